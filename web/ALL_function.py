@@ -4,14 +4,35 @@ import secrets
 import ast
 import csv
 import re
+import math
 import smtplib
 import random
+import time
 from email.mime.text import MIMEText
 from email.header import Header
 from openai import OpenAI
 
 # 添加MySQL支持
 import pymysql
+from db_pool import connect as pool_connect, PoolTimeoutError
+from metrics import time_password_hash
+from exam_scores import (
+    use_score_table,
+    read_exam_scores,
+    write_exam_scores,
+    read_students_exam_scores,
+    replace_exam_rows,
+    upsert_score_cells,
+    delete_student_scores,
+    SCORE_BACKEND
+)
+from snapshot_cache import get_teacher_snapshot, bump_teacher_version
+from exam_summary import record_student_change, record_students_change, invalidate_exam_summary
+from teacher_groups import (read_groups, read_templates, get_teacher_groups, add_exam_to_group,
+                            remove_exam_from_groups, replace_teacher_groups, save_template, delete_template)
+from student_roster import insert_students
+from exam_registry import (register_exam, register_student_exams, unregister_removed_exams, exam_layout,
+                           exam_exists, read_exam_names)
 
 # MySQL数据库配置
 MYSQL_CONFIG = {}
@@ -25,20 +46,18 @@ verification_codes = {}
 
 
 def connect_db(database='smsf'):
-    # 连接到MySQL数据库
+    # 从连接池借出连接（close() 时归还连接池，不会断开）
+    # 在 Flask 请求内返回本请求共享的连接，嵌套调用的 helper 不会再借新连接
     try:
-        config = MYSQL_CONFIG.copy()
-        config['database'] = database
-        conn = pymysql.connect(**config)
-        return conn
+        return pool_connect(database, MYSQL_CONFIG)
+    except PoolTimeoutError as e:
+        print(f"数据库连接池已耗尽: {e}")
+        raise
     except Exception as e:
         print(f"数据库连接失败: {e}")
         # 尝试重新连接
         try:
-            config = MYSQL_CONFIG.copy()
-            config['database'] = database
-            conn = pymysql.connect(**config)
-            return conn
+            return pool_connect(database, MYSQL_CONFIG)
         except Exception as e2:
             print(f"数据库重连失败: {e2}")
             raise e2
@@ -999,7 +1018,8 @@ def hash_password(password: str, salt: str = None) -> tuple[str, str]:
         salt = secrets.token_hex(16)
 
     # 使用SHA-256和盐值对密码进行哈希
-    hashed = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), 100000)
+    with time_password_hash():
+        hashed = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), 100000)
     return hashed.hex(), salt
 
 def verify_password(password: str, hashed: str, salt: str) -> bool:
@@ -1061,35 +1081,23 @@ def create_student_table(conn, teacher_account):
 
 #添加学生用的，参数是：名字，班级，考试字典（正常情况不用填）
 def add_student(conn, teacher_account, name, class_name, exam="{}"):
-    """添加学生记录"""
-    cursor = conn.cursor()
-
-    # 验证teacher_account只包含字母数字和下划线
-    if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
-        raise ValueError("Invalid teacher account name")
-    
-    table_name = f"student_{teacher_account}"
-
-    # 先查询该表中的记录数量，用于生成账号
-    cursor.execute(f'SELECT COUNT(*) FROM `{table_name}`')
-    count = cursor.fetchone()[0]
-    student_id = count + 1
-
-    # 构造账号和密码
-    account = f"{teacher_account}@{student_id}"
-    password = account  # 密码默认为账号
-
-    # # 对密码进行哈希处理
-    # hashed_password, salt = hash_password(password)
-
-    # 插入完整记录
-    cursor.execute(f'''
-        INSERT INTO `{table_name}` (`账号`, `密码`, `名称`, `班级`, `考试`)
-        VALUES (%s, %s, %s, %s, %s)
-    ''', (account, password, name, class_name, exam))
+    """添加学生记录（账号编号从 student_sequences 原子分配，不会重复）"""
+    if not isinstance(exam, str):
+        exam = str(exam)
+    created = insert_students(conn, teacher_account, [(name, class_name, exam)])[0]
+    account = created['account']
+
+    exam_dict = {}
+    if exam and exam != "{}":
+        exam_dict = ast.literal_eval(exam)
+        if SCORE_BACKEND != 'blob':
+            write_exam_scores(conn, account, exam_dict)
+        record_student_change(conn, teacher_account, None, {}, class_name, exam_dict)
+        register_student_exams(conn, teacher_account, class_name, None, exam_dict)
 
     conn.commit()
-    return student_id
+    bump_teacher_version(teacher_account, exam_dict.keys())
+    return created['number']
 
 
 def send_verification_email(email: str) -> str:
@@ -1431,17 +1439,14 @@ def read_class(conn,teacher_account):
     except Exception as e:
         # 如果连接断开或序列号错误，尝试重新连接
         if "Lost connection" in str(e) or "2013" in str(e) or "Packet sequence number wrong" in str(e):
-            fresh_conn = connect_db()
-            cursor = fresh_conn.cursor()
-            if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
-                fresh_conn.close()
-                raise ValueError("Invalid teacher account name")
+            # 在调用方的连接上重连后重试，不另外借连接
+            conn.ping(reconnect=True)
+            cursor = conn.cursor()
             table_name = f"student_{teacher_account}"
             cursor.execute(f'''
                 SELECT DISTINCT `班级` FROM `{table_name}`
             ''')
             result = cursor.fetchall()
-            fresh_conn.close()
             return [row[0] for row in result]
         else:
             raise e
@@ -1474,17 +1479,14 @@ def read_single_class(conn,teacher_account,class_name):
     except Exception as e:
         # 如果连接断开或序列号错误，尝试重新连接
         if "Lost connection" in str(e) or "2013" in str(e) or "Packet sequence number wrong" in str(e):
-            fresh_conn = connect_db()
-            cursor = fresh_conn.cursor()
-            if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
-                fresh_conn.close()
-                raise ValueError("Invalid teacher account name")
+            # 在调用方的连接上重连后重试，不另外借连接
+            conn.ping(reconnect=True)
+            cursor = conn.cursor()
             table_name = f"student_{teacher_account}"
             cursor.execute(f'''
                 SELECT `账号`, `名称`, `考试` FROM `{table_name}` WHERE `班级` = %s
             ''', (class_name,))
             result = cursor.fetchall()
-            fresh_conn.close()
             return [{"账号": row[0],"名称": row[1], "考试": row[2]} for row in result]
         else:
             raise e
@@ -1509,11 +1511,20 @@ def student_class_change(conn,teacher_account,student_id,class_name):
     if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
         raise ValueError("Invalid teacher account name")
     table_name = f"student_{teacher_account}"
+    old_class, exam_dict = _lock_student_exams(conn, teacher_account, student_id)
     cursor.execute(f'''
         UPDATE `{table_name}` SET `班级` = %s WHERE `账号` = %s
     ''', (class_name, student_id))
+    changed = cursor.rowcount > 0
+    # 学生的成绩从原班级的考试汇总移到新班级
+    if exam_dict is None:
+        invalidate_exam_summary(conn, teacher_account)
+    elif old_class is not None:
+        record_student_change(conn, teacher_account, old_class, exam_dict, class_name, exam_dict)
     conn.commit()
-    return cursor.rowcount > 0
+    # 排名等按考试缓存的数据中包含班级，学生参加过的考试都要更新
+    bump_teacher_version(teacher_account, None if exam_dict is None else exam_dict.keys())
+    return changed
 
 
 ##读取学生考试信息，输出字典
@@ -1530,6 +1541,9 @@ def read_student_exam(conn,student_id):
 
     """
     student_parts = student_id.split("@")
+    if use_score_table():
+        # 成绩已迁移到 exam_scores 表，按学生账号走索引读取
+        return read_exam_scores(conn, student_id)
     try:
         cursor = conn.cursor()
         # 验证teacher_account只包含字母数字和下划线
@@ -1548,17 +1562,14 @@ def read_student_exam(conn,student_id):
     except Exception as e:
         # 如果连接断开或序列号错误，尝试重新连接
         if "Lost connection" in str(e) or "2013" in str(e) or "Packet sequence number wrong" in str(e):
-            fresh_conn = connect_db()
-            cursor = fresh_conn.cursor()
-            if not re.match(r'^[a-zA-Z0-9_]+$', student_parts[0]):
-                fresh_conn.close()
-                raise ValueError("Invalid teacher account name")
+            # 在调用方的连接上重连后重试，不另外借连接
+            conn.ping(reconnect=True)
+            cursor = conn.cursor()
             table_name = f"student_{student_parts[0]}"
             cursor.execute(f'''
                 SELECT `考试` FROM `{table_name}` WHERE `账号` = %s
             ''', (student_id,))
             result = cursor.fetchone()
-            fresh_conn.close()
             if result is None or result[0] is None:
                 return {}
             score_dict = ast.literal_eval(result[0])
@@ -1639,16 +1650,8 @@ def update_teacher_group(conn, teacher_account, group_data):
     bool: 更新是否成功
     """
     try:
-        cursor = conn.cursor()
-        # 确保group_data是字符串类型
-        group_str = str(group_data) if group_data is not None else None
-        cursor.execute('''
-            UPDATE `teachers` 
-            SET `分组` = %s 
-            WHERE `账户` = %s
-        ''', (group_str, teacher_account))
-        conn.commit()
-        return cursor.rowcount > 0
+        # 分组保存在 exam_groups / exam_group_members 表中，整体替换
+        return replace_teacher_groups(conn, teacher_account, group_data)
     except Exception as e:
         print(f"更新教师分组时发生错误: {e}")
         return False
@@ -1666,16 +1669,8 @@ def read_teacher_group(conn, teacher_account):
     返回:
     dict: 分组信息
     """
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT `分组` FROM `teachers` 
-        WHERE `账户` = %s
-    ''', (teacher_account,))
-    result = cursor.fetchone()
-    if result and result[0]:
-        return ast.literal_eval(result[0])
-    else:
-        return {}
+    # 按教师缓存，写操作后失效
+    return read_groups(conn, teacher_account)
 
 
 ##返回单个学生参加过的考试列表，参数为该学生的成绩字典
@@ -1698,39 +1693,9 @@ def not_group_exam(conn, teacher_account):
     返回:
     list: 未分组的考试信息列表
     """
-    # 先读取老师账户下的所有班级
-    class_list = read_class(conn, teacher_account)
-    # 创建一个空字典存储结果
-    dicct = {}
-    # 遍历所有班级
-    for class_name in class_list:
-        student_list = read_single_class(conn, teacher_account, class_name)
-        for student in student_list:
-            dicct[student["名称"]] = student["账号"]
-
-    created_exam_set = set()
-    for i in dicct.values():
-        dict = read_student_exam(conn, i)
-        for i in student_joined_exam_list(dict):
-            created_exam_set.add(i)
-
-
-    already_group_dict = read_teacher_group(conn, teacher_account)
-    result = []
-    noww_have = []
-    if already_group_dict != {}:
-        for i in already_group_dict.values():
-            for aa in i:
-               noww_have.append(aa)
-        for end in created_exam_set:
-            if end not in noww_have:
-                result.append(end)
-
-    else:
-        for a in created_exam_set:
-            result.append(a)
-
-    return result
+    # 考试登记表中的考试（按创建顺序）减去已分组的考试
+    grouped = get_teacher_groups(conn, teacher_account).grouped_exams()
+    return [exam_name for exam_name in read_exam_names(conn, teacher_account) if exam_name not in grouped]
 
 
 ##删除学生信息，输入学生ID
@@ -1751,11 +1716,21 @@ def remove_student(conn,student_id):
     if not re.match(r'^[a-zA-Z0-9_]+$', result[0]):
         raise ValueError("Invalid teacher account name")
     table_name = f"student_{result[0]}"
+    old_class, exam_dict = _lock_student_exams(conn, result[0], student_id)
     cursor.execute(f'''
         DELETE FROM `{table_name}` WHERE `账号` = %s
     ''', (student_id,))
+    removed = cursor.rowcount > 0
+    if SCORE_BACKEND != 'blob':
+        delete_student_scores(conn, student_id)
+    if exam_dict is None:
+        invalidate_exam_summary(conn, result[0])
+    elif old_class is not None:
+        record_student_change(conn, result[0], old_class, exam_dict, None, None)
+        unregister_removed_exams(conn, result[0], exam_dict, None)
     conn.commit()
-    return cursor.rowcount > 0
+    bump_teacher_version(result[0], None if exam_dict is None else exam_dict.keys())
+    return removed
 
 
 #修改学生考试成绩字典，参数（原字典，考试名， 学科名，分数）
@@ -1785,6 +1760,79 @@ def change_student_score(score_dict, exam_name, subject, score):
     return result
 
 
+def _lock_student_exams(conn, teacher_account, student_id):
+    """
+    锁住学生行并读取修改前的班级和考试字典
+
+    返回:
+    tuple: (班级, 考试字典)；学生不存在时为 (None, {})，考试数据无法解析时考试字典为 None
+    """
+    cursor = conn.cursor()
+    table_name = f"student_{teacher_account}"
+    cursor.execute(f'''
+        SELECT `班级`, `考试` FROM `{table_name}` WHERE `账号` = %s FOR UPDATE
+    ''', (student_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None, {}
+    if use_score_table():
+        return row[0], read_exam_scores(conn, student_id)
+    if not row[1]:
+        return row[0], {}
+    try:
+        return row[0], ast.literal_eval(row[1])
+    except (ValueError, SyntaxError) as e:
+        print(f"⚠️  学生 {student_id} 的考试数据无法解析: {e}")
+        return row[0], None
+
+
+def _changed_exams(old_dict, new_dict):
+    """两个考试字典中内容不同的考试名"""
+    return {exam_name for exam_name in set(old_dict) | set(new_dict)
+            if old_dict.get(exam_name) != new_dict.get(exam_name)}
+
+
+def _persist_student_exams(conn, student_id, score_dict):
+    """
+    写入学生的考试字典并同步考试汇总（不提交事务）
+
+    按配置的存储方式写 `考试` 字段和/或 exam_scores 表，学生行先加锁，
+    与迁移工具和汇总重建的加锁顺序一致。
+
+    返回:
+    tuple: (学生是否存在, 成绩发生变化的考试名集合)；旧数据无法解析时集合为 None，表示无法确定
+    """
+    teacher_account = student_id.split('@')[0]
+    # 验证teacher_account只包含字母数字和下划线
+    if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
+        raise ValueError("Invalid teacher account name")
+    table_name = f"student_{teacher_account}"
+
+    old_class, old_dict = _lock_student_exams(conn, teacher_account, student_id)
+    if old_class is None:
+        return False, set()
+
+    if not use_score_table():
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            UPDATE `{table_name}` 
+            SET `考试` = %s 
+            WHERE `账号` = %s
+        ''', (str(score_dict), student_id))
+    # 迁移期间（dual）和迁移完成后（table）写 exam_scores 表
+    if SCORE_BACKEND != 'blob':
+        write_exam_scores(conn, student_id, score_dict)
+
+    if old_dict is None:
+        invalidate_exam_summary(conn, teacher_account)
+        register_student_exams(conn, teacher_account, old_class, None, score_dict)
+        return True, None
+    record_student_change(conn, teacher_account, old_class, old_dict, old_class, score_dict)
+    register_student_exams(conn, teacher_account, old_class, old_dict, score_dict)
+    unregister_removed_exams(conn, teacher_account, old_dict, score_dict)
+    return True, _changed_exams(old_dict, score_dict)
+
+
 #更新学生考试成绩，覆盖数据库
 def update_student_score(conn, student_id,score_dict):
     """
@@ -1799,24 +1847,316 @@ def update_student_score(conn, student_id,score_dict):
     bool: 更新是否成功
     """
     try:
-        cursor = conn.cursor()
-        student_parts = student_id.split('@')
-        # 验证teacher_account只包含字母数字和下划线
-        if not re.match(r'^[a-zA-Z0-9_]+$', student_parts[0]):
-            raise ValueError("Invalid teacher account name")
-        table_name = f"student_{student_parts[0]}"
-        cursor.execute(f'''
-            UPDATE `{table_name}` 
-            SET `考试` = %s 
-            WHERE `账号` = %s
-        ''', (str(score_dict), student_id))
+        updated, changed = _persist_student_exams(conn, student_id, score_dict)
         conn.commit()
-        return cursor.rowcount > 0
+        bump_teacher_version(student_id.split('@')[0], changed)
+        return updated
     except Exception as e:
         print(f"更新学生成绩时发生错误: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
         return False
 
 
+BULK_UPDATE_CHUNK = 500     # 批量更新 `考试` 字段时每条 UPDATE 包含的学生数
+MAX_SCORE_EDITS = 5000      # 一次批量改分最多包含的成绩格数
+
+
+def _write_exam_blobs(conn, teacher_account, changes):
+    """
+    用 UPDATE ... CASE 分批写入多个学生的 `考试` 字段（pymysql 的 executemany 只会合并 INSERT/REPLACE）
+
+    返回:
+    int: 执行的 UPDATE 语句数
+    """
+    table_name = f"student_{teacher_account}"
+    cursor = conn.cursor()
+    statements = 0
+    for i in range(0, len(changes), BULK_UPDATE_CHUNK):
+        chunk = changes[i:i + BULK_UPDATE_CHUNK]
+        cases = ' '.join(['WHEN %s THEN %s'] * len(chunk))
+        placeholders = ', '.join(['%s'] * len(chunk))
+        params = [value for change in chunk for value in (change[0], str(change[4]))]
+        cursor.execute(f'''
+            UPDATE `{table_name}` SET `考试` = CASE `账号` {cases} END
+            WHERE `账号` IN ({placeholders})
+        ''', (*params, *[change[0] for change in chunk]))
+        statements += 1
+    return statements
+
+
+def persist_exam_changes(conn, teacher_account, exam_name, changes):
+    """
+    批量写入多个学生在同一次考试中的成绩变化（不提交事务，学生行须已加锁）
+
+    `考试` 字段用 UPDATE ... CASE 分批写入（pymysql 的 executemany 只会合并 INSERT/REPLACE），
+    exam_scores 表中该考试的成绩整体替换，考试汇总的增量合并为一次写入。
+
+    参数:
+    changes: [(学生账号, 原班级, 原考试字典, 新班级, 新考试字典), ...]，新增学生的原班级为 None
+
+    返回:
+    dict: score_rows（写入 exam_scores 的成绩条数）, statements（执行的写语句数）
+    """
+    stats = {'score_rows': 0, 'statements': 0}
+    if not changes:
+        return stats
+
+    if not use_score_table():
+        stats['statements'] += _write_exam_blobs(conn, teacher_account, changes)
+    # 迁移期间（dual）和迁移完成后（table）写 exam_scores 表
+    if SCORE_BACKEND != 'blob':
+        stats['score_rows'] = replace_exam_rows(
+            conn, teacher_account, exam_name, {change[0]: change[4].get(exam_name, {}) for change in changes})
+        stats['statements'] += 2
+    record_students_change(conn, teacher_account, [change[1:] for change in changes])
+
+    subjects = {}
+    for change in changes:
+        subjects.update(exam_layout(change[4].get(exam_name)))
+    joined = sum(1 for change in changes if exam_name not in (change[2] or {}))
+    register_exam(conn, teacher_account, exam_name, [change[3] for change in changes], subjects, joined=joined)
+    return stats
+
+
+def bulk_add_exam(conn, teacher_account, class_name, exam_name, subject_info):
+    """
+    为一个班级的全部学生批量创建考试（一个事务）
+
+    一次读出班级全部学生并加锁，在内存中生成新的考试字典，
+    `考试` 字段用 UPDATE ... CASE 分批写入，exam_scores 表用一次 executemany 写入，
+    考试汇总的增量合并为一次写入，最后提交一次。
+
+    参数:
+    conn: 数据库连接对象
+    teacher_account: 教师账户
+    class_name: 参与的班级
+    exam_name: 考试名称
+    subject_info: 考试科目信息 {学科：满分}，创建后默认 0 分
+
+    返回:
+    dict: success, students（写入的学生数）, skipped（考试数据无法解析而跳过的学生数）,
+          score_rows（写入 exam_scores 的成绩条数）, statements（执行的写语句数）,
+          read_ms, write_ms, elapsed_ms
+    """
+    # 验证teacher_account只包含字母数字和下划线
+    if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
+        raise ValueError("Invalid teacher account name")
+    table_name = f"student_{teacher_account}"
+    new_exam = {subject: [0, full_score] for subject, full_score in subject_info.items()}
+    result = {'success': False, 'students': 0, 'skipped': 0, 'score_rows': 0, 'statements': 0,
+              'read_ms': 0.0, 'write_ms': 0.0, 'elapsed_ms': 0.0}
+
+    started = time.perf_counter()
+    try:
+        cursor = conn.cursor()
+        # 按序号顺序锁住班级的全部学生行，与单个学生写入和迁移工具的加锁顺序一致
+        cursor.execute(f'''
+            SELECT `账号`, `考试` FROM `{table_name}` WHERE `班级` = %s ORDER BY `序号` FOR UPDATE
+        ''', (class_name,))
+        rows = cursor.fetchall()
+        if use_score_table():
+            old_dicts = read_students_exam_scores(conn, [row[0] for row in rows])
+        else:
+            old_dicts = {}
+            for account, blob in rows:
+                try:
+                    old_dicts[account] = ast.literal_eval(blob) if blob else {}
+                except (ValueError, SyntaxError) as e:
+                    print(f"⚠️  学生 {account} 的考试数据无法解析，已跳过: {e}")
+                    result['skipped'] += 1
+
+        changes = []
+        for account, _ in rows:
+            if account not in old_dicts:
+                continue
+            score_dict = dict(old_dicts[account])
+            score_dict[exam_name] = {subject: list(value) for subject, value in new_exam.items()}
+            changes.append((account, class_name, old_dicts[account], class_name, score_dict))
+        read_done = time.perf_counter()
+
+        result.update(persist_exam_changes(conn, teacher_account, exam_name, changes))
+        conn.commit()
+        bump_teacher_version(teacher_account, [exam_name])
+
+        finished = time.perf_counter()
+        result.update({
+            'success': True,
+            'students': len(changes),
+            'read_ms': round((read_done - started) * 1000, 2),
+            'write_ms': round((finished - read_done) * 1000, 2),
+            'elapsed_ms': round((finished - started) * 1000, 2)
+        })
+        print(f"✅ 考试 {exam_name} 已为班级 {class_name} 的 {result['students']} 名学生创建，"
+              f"耗时 {result['elapsed_ms']} ms")
+    except Exception as e:
+        print(f"批量创建考试时发生错误: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        result['message'] = str(e)
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def _edit_score(value):
+    """批量改分时的分数：数字或数字字符串，整数值保存为 int；无效时返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        try:
+            value = float(value.strip())
+        except ValueError:
+            return None
+    # nan / inf 写入 `考试` 字段后无法用 literal_eval 读回
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value if isinstance(value, (int, float)) else None
+
+
+def _exam_total(exam_data):
+    """考试总分和满分（跳过 total 字段和非数字成绩）"""
+    total = 0
+    full = 0
+    for subject, value in exam_data.items():
+        if subject == "total":  # 跳过total字段
+            continue
+        score = _edit_score(value[0])
+        if score is not None:
+            total += score
+        max_score = _edit_score(value[1]) if len(value) > 1 else None
+        if max_score is not None:
+            full += max_score
+    return total, full
+
+
+def apply_score_edits(conn, teacher_account, edits, class_name=None):
+    """
+    批量修改成绩（一个事务）
+
+    一次读出并锁住涉及的全部学生，在内存中修改考试字典，`考试` 字段用 UPDATE ... CASE 写入，
+    exam_scores 表用一条多行 INSERT ... ON DUPLICATE KEY UPDATE 写入，最后提交一次。
+    只能修改已有的考试科目（满分不变）；任何一格无效时整批不写入。
+
+    参数:
+    conn: 数据库连接对象
+    teacher_account: 教师账户
+    edits: [(学生账号, 考试名称, 科目, 分数), ...]，同一格出现多次时以最后一次为准
+    class_name: 只允许修改该班级的学生（可选）
+
+    返回:
+    dict: success, updated（修改的成绩格数）, unchanged, students（写入的学生数）,
+          totals（[{studentAccount, examName, total, fullScore}]，修改后的考试总分）,
+          errors（[{index, studentAccount, examName, subject, message}]）, statements, elapsed_ms
+    """
+    # 验证teacher_account只包含字母数字和下划线
+    if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
+        raise ValueError("Invalid teacher account name")
+    table_name = f"student_{teacher_account}"
+    result = {'success': False, 'updated': 0, 'unchanged': 0, 'students': 0, 'totals': [],
+              'errors': [], 'statements': 0, 'elapsed_ms': 0.0}
+    started = time.perf_counter()
+
+    def error(index, account, exam_name, subject, message):
+        result['errors'].append({'index': index, 'studentAccount': account, 'examName': exam_name,
+                                 'subject': subject, 'message': message})
+
+    cells = {}      # (学生账号, 考试, 科目) -> (序号, 分数)
+    for index, (account, exam_name, subject, value) in enumerate(edits):
+        score = _edit_score(value)
+        if score is None:
+            error(index, account, exam_name, subject, '分数无效')
+            continue
+        cells[(account, exam_name, subject)] = (index, score)
+    accounts = list(dict.fromkeys(account for account, _, _ in cells))
+
+    try:
+        rows = []
+        if accounts:
+            cursor = conn.cursor()
+            placeholders = ', '.join(['%s'] * len(accounts))
+            # 按序号顺序锁住涉及的学生行，与单个学生写入和批量创建考试的加锁顺序一致
+            cursor.execute(f'''
+                SELECT `账号`, `班级`, `考试` FROM `{table_name}` WHERE `账号` IN ({placeholders})
+                ORDER BY `序号` FOR UPDATE
+            ''', accounts)
+            rows = cursor.fetchall()
+        classes = {account: student_class for account, student_class, _ in rows}
+        if use_score_table():
+            old_dicts = read_students_exam_scores(conn, list(classes))
+        else:
+            old_dicts = {}
+            for account, _, blob in rows:
+                try:
+                    old_dicts[account] = ast.literal_eval(blob) if blob else {}
+                except (ValueError, SyntaxError):
+                    old_dicts[account] = None
+
+        new_dicts = {}
+        written_cells = []
+        for (account, exam_name, subject), (index, score) in cells.items():
+            if account not in classes or (class_name is not None and classes[account] != class_name):
+                error(index, account, exam_name, subject, '学生不存在')
+                continue
+            if old_dicts.get(account) is None:
+                error(index, account, exam_name, subject, '该学生已有的考试数据无法解析')
+                continue
+            old_value = old_dicts[account].get(exam_name, {}).get(subject)
+            if old_value is None:
+                error(index, account, exam_name, subject, '该学生没有这次考试的这个科目')
+                continue
+            if old_value[0] == score:
+                result['unchanged'] += 1
+                continue
+            new_dict = new_dicts.setdefault(account, {name: dict(exam) for name, exam in old_dicts[account].items()})
+            new_dict[exam_name][subject] = [score, old_value[1]]
+            written_cells.append((account, exam_name, subject, score, old_value[1]))
+
+        if result['errors']:
+            conn.rollback()
+            result['message'] = f"{len(result['errors'])} 个成绩无效，未保存任何修改"
+            return result
+
+        changes = [(account, classes[account], old_dicts[account], classes[account], new_dict)
+                   for account, new_dict in new_dicts.items()]
+        if changes and not use_score_table():
+            result['statements'] += _write_exam_blobs(conn, teacher_account, changes)
+        # 迁移期间（dual）和迁移完成后（table）写 exam_scores 表
+        if written_cells and SCORE_BACKEND != 'blob':
+            upsert_score_cells(conn, teacher_account, written_cells)
+            result['statements'] += 1
+        record_students_change(conn, teacher_account, [change[1:] for change in changes])
+        conn.commit()
+        changed_exams = {cell[1] for cell in written_cells}
+        if changed_exams:
+            bump_teacher_version(teacher_account, changed_exams)
+
+        for account, exam_name in dict.fromkeys((account, exam_name) for account, exam_name, _ in cells):
+            total, full = _exam_total(new_dicts.get(account, old_dicts[account])[exam_name])
+            result['totals'].append({'studentAccount': account, 'examName': exam_name,
+                                     'total': total, 'fullScore': full})
+        result.update({
+            'success': True,
+            'updated': len(written_cells),
+            'students': len(changes)
+        })
+    except Exception as e:
+        print(f"批量修改成绩时发生错误: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        result['message'] = str(e)
+    finally:
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
 #创建新考试，参数（教师账号， 参与班级， 考试名称， 科目信息），其中科目信息为字典，格式{科目：满分}， 创建完后默认0分
 def add_new_exam(conn, teacher_account, join_class, exam_name, subject_info):
     """
@@ -1833,20 +2173,7 @@ def add_new_exam(conn, teacher_account, join_class, exam_name, subject_info):
     返回:
     bool: 添加是否成功
     """
-    # 先读取老师账户符合参考班级下的所有学生账号
-    stu_lis =[]
-    student_a = read_single_class(conn, teacher_account, join_class)
-    for i in student_a:
-        stu_lis.append(i["账号"])
-    for i in stu_lis:
-
-        score_d = read_student_exam(conn, i)
-        new_e_d ={}
-        for k in subject_info.keys():
-            fenshu = [0, subject_info[k]]
-            new_e_d[k] = fenshu
-        score_d[exam_name] = new_e_d
-        update_student_score(conn, i, score_d)
+    return bulk_add_exam(conn, teacher_account, join_class, exam_name, subject_info)['success']
 
 
 def subject_compare_rate(conn, student_id, exam_name):
@@ -1881,36 +2208,11 @@ def export_student_account_and_password_to_csv(conn, teacher_account, class_name
     bool: 导出是否成功
     """
     try:
-        
-        # 获取指定班级的学生信息
-        student_list = read_single_class(conn, teacher_account, class_name)
-        
-        # 准备CSV文件数据
-        csv_data = []
-        csv_data.append(['姓名', '账号', '密码'])  # 表头
-        
-        # 获取每个学生的账号和密码
-        # 验证teacher_account只包含字母数字和下划线
-        if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
-            raise ValueError("Invalid teacher account name")
-        table_name = f"student_{teacher_account}"
-        cursor = conn.cursor()
-        
-        for student in student_list:
-            student_account = student["账号"]
-            # 查询该学生的密码
-            cursor.execute(f'''
-                SELECT `密码` FROM `{table_name}` WHERE `账号` = %s
-            ''', (student_account,))
-            result = cursor.fetchone()
-            if result:
-                password = result[0]
-                csv_data.append([student["名称"], student_account, password])
-        
-        # 写入CSV文件
-        with open(file_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerows(csv_data)
+        # 一条查询流式读取姓名、账号和密码，逐批写入文件（BOM 由生成器输出）
+        from roster_export import stream_roster_csv
+        with open(file_path, 'w', newline='', encoding='utf-8') as csvfile:
+            for chunk in stream_roster_csv(conn, teacher_account, class_name):
+                csvfile.write(chunk)
         
         return True
     except Exception as e:
@@ -1931,17 +2233,8 @@ def add_new_exam_group(conn, teacher_account, exam_name, group):
     返回:
     bool: 添加是否成功
     """
-    now_group = read_teacher_group(conn, teacher_account)
-    if now_group != {}:
-        try:
-            now_group[group].append(exam_name)
-        except:
-            now_group[group] = [exam_name]
-
-
-        update_teacher_group(conn, teacher_account, now_group)
-    else:
-        update_teacher_group(conn, teacher_account, {group: [exam_name]})
+    # 一条语句放入分组（分组不存在时先创建）
+    return add_exam_to_group(conn, teacher_account, exam_name, group)
 
 
 #AI分析
@@ -2014,30 +2307,25 @@ def exam_group_change(conn, teacher_account, exam_name, group):
     返回:
     none
     """
-    now_group = read_teacher_group(conn, teacher_account)
-    for o in now_group.keys():
-        if exam_name in now_group[o]:
-            now_group[o].remove(exam_name)
-    update_teacher_group(conn, teacher_account, now_group)
-    add_new_exam_group(conn, teacher_account, exam_name, group)
+    # 每次考试只属于一个分组，放入新分组即从原分组移出
+    add_exam_to_group(conn, teacher_account, exam_name, group)
 
 
 def single_exam_score_show(conn, teacher_account, exam_name):
+    """
+    读取一次考试全部学生的成绩
 
-    student_listt = []
-    class_tea_con = read_class(conn, teacher_account)
-    #读取参加考试的学生账号
-    for i in class_tea_con:
-        stu_l = read_single_class(conn, teacher_account, i)
-        for j in stu_l:
-            dicccct = read_student_exam(conn, j["账号"])
-            if exam_name in dicccct.keys():
-                student_listt.append(j["账号"])
-
+    返回:
+    dict: {学生姓名: {科目: [分数, 满分]}}
+    """
+    # 考试不存在时不需要读取学生
+    if not exam_exists(conn, teacher_account, exam_name):
+        return {}
 
+    snapshot = get_teacher_snapshot(conn, teacher_account)
     scoore_dic = {}
-    for i in student_listt:
-        scoore_dic[read_student(conn, i)[0]] = read_student_exam(conn, i)[exam_name]
+    for account, exam_data in snapshot.exam_scores(exam_name).items():
+        scoore_dic[snapshot.by_student[account]["名称"]] = exam_data
     return scoore_dic
 
 
@@ -2083,16 +2371,8 @@ def read_teacher_model(conn, teacher_account):
     返回:
     dict: 模板信息
     """
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT `模板` FROM `teachers` 
-        WHERE `账户` = %s
-    ''', (teacher_account,))
-    result = cursor.fetchone()
-    if result and result[0]:
-        return ast.literal_eval(result[0])
-    else:
-        return {}
+    # 按教师缓存，写操作后失效
+    return read_templates(conn, teacher_account)
 
 
 def create_new_model_exam(conn, teacher_account, model_name,exam_subjects):
@@ -2102,17 +2382,8 @@ def create_new_model_exam(conn, teacher_account, model_name,exam_subjects):
         {"model_1":{"subject_1":"满分", "subject_2":"", ....},....}
 
     """
-    cursor = conn.cursor()
-    model_info = read_teacher_model(conn, teacher_account)
-    model_info[model_name] = exam_subjects
     try:
-        cursor.execute('''
-                   UPDATE `teachers` 
-                   SET `模板` = %s 
-                   WHERE `账户` = %s
-               ''', (str(model_info), teacher_account))
-        conn.commit()
-        return cursor.rowcount > 0
+        return save_template(conn, teacher_account, model_name, exam_subjects)
     except Exception as e:
         print(f"更新教师模板时发生错误: {e}")
         return False
@@ -2122,21 +2393,11 @@ def delete_model_exam(conn, teacher_account, model_name):
     """
     删除教师模板
     """
-    cursor = conn.cursor()
-    model_info = read_teacher_model(conn, teacher_account)
-    if model_name in model_info:
-        del model_info[model_name]
-        try:
-            cursor.execute('''
-                   UPDATE `teachers` 
-                   SET `模板` = %s 
-                   WHERE `账户` = %s
-               ''', (str(model_info), teacher_account))
-            conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            print(f"更新教师模板时发生错误: {e}")
-            return False
+    try:
+        return delete_template(conn, teacher_account, model_name)
+    except Exception as e:
+        print(f"更新教师模板时发生错误: {e}")
+        return False
 
 
 def cre_new_exam_bymodel(conn, teacher_account, class_name, exam_name, model_name):
@@ -2159,22 +2420,9 @@ def cre_new_exam_bymodel(conn, teacher_account, class_name, exam_name, model_nam
             print(f"模板 {model_name} 不存在")
             return False
         
-        stu = read_single_class(conn, teacher_account, class_name)
         moddel = model_info[model_name]
-
-        all_success = True
-        for i in stu:
-            student_id = i["账号"]
-            data = read_student_exam(conn, student_id)
-            data[exam_name] = {}
-            for subject_name, max_score in moddel.items():
-                data[exam_name][subject_name] = [0, int(max_score)]
-            
-            success = update_student_score(conn, student_id, data)
-            if not success:
-                all_success = False
-                
-        return all_success
+        subject_info = {subject_name: int(max_score) for subject_name, max_score in moddel.items()}
+        return bulk_add_exam(conn, teacher_account, class_name, exam_name, subject_info)['success']
     except Exception as e:
         print(f"使用模板创建考试时发生错误: {e}")
         return False
@@ -2192,13 +2440,7 @@ def exam_exist_cheek(conn, teacher_account, exam_name):
     返回:
     bool: 考试是否存在
     """
-    class_list = read_class(conn, teacher_account)
-    for i in class_list:
-        stu_data = read_single_class(conn, teacher_account, i)
-        for j in stu_data:
-            if exam_name in read_student_exam(conn, j["账号"]):
-                return True
-    return False
+    return exam_exists(conn, teacher_account, exam_name)
 
 
 def refreash_exam_groupp(conn, teacher_account, exam_name):
@@ -2213,11 +2455,7 @@ def refreash_exam_groupp(conn, teacher_account, exam_name):
     返回:
     无返回值
     """
-    llist = read_teacher_group(conn, teacher_account)
-    for i in llist.keys():
-        if exam_name in llist[i]:
-            llist[i].remove(exam_name)  # 从列表中移除元素，而不是从字典中删除键
-    update_teacher_group(conn, teacher_account, llist)
+    remove_exam_from_groups(conn, teacher_account, exam_name)
 
 
 def account_cheek(conn, account, password):
@@ -2487,7 +2725,7 @@ def read_csv_and_update_scores(csv_file_path, conn, student_id, exam_name, full_
 
 def csv_updata(conn, csv_file_path, class_name, teacher_account, exam_name, full_scores=None):
     """
-    从CSV文件更新学生考试数据
+    从CSV文件更新学生考试数据（单次读取 CSV，所有修改在一个事务中批量写入）
     
     参数:
     conn: 数据库连接对象
@@ -2496,54 +2734,16 @@ def csv_updata(conn, csv_file_path, class_name, teacher_account, exam_name, full
     teacher_account: 教师账号
     exam_name: 考试名称
     full_scores: 满分字典，格式为{"科目1": 满分值, ...}
-    """
-    import csv
 
-    # 读取CSV文件，获取考生名单
-    with open(csv_file_path, 'r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile)
-        headers = reader.fieldnames
-
-        # 查找包含学生姓名的列（可能是"姓名"、"学生姓名"等）
-        student_col = None
-        for col in headers:
-            if col in ["姓名", "学生姓名", "Name", "student_name"]:
-                student_col = col
-                break
-
-        if not student_col:
-            print("错误：CSV文件中未找到学生姓名列")
-            return False
-
-        # 读取该班级下所有学生信息
-        class_students = read_single_class(conn, teacher_account, class_name)
-        # 创建学生姓名到ID的映射
-        student_name_to_id = {}
-        for student in class_students:
-            student_name = read_student(conn, student["账号"])[0]  # 获取学生姓名
-            student_name_to_id[student_name] = student["账号"]
-
-        # 遍历CSV中的每个考生
-        for row in reader:
-            csv_student_name = row[student_col]
-
-            if csv_student_name in student_name_to_id:
-                # 学生已存在，更新其考试数据
-                student_id = student_name_to_id[csv_student_name]
-                print(f"正在更新学生 {csv_student_name} 的考试数据...")
-                read_csv_and_update_scores(csv_file_path, conn, student_id, exam_name, full_scores)
-            else:
-                # 学生不存在，先创建学生
-                print(f"学生 {csv_student_name} 不存在，正在创建...")
-                student_id = add_student(conn, teacher_account, csv_student_name, class_name)
-                new_student_id = f"{teacher_account}@{student_id}"
-                print(f"已创建学生 {csv_student_name}，ID: {new_student_id}")
-
-                # 更新该学生的考试数据
-                read_csv_and_update_scores(csv_file_path, conn, new_student_id, exam_name, full_scores)
+    返回:
+    bool: 导入是否成功（逐行的错误见 score_import.import_scores_csv 返回的结果）
+    """
+    from score_import import import_scores_csv
 
-    print("CSV数据更新完成")
-    return True
+    result = import_scores_csv(conn, csv_file_path, class_name, teacher_account, exam_name, full_scores)
+    for error in result['errors']:
+        print(f"第 {error['line']} 行（{error['name']}）: {error['message']}")
+    return result['success']
 
 
 def detect_csv_subjects(csv_file_path):
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+考试统计性能测试 - 比较逐项遍历与 NumPy 向量化两种实现
+
+生成一个 5000 名学生的模拟学校（不需要数据库），对每个班级计算班级详情、
+对每次考试计算考试详情、对抽样学生计算学生详情，并计算全部学生的综合成绩和方差。
+
+用法:
+    python bench_exam_analytics.py
+    python bench_exam_analytics.py --students 5000 --classes 50 --exams 12 --rounds 3
+"""
+import argparse
+import random
+import sys
+import time
+
+import exam_analytics
+from exam_analytics import (NUMPY_ENABLED, class_detail, exam_detail, student_detail,
+                            subject_calculate_all, get_score_tensor)
+from teacher_snapshot import TeacherSnapshot
+
+
+SUBJECTS = ['语文', '数学', '英语', '物理', '化学', '生物', '历史', '地理', '政治']
+
+
+def build_school(students: int, classes: int, exams: int, seed: int = 42) -> TeacherSnapshot:
+    """生成模拟学校的教师快照（约 5% 缺考，部分考试只考主科）"""
+    rng = random.Random(seed)
+    exam_subjects = {}
+    for i in range(exams):
+        subjects = SUBJECTS if i % 3 else SUBJECTS[:3]
+        exam_subjects[f"第{i + 1}次考试"] = subjects
+
+    rows = []
+    for i in range(students):
+        score_dict = {}
+        for exam_name, subjects in exam_subjects.items():
+            if rng.random() < 0.05:
+                continue
+            score_dict[exam_name] = {
+                subject: [rng.randint(20, 150 if subject in SUBJECTS[:3] else 100),
+                          150 if subject in SUBJECTS[:3] else 100]
+                for subject in subjects
+            }
+        rows.append({"账号": f"bench@{i + 1}", "名称": f"学生{i + 1}",
+                     "班级": f"{i % classes + 1}班", "考试": score_dict})
+    return TeacherSnapshot('bench', rows)
+
+
+def run_all(snapshot, sample, use_numpy):
+    """计算三个详情接口的全部统计和 subject_calculate"""
+    results = []
+    for class_name in snapshot.classes:
+        results.append(class_detail(snapshot, class_name, use_numpy=use_numpy))
+    for exam_name in snapshot.exam_names:
+        results.append(exam_detail(snapshot, exam_name, use_numpy=use_numpy))
+    for account in sample:
+        results.append(student_detail(snapshot, account, use_numpy=use_numpy))
+    results.append(subject_calculate_all(snapshot, use_numpy=use_numpy))
+    return results
+
+
+def timed(func, rounds):
+    """返回最快一轮的耗时（秒）和结果"""
+    best = None
+    result = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def same(a, b, tol=1e-6):
+    """比较两种实现的结果（浮点数允许误差）"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k], tol) for k in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(same(x, y, tol) for x, y in zip(a, b))
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(a - b) <= tol * max(1, abs(a), abs(b))
+    return a == b
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='考试统计性能测试')
+    parser.add_argument('--students', type=int, default=5000, help='学生数')
+    parser.add_argument('--classes', type=int, default=50, help='班级数')
+    parser.add_argument('--exams', type=int, default=12, help='考试次数')
+    parser.add_argument('--sample', type=int, default=200, help='计算学生详情的学生数')
+    parser.add_argument('--rounds', type=int, default=3, help='每种实现运行的轮数（取最快一轮）')
+    args = parser.parse_args(argv)
+
+    if not NUMPY_ENABLED:
+        print("❌ 未安装 numpy，无法比较")
+        return 1
+
+    snapshot = build_school(args.students, args.classes, args.exams)
+    sample = random.Random(7).sample([s["账号"] for s in snapshot.students], min(args.sample, args.students))
+    cells = sum(len(exam_data) for s in snapshot.students for exam_data in s["考试"].values())
+    print("=" * 50)
+    print(f"学生 {args.students} 个，班级 {args.classes} 个，考试 {args.exams} 次，成绩 {cells} 条")
+    print("=" * 50)
+
+    loops_time, loops_result = timed(lambda: run_all(snapshot, sample, False), args.rounds)
+
+    def cold():
+        exam_analytics._tensors.clear()
+        return run_all(snapshot, sample, True)
+    cold_time, numpy_result = timed(cold, args.rounds)
+
+    build_time, _ = timed(lambda: (exam_analytics._tensors.clear(), get_score_tensor(snapshot)), args.rounds)
+    warm_time, _ = timed(lambda: run_all(snapshot, sample, True), args.rounds)
+
+    print(f"逐项遍历:              {loops_time * 1000:8.1f} ms")
+    print(f"NumPy（含构建数组）:   {cold_time * 1000:8.1f} ms  ({loops_time / cold_time:.1f}x)")
+    print(f"  其中构建数组:        {build_time * 1000:8.1f} ms")
+    print(f"NumPy（数组已缓存）:   {warm_time * 1000:8.1f} ms  ({loops_time / warm_time:.1f}x)")
+
+    if same(loops_result, numpy_result):
+        print("✅ 两种实现结果一致")
+        return 0
+    print("❌ 两种实现结果不一致")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+会话模式性能测试 - 比较 Redis 会话、Redis 会话 + 进程内缓存、签名令牌三种模式的校验开销
+
+每种模式创建一批会话，随机抽取会话反复校验（与每个 API 请求的鉴权相同），
+最后检查退出登录和强制下线在各模式下是否生效，并删除测试数据。
+需要可用的 Redis（使用 redis_manager 中的配置，或通过参数指定）；Redis 不可用时只测试签名令牌。
+
+用法:
+    python bench_session_modes.py
+    python bench_session_modes.py --host 127.0.0.1 --sessions 1000 --requests 20000
+"""
+import argparse
+import random
+import sys
+import time
+
+from redis_manager import redis_session_manager
+import session_tokens
+
+
+BENCH_ACCOUNT = 'bench_session'
+
+
+def run_validations(manager, session_ids, requests: int, seed: int = 7):
+    """随机校验 requests 次，返回耗时（秒）和校验失败的次数"""
+    rng = random.Random(seed)
+    picks = [rng.choice(session_ids) for _ in range(requests)]
+    failed = 0
+    started = time.perf_counter()
+    for session_id in picks:
+        if manager.validate_and_touch(session_id) is None:
+            failed += 1
+    return time.perf_counter() - started, failed
+
+
+def create_sessions(manager, mode: str, count: int):
+    manager.session_mode = mode
+    return [manager.create_session(f"{BENCH_ACCOUNT}_{mode}_{i % 50}", 1, 'teacher') for i in range(count)]
+
+
+def report(name: str, elapsed: float, requests: int, failed: int, baseline: float = None):
+    per_request = elapsed / requests * 1e6
+    line = f"{name:<22}{per_request:9.1f} µs/次  {requests / elapsed:10.0f} 次/秒"
+    if baseline:
+        line += f"  ({baseline / elapsed:.1f}x)"
+    if failed:
+        line += f"  ❌ {failed} 次校验失败"
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='会话模式性能测试')
+    parser.add_argument('--host', help='Redis 地址（默认使用 redis_manager 中的配置）')
+    parser.add_argument('--port', type=int, help='Redis 端口')
+    parser.add_argument('--password', help='Redis 密码')
+    parser.add_argument('--sessions', type=int, default=1000, help='每种模式创建的会话数')
+    parser.add_argument('--requests', type=int, default=20000, help='每种模式的校验次数')
+    args = parser.parse_args(argv)
+
+    manager = redis_session_manager
+    if args.host or args.port or args.password:
+        manager.host = args.host or manager.host
+        manager.port = args.port or manager.port
+        manager.password = args.password if args.password is not None else manager.password
+        manager._initialize_connection()
+    redis_available = manager.is_connected()
+    original_mode, original_ttl = manager.session_mode, manager.local_cache.ttl
+
+    print("=" * 50)
+    print(f"会话 {args.sessions} 个，校验 {args.requests} 次，Redis: {'可用' if redis_available else '不可用'}")
+    print("=" * 50)
+
+    created = []
+    ok = True
+    try:
+        baseline = None
+        if redis_available:
+            redis_ids = create_sessions(manager, 'redis', args.sessions)
+            created.extend(redis_ids)
+
+            manager.local_cache.ttl = 0     # 关闭进程内缓存，每次校验一次 Redis 往返
+            elapsed, failed = run_validations(manager, redis_ids, args.requests)
+            report("Redis 会话:", elapsed, args.requests, failed)
+            baseline = elapsed
+            ok = ok and not failed
+
+            manager.local_cache.ttl = original_ttl or 30
+            manager.local_cache.ensure_listener(manager.redis_client)
+            time.sleep(0.2)                 # 等待订阅线程就绪
+            elapsed, failed = run_validations(manager, redis_ids, args.requests)
+            report("Redis 会话 + 本地缓存:", elapsed, args.requests, failed, baseline)
+            ok = ok and not failed
+        else:
+            print("⚠️  Redis 不可用，只测试签名令牌（撤销列表无法刷新）")
+
+        token_ids = create_sessions(manager, 'token', args.sessions)
+        elapsed, failed = run_validations(manager, token_ids, args.requests)
+        report("签名令牌:", elapsed, args.requests, failed, baseline)
+        ok = ok and not failed
+        print(f"令牌长度: {len(token_ids[0])} 字节")
+
+        if redis_available:
+            # 退出登录和强制下线
+            checks = {
+                'Redis 会话退出登录': (manager.delete_session(redis_ids[0]), redis_ids[0]),
+                '令牌退出登录': (manager.delete_session(token_ids[0]), token_ids[0]),
+            }
+            forced_account = manager.validate_and_touch(token_ids[1])
+            manager.delete_user_all_sessions(forced_account)
+            checks['令牌强制下线'] = (True, token_ids[1])
+            time.sleep(0.05)
+            for name, (deleted, session_id) in checks.items():
+                if deleted and manager.validate_and_touch(session_id) is None:
+                    print(f"✅ {name}后会话失效")
+                else:
+                    print(f"❌ {name}后会话仍然有效")
+                    ok = False
+    finally:
+        manager.session_mode, manager.local_cache.ttl = original_mode, original_ttl
+        if redis_available:
+            pipe = manager.redis_client.pipeline(transaction=False)
+            for session_id in created:
+                pipe.delete(f"{manager.prefix}{session_id}")
+            for i in range(50):
+                pipe.delete(f"user_sessions:{BENCH_ACCOUNT}_redis_{i}")
+                pipe.hdel(session_tokens.REVOKED_USERS_KEY, f"{BENCH_ACCOUNT}_token_{i}")
+            pipe.execute()
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+"""
+MySQL 连接池 - 按数据库名复用 pymysql 连接，避免每次请求都重新进行 TCP + 认证握手
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+import pymysql
+import pymysql.cursors
+from pymysql.constants import SERVER_STATUS
+
+from sql_trace import trace_cursor
+
+
+# 连接池配置（可通过环境变量覆盖）
+POOL_CONFIG = {
+    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 1)),                 # 每个库保留的最少空闲连接
+    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),                # 每个库的最大连接数（空闲 + 借出）
+    'checkout_timeout': float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', 5)),   # 借连接的最长等待时间（秒）
+    'idle_timeout': float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),     # 空闲超过该时间的连接会被回收（秒）
+    'ping_interval': float(os.getenv('DB_POOL_PING_INTERVAL', 30)),    # 空闲超过该时间的连接借出前先 ping（秒，0 表示每次都 ping）
+    'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),    # 连接最长存活时间（秒）
+}
+
+
+class PoolTimeoutError(pymysql.err.OperationalError):
+    """在 checkout_timeout 内没有借到连接"""
+
+
+class PooledConnection:
+    """
+    连接池借出的连接代理
+
+    用法与 pymysql 连接完全一致，区别是 close() 会把连接归还连接池而不是断开，
+    因此现有的 conn = connect_db() ... conn.close() 写法无需修改。
+    """
+
+    def __init__(self, pool, raw, created_at, generation):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._generation = generation
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get('_raw')
+        if raw is None:
+            raise pymysql.err.InterfaceError(0, '连接已归还连接池')
+        return getattr(raw, name)
+
+    @property
+    def open(self):
+        return self._raw is not None and self._raw.open
+
+    def close(self):
+        """归还连接（重复调用是安全的）"""
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._release(raw, self._created_at, self._generation)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # 兜底：调用方忘记 close 时，在对象回收时归还连接
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class MySQLConnectionPool:
+    """单个数据库的连接池"""
+
+    def __init__(self, database: str, config: Dict[str, Any], min_size: int = 1, max_size: int = 10,
+                 checkout_timeout: float = 5.0, idle_timeout: float = 300.0,
+                 ping_interval: float = 30.0, max_lifetime: float = 3600.0):
+        """
+        初始化连接池（不会立即建立连接）
+
+        Args:
+            database: 数据库名
+            config: pymysql.connect 的连接参数（不含 database）
+            min_size: 空闲回收时至少保留的连接数
+            max_size: 最大连接数（空闲 + 借出）
+            checkout_timeout: 连接池耗尽时借连接的最长等待时间（秒）
+            idle_timeout: 空闲连接的回收时间（秒）
+            ping_interval: 空闲超过该时间的连接在借出前先 ping 一次（秒）
+            max_lifetime: 连接的最长存活时间（秒），超过后归还时直接关闭
+        """
+        self.database = database
+        self.config = dict(config)
+        self.config['database'] = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.max_lifetime = max_lifetime
+
+        self._reset_state()
+
+    def _reset_state(self):
+        """重置内部状态（初始化和 fork 之后使用）"""
+        self._cond = threading.Condition()
+        self._idle = deque()      # (raw, created_at, last_used)
+        self._in_use = 0
+        self._pid = os.getpid()
+        self._generation = getattr(self, '_generation', 0) + 1
+
+        # 统计数据
+        self.created_count = 0
+        self.reused_count = 0
+        self.timeout_count = 0
+        self.discarded_count = 0
+
+    # ------------------------------------------------------------------
+    # 借出 / 归还
+    # ------------------------------------------------------------------
+    def get_connection(self) -> PooledConnection:
+        """
+        从连接池借出一个连接
+
+        Returns:
+            PooledConnection: 连接代理，close() 时归还
+
+        Raises:
+            PoolTimeoutError: 超过 checkout_timeout 仍无可用连接
+        """
+        self._check_fork()
+        deadline = time.monotonic() + self.checkout_timeout
+        expired = []
+
+        with self._cond:
+            while True:
+                expired.extend(self._evict_idle_locked())
+                if self._idle:
+                    raw, created_at, last_used = self._idle.pop()  # 后进先出，优先使用最热的连接
+                    self._in_use += 1
+                    break
+                if self._in_use + len(self._idle) < self.max_size:
+                    raw, created_at, last_used = None, None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeout_count += 1
+                    raise PoolTimeoutError(
+                        0, f'数据库 {self.database} 连接池已耗尽（{self.max_size} 个连接均在使用中）')
+                self._cond.wait(remaining)
+            generation = self._generation
+
+        # 网络操作放在锁外进行
+        for stale in expired:
+            self._close_raw(stale)
+
+        try:
+            if raw is not None and not self._validate(raw, created_at, last_used):
+                self._close_raw(raw, force=True)
+                raw = None
+            if raw is None:
+                raw = pymysql.connect(**self.config)
+                created_at = time.monotonic()
+                self.created_count += 1
+                scope = _current_scope.get()
+                if scope is not None:
+                    scope.physical_opened += 1
+            else:
+                self.reused_count += 1
+        except Exception:
+            with self._cond:
+                if generation == self._generation:
+                    self._in_use -= 1
+                    self._cond.notify()
+            raise
+
+        return PooledConnection(self, raw, created_at, generation)
+
+    def _validate(self, raw, created_at, last_used) -> bool:
+        """借出前检查连接是否可用"""
+        if not raw.open:
+            return False
+        if self.max_lifetime and time.monotonic() - created_at > self.max_lifetime:
+            return False
+        if time.monotonic() - last_used >= self.ping_interval:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def _release(self, raw, created_at, generation):
+        """归还连接（由 PooledConnection.close 调用）"""
+        if generation != self._generation or os.getpid() != self._pid:
+            # fork 之前借出的连接，socket 属于父进程，直接丢弃
+            self._close_raw(raw, force=True)
+            return
+
+        reusable = raw.open
+        if reusable and raw.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            # 调用方没有提交的事务不能带给下一个使用者
+            try:
+                raw.rollback()
+            except Exception:
+                reusable = False
+        if reusable and self.max_lifetime and time.monotonic() - created_at > self.max_lifetime:
+            reusable = False
+
+        with self._cond:
+            if generation != self._generation:
+                reusable = False
+            else:
+                self._in_use -= 1
+                if reusable and len(self._idle) < self.max_size:
+                    self._idle.append((raw, created_at, time.monotonic()))
+                    raw = None
+                self._cond.notify()
+
+        if raw is not None:
+            self._close_raw(raw)
+
+    def _evict_idle_locked(self):
+        """回收空闲过久的连接（需持有锁），返回待关闭的连接"""
+        if not self.idle_timeout:
+            return []
+        now = time.monotonic()
+        expired = []
+        # 队列左侧是最久未使用的连接
+        while len(self._idle) > self.min_size and now - self._idle[0][2] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+        return expired
+
+    def _close_raw(self, raw, force=False):
+        """关闭底层连接"""
+        self.discarded_count += 1
+        try:
+            if force:
+                # 不发送 COM_QUIT，只关闭本进程持有的 socket
+                raw._force_close()
+            else:
+                raw.close()
+        except Exception:
+            pass
+
+    # ------------------------------------------------------------------
+    # 进程管理
+    # ------------------------------------------------------------------
+    def _check_fork(self):
+        """检测是否在 fork 出的子进程中使用了父进程的连接池"""
+        if os.getpid() != self._pid:
+            self.reset_after_fork()
+
+    def reset_after_fork(self):
+        """
+        fork 之后在子进程中调用：丢弃继承自父进程的连接
+
+        gunicorn preload_app=True 时，主进程加载应用期间建立的连接会被所有 worker 继承，
+        多个进程共用同一个 socket 会导致 Packet sequence number wrong 等错误。
+        """
+        inherited = [item[0] for item in self._idle]
+        self._reset_state()
+        for raw in inherited:
+            self._close_raw(raw, force=True)
+
+    def close_all(self):
+        """关闭所有空闲连接（借出中的连接归还时会被关闭）"""
+        with self._cond:
+            idle = [item[0] for item in self._idle]
+            self._idle.clear()
+            self._generation += 1
+            self._in_use = 0
+            self._cond.notify_all()
+        for raw in idle:
+            self._close_raw(raw)
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池使用情况"""
+        with self._cond:
+            return {
+                'database': self.database,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'max_size': self.max_size,
+                'created': self.created_count,
+                'reused': self.reused_count,
+                'timeouts': self.timeout_count,
+                'discarded': self.discarded_count,
+            }
+
+
+# ----------------------------------------------------------------------
+# 按数据库名管理的全局连接池
+# ----------------------------------------------------------------------
+_pools: Dict[str, MySQLConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database: str, config: Dict[str, Any]) -> MySQLConnectionPool:
+    """获取（必要时创建）指定数据库的连接池"""
+    pool = _pools.get(database)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(database)
+            if pool is None:
+                pool = MySQLConnectionPool(database, config, **POOL_CONFIG)
+                _pools[database] = pool
+    return pool
+
+
+def get_connection(database: str, config: Dict[str, Any]) -> PooledConnection:
+    """从指定数据库的连接池借出连接"""
+    return get_pool(database, config).get_connection()
+
+
+def reset_all_pools():
+    """fork 之后重置所有连接池"""
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    for pool in list(_pools.values()):
+        pool.reset_after_fork()
+
+
+def close_all_pools():
+    """关闭所有连接池的空闲连接"""
+    for pool in list(_pools.values()):
+        pool.close_all()
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """所有连接池的使用情况"""
+    return {name: pool.stats() for name, pool in list(_pools.items())}
+
+
+# ----------------------------------------------------------------------
+# 请求级连接作用域：同一个请求内的所有 connect_db() 共用一个连接和游标
+# ----------------------------------------------------------------------
+_current_scope = contextvars.ContextVar('db_request_scope', default=None)
+
+class ScopedCursor:
+    """
+    请求作用域内共享的游标代理
+
+    close() 不会真正关闭游标，只是丢弃未读取的结果，下一个 helper 可以继续使用。
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def busy(self) -> bool:
+        """是否还有未读取的结果（有则不能交给其他调用方）"""
+        rows = self._cursor._rows
+        return rows is not None and self._cursor.rownumber < len(rows)
+
+    def close(self):
+        rows = self._cursor._rows
+        if rows is not None:
+            self._cursor.rownumber = len(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ScopedConnection:
+    """
+    请求作用域内共享的连接代理
+
+    close() 不做任何事，连接在请求结束时统一归还连接池；
+    cursor() 对同一种游标类型复用同一个游标。
+    """
+
+    def __init__(self, scope, database):
+        self._scope = scope
+        self._database = database
+
+    @property
+    def _pooled(self):
+        return self._scope._connections[self._database]
+
+    def __getattr__(self, name):
+        return getattr(self._pooled, name)
+
+    @property
+    def open(self):
+        return self._pooled.open
+
+    def cursor(self, cursor=None):
+        # 被采样的请求中包一层计时代理（见 sql_trace）
+        return trace_cursor(self._scope._cursor(self._database, cursor))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class RequestScope:
+    """一个请求内借出的连接和游标"""
+
+    def __init__(self):
+        self._connections: Dict[str, PooledConnection] = {}
+        self._cursors: Dict[Any, ScopedCursor] = {}
+        self.physical_opened = 0    # 本请求新建立的物理连接数
+        self.checkouts = 0          # 本请求从连接池借出的连接数
+        self.cursor_reused = 0      # 复用游标的次数
+
+    def connection(self, database: str, config: Dict[str, Any]) -> ScopedConnection:
+        """获取本请求在指定数据库上的连接（首次调用时从连接池借出）"""
+        pooled = self._connections.get(database)
+        if pooled is not None and not pooled.open:
+            # 连接已被服务器断开，重连后继续使用同一个连接
+            try:
+                pooled.ping(reconnect=True)
+            except Exception:
+                self._drop(database)
+                pooled = None
+        if pooled is None:
+            self._connections[database] = get_connection(database, config)
+            self.checkouts += 1
+        return ScopedConnection(self, database)
+
+    def _cursor(self, database, cursor_class):
+        pooled = self._connections[database]
+        cursor_class = cursor_class or pooled.cursorclass
+        if issubclass(cursor_class, pymysql.cursors.SSCursor):
+            # 流式游标会占用连接直到读完，不共享
+            return pooled.cursor(cursor_class)
+        key = (database, cursor_class)
+        shared = self._cursors.get(key)
+        if shared is not None and shared.connection is not None and not shared.busy:
+            self.cursor_reused += 1
+            return shared
+        if shared is not None and shared.busy:
+            # 共享游标的结果还没读完（外层调用方仍在使用），单独给一个新游标
+            return pooled.cursor(cursor_class)
+        shared = ScopedCursor(pooled.cursor(cursor_class))
+        self._cursors[key] = shared
+        return shared
+
+    def _drop(self, database):
+        for key in [k for k in self._cursors if k[0] == database]:
+            del self._cursors[key]
+        pooled = self._connections.pop(database, None)
+        if pooled is not None:
+            pooled.close()
+
+    def close(self):
+        """归还本请求借出的所有连接"""
+        for database in list(self._connections):
+            self._drop(database)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'opened': self.physical_opened,
+            'used': self.checkouts,
+            'cursor_reused': self.cursor_reused,
+        }
+
+
+def begin_request_scope() -> RequestScope:
+    """开始一个请求作用域（Flask before_request 中调用）"""
+    scope = RequestScope()
+    scope._token = _current_scope.set(scope)
+    return scope
+
+
+def end_request_scope(scope: Optional[RequestScope]):
+    """结束请求作用域并归还连接（Flask teardown_request 中调用）"""
+    if scope is None:
+        return
+    try:
+        scope.close()
+    finally:
+        try:
+            _current_scope.reset(scope._token)
+        except ValueError:
+            # 在其他上下文中结束（例如流式响应），直接清空
+            _current_scope.set(None)
+
+
+def current_request_scope() -> Optional[RequestScope]:
+    """当前请求作用域（不在请求内时为 None）"""
+    return _current_scope.get()
+
+
+def connect(database: str, config: Dict[str, Any]):
+    """
+    获取数据库连接：在请求作用域内返回本请求共享的连接，否则直接从连接池借出
+
+    两种情况下调用方都照常 close()，请求内的 close() 不会归还连接。
+    """
+    scope = _current_scope.get()
+    if scope is not None:
+        return scope.connection(database, config)
+    return get_connection(database, config)
+
+
+# 子进程中自动丢弃继承的连接（gunicorn worker、multiprocessing 等）
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_all_pools)
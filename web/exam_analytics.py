@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""
+考试统计分析 - 把教师快照转换为 NumPy 数组（学生 × 考试 × 科目）后向量化计算
+
+班级详情、考试详情、学生详情接口返回的平均分、及格率、最高/最低分、各科平均分、总分，
+以及 subject_calculate 的综合成绩和方差，都在这里计算。
+未安装 numpy 时自动使用逐个字典遍历的实现，两种实现的返回结果一致。
+"""
+import statistics
+import threading
+import weakref
+from typing import Dict, Any, Optional
+
+try:
+    import numpy as np
+    NUMPY_ENABLED = True
+except ImportError as e:
+    NUMPY_ENABLED = False
+    print(f"⚠️  NumPy 未安装，考试统计使用逐项计算: {e}")
+
+
+PASS_SCORE = 60     # 及格线
+
+
+def _number(value):
+    """取出可以参与统计的分数，非数字返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ScoreTensor:
+    """
+    教师成绩的数组表示
+
+    scores/full: float64[S, E, J]，缺考或非数字的位置为 0
+    mask:        bool[S, E, J]，该学生该考试该科目是否有有效分数
+    present:     bool[S, E, J]，该学生该考试的成绩字典中是否有该科目（分数不一定是数字）
+    taken:       bool[S, E]，该学生的成绩字典中是否有该考试
+    学生按 班级 → 学生 的顺序排列，与原接口的遍历顺序一致，每个班级占连续的一段。
+    """
+
+    def __init__(self, snapshot):
+        self.accounts = [student["账号"] for class_name in snapshot.classes
+                         for student in snapshot.class_students(class_name)]
+        self.exams = snapshot.exam_names
+        self.subjects = list(snapshot.by_subject.keys())
+        self.student_index = {account: i for i, account in enumerate(self.accounts)}
+        self.class_slices = {}
+        start = 0
+        for class_name in snapshot.classes:
+            end = start + len(snapshot.class_students(class_name))
+            self.class_slices[class_name] = slice(start, end)
+            start = end
+        self.exam_index = {exam: i for i, exam in enumerate(self.exams)}
+        self.subject_index = {subject: i for i, subject in enumerate(self.subjects)}
+
+        shape = (len(self.accounts), len(self.exams), len(self.subjects))
+        self.scores = np.zeros(shape)
+        self.full = np.zeros(shape)
+        self.mask = np.zeros(shape, dtype=bool)
+        self.present = np.zeros(shape, dtype=bool)
+        self.taken = np.zeros(shape[:2], dtype=bool)
+
+        for s, account in enumerate(self.accounts):
+            for exam_name, exam_data in snapshot.exams_of(account).items():
+                e = self.exam_index[exam_name]
+                self.taken[s, e] = True
+                for subject, value in exam_data.items():
+                    j = self.subject_index[subject]
+                    self.present[s, e, j] = True
+                    score = _number(value[0])
+                    if score is None:
+                        continue
+                    self.scores[s, e, j] = score
+                    self.full[s, e, j] = _number(value[1]) or 0
+                    self.mask[s, e, j] = True
+
+
+# 按快照对象缓存数组（快照本身按版本缓存，版本变化后旧快照被回收，数组随之释放）
+_tensors = weakref.WeakKeyDictionary()
+_tensors_lock = threading.Lock()
+
+
+def get_score_tensor(snapshot) -> 'ScoreTensor':
+    """获取快照对应的成绩数组（同一快照只构建一次）"""
+    with _tensors_lock:
+        tensor = _tensors.get(snapshot)
+    if tensor is None:
+        tensor = ScoreTensor(snapshot)
+        with _tensors_lock:
+            _tensors[snapshot] = tensor
+    return tensor
+
+
+# ----------------------------------------------------------------------
+# 班级详情
+# ----------------------------------------------------------------------
+def class_detail(snapshot, class_name: str, use_numpy: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+    """
+    班级详情统计（/api/class-detail 使用）
+
+    返回:
+    dict: classDetail，班级不存在或没有学生时返回 None
+    """
+    students = snapshot.class_students(class_name)
+    if not students:
+        return None
+    if use_numpy is None:
+        use_numpy = NUMPY_ENABLED
+    if use_numpy:
+        return _class_detail_numpy(snapshot, class_name, students)
+    return _class_detail_loops(snapshot, class_name, students)
+
+
+def _class_detail_numpy(snapshot, class_name, students):
+    tensor = get_score_tensor(snapshot)
+    rows = tensor.class_slices[class_name]
+    scores = tensor.scores[rows]
+    mask = tensor.mask[rows]
+
+    counts = mask.sum(axis=(1, 2))
+    totals = scores.sum(axis=(1, 2))
+    passed = ((scores >= PASS_SCORE) & mask).sum(axis=(1, 2))
+    exam_counts = tensor.taken[rows].sum(axis=1)
+
+    student_list = []
+    for i, student in enumerate(students):
+        count = int(counts[i])
+        student_list.append({
+            'name': student["名称"],
+            'account': student["账号"],
+            'avgScore': float(totals[i]) / count if count > 0 else 0,
+            'examCount': int(exam_counts[i]),
+            'passedRate': (int(passed[i]) / count * 100) if count > 0 else 0
+        })
+
+    total_count = int(counts.sum())
+    subject_counts = mask.sum(axis=(0, 1))
+    subject_totals = scores.sum(axis=(0, 1))
+    subject_averages = {tensor.subjects[j]: float(subject_totals[j]) / int(subject_counts[j])
+                        for j in np.flatnonzero(subject_counts)}
+
+    class_avg_score = float(totals.sum()) / total_count if total_count > 0 else 0
+    class_pass_rate = (int(passed.sum()) / total_count * 100) if total_count > 0 else 0
+    return {
+        'className': class_name,
+        'studentCount': len(students),
+        'avgScore': round(class_avg_score, 2),
+        'passRate': round(class_pass_rate, 2),
+        'examCount': int(exam_counts.max()) if len(students) else 0,
+        'students': student_list,
+        'subjectAverages': subject_averages
+    }
+
+
+def _class_detail_loops(snapshot, class_name, students):
+    total_score = 0
+    total_count = 0
+    exam_count = 0
+    passed_count = 0
+    student_list = []
+    subject_totals = {}
+    subject_counts = {}
+
+    for student in students:
+        student_exams = snapshot.exams_of(student["账号"])
+        student_total_score = 0
+        student_score_count = 0
+        student_passed_count = 0
+
+        for exam_data in student_exams.values():
+            for subject, (score, total) in exam_data.items():
+                score = _number(score)
+                if score is None:
+                    continue
+                student_total_score += score
+                student_score_count += 1
+                total_score += score
+                total_count += 1
+                subject_totals[subject] = subject_totals.get(subject, 0) + score
+                subject_counts[subject] = subject_counts.get(subject, 0) + 1
+                if score >= PASS_SCORE:
+                    student_passed_count += 1
+                    passed_count += 1
+
+        student_list.append({
+            'name': student["名称"],
+            'account': student["账号"],
+            'avgScore': student_total_score / student_score_count if student_score_count > 0 else 0,
+            'examCount': len(student_exams),
+            'passedRate': (student_passed_count / student_score_count * 100) if student_score_count > 0 else 0
+        })
+        exam_count = max(exam_count, len(student_exams))
+
+    class_avg_score = total_score / total_count if total_count > 0 else 0
+    class_pass_rate = (passed_count / total_count * 100) if total_count > 0 else 0
+    return {
+        'className': class_name,
+        'studentCount': len(students),
+        'avgScore': round(class_avg_score, 2),
+        'passRate': round(class_pass_rate, 2),
+        'examCount': exam_count,
+        'students': student_list,
+        'subjectAverages': {subject: subject_totals[subject] / subject_counts[subject] for subject in subject_totals}
+    }
+
+
+# ----------------------------------------------------------------------
+# 考试详情
+# ----------------------------------------------------------------------
+def exam_detail(snapshot, exam_name: str, use_numpy: Optional[bool] = None) -> tuple:
+    """
+    考试详情统计（/api/exam-detail 使用）
+
+    返回:
+    tuple: (examDetail, students)
+    """
+    if use_numpy is None:
+        use_numpy = NUMPY_ENABLED
+    if use_numpy:
+        return _exam_detail_numpy(snapshot, exam_name)
+    return _exam_detail_loops(snapshot, exam_name)
+
+
+def _exam_student(snapshot, account, exam_data, total):
+    student = snapshot.by_student[account]
+    return {
+        'name': student["名称"],
+        'account': account,
+        'className': student["班级"],
+        'scores': {subject: data[0] for subject, data in exam_data.items()},  # 只保留得分，不包含满分
+        'totalScore': total
+    }
+
+
+def _exam_detail_numpy(snapshot, exam_name):
+    tensor = get_score_tensor(snapshot)
+    e = tensor.exam_index.get(exam_name)
+    if e is None:
+        rows = np.zeros(0, dtype=int)
+    else:
+        rows = np.flatnonzero(tensor.taken[:, e])
+    scores = tensor.scores[rows, e] if len(rows) else np.zeros((0, len(tensor.subjects)))
+    mask = tensor.mask[rows, e] if len(rows) else np.zeros((0, len(tensor.subjects)), dtype=bool)
+    full = tensor.full[rows, e] if len(rows) else np.zeros((0, len(tensor.subjects)))
+
+    student_totals = scores.sum(axis=1)
+    score_count = int(mask.sum())
+    subject_present = mask.any(axis=0)
+    subject_max = np.where(mask, full, -np.inf).max(axis=0) if len(rows) else full.sum(axis=0)
+
+    exam_scores = snapshot.exam_scores(exam_name)
+    students = [_exam_student(snapshot, tensor.accounts[s], exam_scores[tensor.accounts[s]],
+                              float(student_totals[i]))
+                for i, s in enumerate(rows)]
+    exam = {
+        'name': exam_name,
+        'date': '2024-01-01',  # 实际应用中应从数据库获取
+        'participants': len(students),
+        'avgScore': float(scores.sum()) / score_count if score_count > 0 else 0,
+        'subjectMaxScores': {tensor.subjects[j]: float(subject_max[j]) for j in np.flatnonzero(subject_present)},
+        'allSubjects': [tensor.subjects[j] for j in np.flatnonzero(subject_present)]
+    }
+    return exam, students
+
+
+def _exam_detail_loops(snapshot, exam_name):
+    all_students = []
+    total_score = 0
+    score_count = 0
+    subject_max_scores = {}
+
+    for class_name in snapshot.classes:
+        for student in snapshot.class_students(class_name):
+            exam_data = student["考试"].get(exam_name)
+            if exam_data is None:
+                continue
+            student_total = 0
+            for subject, (score, max_score) in exam_data.items():
+                score = _number(score)
+                if score is None:
+                    continue
+                student_total += score
+                total_score += score
+                score_count += 1
+                max_score = _number(max_score) or 0
+                if subject not in subject_max_scores or max_score > subject_max_scores[subject]:
+                    subject_max_scores[subject] = max_score
+            all_students.append(_exam_student(snapshot, student["账号"], exam_data, student_total))
+
+    exam = {
+        'name': exam_name,
+        'date': '2024-01-01',  # 实际应用中应从数据库获取
+        'participants': len(all_students),
+        'avgScore': total_score / score_count if score_count > 0 else 0,
+        'subjectMaxScores': subject_max_scores,
+        'allSubjects': list(subject_max_scores.keys())
+    }
+    return exam, all_students
+
+
+# ----------------------------------------------------------------------
+# 学生详情
+# ----------------------------------------------------------------------
+def student_detail(snapshot, student_account: str, use_numpy: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    学生详情统计（/api/student-detail 使用）
+
+    返回:
+    dict: avgScore, examCount, highestScore, lowestScore, passRate, totalCount,
+          examRecords, examTrendData, subjectAverages, strongest/weakest 科目
+    """
+    if use_numpy is None:
+        use_numpy = NUMPY_ENABLED
+    student_exams = snapshot.exams_of(student_account)
+    if use_numpy:
+        stats = _student_stats_numpy(snapshot, student_account, student_exams)
+    else:
+        stats = _student_stats_loops(student_exams)
+
+    # 最强、最弱科目（平均分相同时取先出现的科目）
+    subject_averages = stats['subjectAverages']
+    if subject_averages:
+        strongest_subject, strongest_score = "", 0
+        weakest_subject, weakest_score = "", float('inf')
+        for subject, avg in subject_averages.items():
+            if avg > strongest_score:
+                strongest_subject, strongest_score = subject, avg
+            if avg < weakest_score:
+                weakest_subject, weakest_score = subject, avg
+    else:
+        strongest_subject, strongest_score = "暂无数据", 0
+        weakest_subject, weakest_score = "暂无数据", 0
+
+    total_count = stats['totalCount']
+    stats.update({
+        'examCount': len(student_exams),
+        'avgScore': stats['totalScore'] / total_count if total_count > 0 else 0,
+        'passRate': f"{(stats['passedCount'] / total_count * 100):.1f}%" if total_count > 0 else '0%',
+        'examRecords': [{
+            'examName': exam_name,
+            'date': '2024-01-01',  # 实际应用中应从数据库获取
+            'subjects': exam_data,
+            'total': [exam_total, exam_max]
+        } for (exam_name, exam_data), exam_total, exam_max
+            in zip(student_exams.items(), stats['examTotals'], stats['examMaxes'])],
+        'examTrendData': {
+            'labels': list(student_exams.keys()),
+            'data': stats['examTotals']
+        },
+        'strongestSubject': strongest_subject,
+        'strongestScore': strongest_score,
+        'weakestSubject': weakest_subject,
+        'weakestScore': weakest_score
+    })
+    return stats
+
+
+def _student_subject_order(student_exams):
+    """学生成绩字典中科目首次出现的顺序（不含 total 字段）"""
+    return list(dict.fromkeys(subject for exam_data in student_exams.values()
+                              for subject in exam_data if subject != 'total'))
+
+
+def _student_stats_numpy(snapshot, student_account, student_exams):
+    tensor = get_score_tensor(snapshot)
+    s = tensor.student_index.get(student_account)
+    exam_cols = [tensor.exam_index[exam_name] for exam_name in student_exams]
+    subject_order = _student_subject_order(student_exams)
+    subject_cols = [tensor.subject_index[subject] for subject in subject_order]
+    if s is None or not exam_cols or not subject_cols:
+        return _student_stats_loops(student_exams)
+
+    # 只取该学生考过的考试和科目（跳过 total 字段）
+    scores = tensor.scores[s][np.ix_(exam_cols, subject_cols)]
+    full = tensor.full[s][np.ix_(exam_cols, subject_cols)]
+    mask = tensor.mask[s][np.ix_(exam_cols, subject_cols)]
+
+    valid = scores[mask]
+    subject_counts = mask.sum(axis=0)
+    subject_totals = scores.sum(axis=0)
+    return {
+        'totalScore': float(valid.sum()),
+        'totalCount': int(mask.sum()),
+        'passedCount': int((valid >= PASS_SCORE).sum()),
+        'highestScore': max(float(valid.max()), 0) if valid.size else 0,
+        'lowestScore': float(valid.min()) if valid.size else 0,
+        'examTotals': [float(x) for x in scores.sum(axis=1)],
+        'examMaxes': [float(x) for x in full.sum(axis=1)],
+        'subjectAverages': {subject_order[j]: float(subject_totals[j]) / int(subject_counts[j])
+                            for j in range(len(subject_order)) if subject_counts[j] > 0}
+    }
+
+
+def _student_stats_loops(student_exams):
+    total_score = 0
+    total_count = 0
+    highest_score = 0
+    lowest_score = float('inf')
+    passed_count = 0
+    subject_totals = {}
+    subject_counts = {}
+    exam_totals = []
+    exam_maxes = []
+
+    for exam_name, exam_data in student_exams.items():
+        exam_total = 0
+        exam_max = 0
+        for subject, (score, max_score) in exam_data.items():
+            score = _number(score)
+            if subject == 'total' or score is None:  # 跳过total字段
+                continue
+            exam_total += score
+            exam_max += _number(max_score) or 0
+            total_score += score
+            total_count += 1
+            highest_score = max(highest_score, score)
+            lowest_score = min(lowest_score, score)
+            subject_totals[subject] = subject_totals.get(subject, 0) + score
+            subject_counts[subject] = subject_counts.get(subject, 0) + 1
+            if score >= PASS_SCORE:
+                passed_count += 1
+        exam_totals.append(exam_total)
+        exam_maxes.append(exam_max)
+
+    return {
+        'totalScore': total_score,
+        'totalCount': total_count,
+        'passedCount': passed_count,
+        'highestScore': highest_score,
+        'lowestScore': lowest_score if total_count > 0 else 0,
+        'examTotals': exam_totals,
+        'examMaxes': exam_maxes,
+        'subjectAverages': {subject: subject_totals[subject] / subject_counts[subject] for subject in subject_totals}
+    }
+
+
+# ----------------------------------------------------------------------
+# 综合成绩 / 各科均分 / 方差（与 ALL_function.subject_calculate 相同，一次算出全部学生）
+# ----------------------------------------------------------------------
+def subject_calculate_all(snapshot, use_numpy: Optional[bool] = None) -> Dict[str, Dict[str, float]]:
+    """
+    计算教师名下每个学生的综合成绩、各科目平均分和方差
+
+    返回:
+    dict: {学生账号: {"综合成绩": ..., "{科目}均分": ..., "方差": ...}}
+    """
+    if use_numpy is None:
+        use_numpy = NUMPY_ENABLED
+    if not use_numpy:
+        return {student["账号"]: _subject_calculate_loops(student["考试"]) for student in snapshot.students}
+
+    tensor = get_score_tensor(snapshot)
+    totals = tensor.scores.sum(axis=2)                      # [S, E] 每次考试总分
+    exam_counts = tensor.taken.sum(axis=1)                  # [S]
+    taken_totals = np.where(tensor.taken, totals, 0)
+    safe_counts = np.maximum(exam_counts, 1)
+    composite = taken_totals.sum(axis=1) / safe_counts
+    deviations = np.where(tensor.taken, totals - composite[:, None], 0)
+    variance = (deviations ** 2).sum(axis=1) / np.maximum(exam_counts - 1, 1)
+
+    subject_counts = tensor.mask.sum(axis=1)                # [S, J]
+    subject_sums = tensor.scores.sum(axis=1)
+    subject_present = tensor.present.any(axis=1)
+
+    result = {}
+    for s, account in enumerate(tensor.accounts):
+        stats = {"综合成绩": float(composite[s]) if exam_counts[s] else 0}
+        for j in np.flatnonzero(subject_present[s]):
+            count = int(subject_counts[s, j])
+            stats[f"{tensor.subjects[j]}均分"] = float(subject_sums[s, j]) / count if count else 0
+        stats["方差"] = float(variance[s]) if exam_counts[s] > 1 else 0
+        result[account] = stats
+    return result
+
+
+def _subject_calculate_loops(score_dict):
+    total_scores = []
+    subject_scores = {}
+    for exam_data in score_dict.values():
+        exam_total = 0
+        for subject, scores in exam_data.items():
+            score = _number(scores[0])
+            subject_scores.setdefault(subject, [])
+            if score is None:
+                continue
+            exam_total += score
+            subject_scores[subject].append(score)
+        total_scores.append(exam_total)
+
+    result = {"综合成绩": sum(total_scores) / len(total_scores) if total_scores else 0}
+    for subject, scores in subject_scores.items():
+        result[f"{subject}均分"] = sum(scores) / len(scores) if scores else 0
+    result["方差"] = statistics.variance(total_scores) if len(total_scores) > 1 else 0
+    return result
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+考试排名索引 - 按考试、科目预先排好序的成绩索引
+
+每次考试为总分和每个科目各保存一份升序分数列表，排名和百分位通过二分查找得到（O(log n)），
+前 k 名直接取降序列表的前 k 项，固定分段的分数分布同样用二分查找统计。
+
+索引按 (教师, 考试) 缓存在进程内，并记录该考试在 Redis 中的版本号，
+只有这次考试的成绩发生变化（写操作 bump 了该考试的版本）后才会重建。
+Redis 不可用时每次请求都从教师快照重新构建，不做缓存。
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from snapshot_cache import get_teacher_snapshot, get_exam_version
+
+
+TOTAL_FIELD = 'total'       # 总分在索引中的字段名
+CACHE_SIZE = 64             # 进程内最多缓存的考试索引数
+
+
+def _number(value):
+    """取出可以参与排名的分数，非数字返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ScoreIndex:
+    """一个字段（总分或某一科目）的排序索引"""
+
+    def __init__(self, entries: List[tuple], full_score):
+        """
+        参数:
+        entries: [(学生账号, 分数)]，按班级顺序排列
+        full_score: 该字段的满分（分数分布的上限）
+        """
+        self.full_score = full_score
+        self.scores = {account: score for account, score in entries}
+        # 升序分数列表用于二分查找；降序账号列表用于前 k 名（同分时保持班级顺序）
+        self.ascending = sorted(score for _, score in entries)
+        self.descending = [account for account, _ in sorted(entries, key=lambda entry: -entry[1])]
+
+    def __len__(self):
+        return len(self.ascending)
+
+    def rank_of_score(self, score) -> int:
+        """分数对应的名次（同分同名次）"""
+        return len(self.ascending) - bisect_right(self.ascending, score) + 1
+
+    def rank(self, account: str) -> Optional[Dict[str, Any]]:
+        """学生的名次和百分位（不高于该分数的比例，最高分为 100），学生没有该字段成绩时返回 None"""
+        score = self.scores.get(account)
+        if score is None:
+            return None
+        at_or_below = bisect_right(self.ascending, score)
+        return {
+            'score': score,
+            'rank': len(self.ascending) - at_or_below + 1,
+            'percentile': round(at_or_below / len(self.ascending) * 100, 1),
+            'count': len(self.ascending)
+        }
+
+    def top(self, k: int) -> List[tuple]:
+        """前 k 名 [(学生账号, 分数, 名次)]"""
+        return [(account, self.scores[account], self.rank_of_score(self.scores[account]))
+                for account in self.descending[:k]]
+
+    def histogram(self, buckets: int) -> List[Dict[str, Any]]:
+        """
+        把 0 到满分等分为 buckets 段统计人数
+
+        每段包含下限不包含上限，最后一段包含满分；超出范围的分数计入第一段或最后一段。
+        """
+        upper = self.full_score
+        if not upper or upper <= 0:
+            upper = self.ascending[-1] if self.ascending else 0
+        buckets = max(1, buckets)
+        width = upper / buckets if upper > 0 else 1
+        result = []
+        for i in range(buckets):
+            low = i * width
+            high = (i + 1) * width
+            start = 0 if i == 0 else bisect_left(self.ascending, low)
+            end = len(self.ascending) if i == buckets - 1 else bisect_left(self.ascending, high)
+            result.append({
+                'min': _round_bound(low),
+                'max': _round_bound(high),
+                'count': end - start
+            })
+        return result
+
+
+def _round_bound(value):
+    """分段边界：整数显示为整数"""
+    value = round(value, 2)
+    return int(value) if value == int(value) else value
+
+
+class ExamRankingIndex:
+    """一次考试的排名索引（总分 + 每个科目）"""
+
+    def __init__(self, snapshot, exam_name: str):
+        self.exam_name = exam_name
+        self.students = {}      # 学生账号 -> (名称, 班级)
+        totals = []
+        total_full = 0
+        subject_entries: Dict[str, List[tuple]] = {}
+        subject_full: Dict[str, Any] = {}
+
+        exam_scores = snapshot.exam_scores(exam_name)
+        # exam_scores 按班级 → 学生的顺序建立，同分时按此顺序排列
+        for account, exam_data in exam_scores.items():
+            student = snapshot.by_student[account]
+            self.students[account] = (student["名称"], student["班级"])
+            total = 0
+            full = 0
+            for subject, value in exam_data.items():
+                score = _number(value[0])
+                if subject == TOTAL_FIELD or score is None:  # 跳过total字段
+                    continue
+                max_score = _number(value[1]) or 0
+                total += score
+                full += max_score
+                subject_entries.setdefault(subject, []).append((account, score))
+                subject_full[subject] = max(subject_full.get(subject, 0), max_score)
+            totals.append((account, total))
+            total_full = max(total_full, full)
+
+        self.fields: Dict[str, ScoreIndex] = {TOTAL_FIELD: ScoreIndex(totals, total_full)}
+        for subject, entries in subject_entries.items():
+            self.fields[subject] = ScoreIndex(entries, subject_full[subject])
+
+    @property
+    def subjects(self) -> List[str]:
+        """考试包含的科目（不含总分）"""
+        return [field for field in self.fields if field != TOTAL_FIELD]
+
+    def student_ranks(self, account: str) -> Optional[Dict[str, Any]]:
+        """学生在总分和各科目中的名次，未参加该考试时返回 None"""
+        if account not in self.students:
+            return None
+        name, class_name = self.students[account]
+        return {
+            'name': name,
+            'account': account,
+            'className': class_name,
+            'ranks': {field: index.rank(account) for field, index in self.fields.items()
+                      if account in index.scores}
+        }
+
+    def top(self, field: str, k: int) -> List[Dict[str, Any]]:
+        """指定字段的前 k 名"""
+        result = []
+        for account, score, rank in self.fields[field].top(k):
+            name, class_name = self.students[account]
+            result.append({
+                'rank': rank,
+                'name': name,
+                'account': account,
+                'className': class_name,
+                'score': score
+            })
+        return result
+
+    def all_ranks(self, field: str) -> Dict[str, int]:
+        """指定字段所有学生的名次 {学生账号: 名次}"""
+        index = self.fields[field]
+        return {account: index.rank_of_score(score) for account, score in index.scores.items()}
+
+    def histograms(self, buckets: int) -> Dict[str, List[Dict[str, Any]]]:
+        """总分和各科目的分数分布"""
+        return {field: index.histogram(buckets) for field, index in self.fields.items()}
+
+
+class ExamRankingCache:
+    """按 (教师, 考试, 考试版本号) 缓存排名索引"""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._indexes = OrderedDict()   # (teacher, exam) -> (version, ExamRankingIndex)
+        self._lock = threading.Lock()
+
+        # 统计数据
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, conn, teacher_account: str, exam_name: str) -> ExamRankingIndex:
+        """获取考试的排名索引，版本号变化后重建"""
+        key = (teacher_account, exam_name)
+        # 先读版本号再读快照：构建期间若有写入，索引会记在旧版本号下，下次请求即重建
+        version = get_exam_version(teacher_account, exam_name)
+        if version is not None:
+            with self._lock:
+                cached = self._indexes.get(key)
+                if cached is not None and cached[0] == version:
+                    self._indexes.move_to_end(key)
+                    self.hits += 1
+                    return cached[1]
+
+        index = ExamRankingIndex(get_teacher_snapshot(conn, teacher_account), exam_name)
+        self.builds += 1
+        if version is not None:
+            with self._lock:
+                self._indexes[key] = (version, index)
+                self._indexes.move_to_end(key)
+                while len(self._indexes) > self.size:
+                    self._indexes.popitem(last=False)
+        return index
+
+    def stats(self):
+        """缓存命中情况"""
+        with self._lock:
+            size = len(self._indexes)
+        return {'hits': self.hits, 'builds': self.builds, 'size': size}
+
+
+# 全局缓存实例
+exam_ranking_cache = ExamRankingCache()
+
+
+# 便捷函数
+def get_exam_ranking(conn, teacher_account: str, exam_name: str) -> ExamRankingIndex:
+    """获取考试的排名索引（只在该考试成绩变化后重建）"""
+    return exam_ranking_cache.get(conn, teacher_account, exam_name)
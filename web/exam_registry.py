@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+考试登记表 - 每个教师创建过的考试各占一行：名称、编号、创建时间、参与班级、科目和满分
+
+原来考试只隐含在每个学生的 `考试` 字段里，判断考试是否存在、列出未分组考试都要读出全部学生。
+创建考试的路径（批量创建、按模板创建、导入成绩、单个学生写入新考试）在写成绩的同一事务中登记，
+查询考试是否存在是一次主键查询，并为每次考试提供稳定的数字编号（/api/exam-details/<id>）。
+删除学生或学生的考试数据后，已经没有学生参加的考试在同一事务中注销，与从学生数据得出的结果保持一致。
+每个考试记录参加的学生数（`students`），只使用 `考试` 字段时据此判断考试是否还有学生参加，不必扫描学生表。
+
+已有数据在第一次读取时从学生表补登（状态表记录是否已补登），也可以用命令行补登:
+    python exam_registry.py                 # 补登所有教师的考试
+    python exam_registry.py --teacher t1    # 只补登指定教师
+"""
+import argparse
+import json
+import re
+import sys
+from typing import Dict, Any, List, Optional, Iterable
+
+from teacher_snapshot import load_teacher_snapshot
+from exam_scores import use_score_table, SCORE_TABLE
+
+
+EXAM_TABLE = 'exams'
+STATE_TABLE = 'exams_state'
+
+# 本进程内已确认补登完成的教师（补登完成后不会再回到未补登状态，每个进程每个教师只查询一次状态表）
+_built_teachers = set()
+
+
+def create_exam_registry_tables(conn):
+    """创建考试登记表和补登状态表"""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{EXAM_TABLE}` (
+            `teacher`     VARCHAR(255) NOT NULL,
+            `exam_name`   VARCHAR(255) NOT NULL,
+            `id`          BIGINT NOT NULL AUTO_INCREMENT,
+            `created_at`  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            `classes`     TEXT,
+            `subjects`    TEXT,
+            `students`    INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (`teacher`, `exam_name`),
+            UNIQUE KEY `uk_exam_id` (`id`)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{STATE_TABLE}` (
+            `teacher`     VARCHAR(255) NOT NULL,
+            `built`       TINYINT NOT NULL DEFAULT 0,
+            `updated_at`  TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (`teacher`)
+        )
+    ''')
+    conn.commit()
+
+
+def exam_layout(exam_data) -> Dict[str, Any]:
+    """考试的科目和满分 {科目: 满分}（不含 total 字段）"""
+    layout = {}
+    if not isinstance(exam_data, dict):
+        return layout
+    for subject, value in exam_data.items():
+        if subject == 'total':  # 跳过total字段
+            continue
+        layout[subject] = value[1] if isinstance(value, (list, tuple)) and len(value) > 1 else None
+    return layout
+
+
+def _loads(text, default):
+    if not text:
+        return default
+    try:
+        return json.loads(text)
+    except ValueError:
+        return default
+
+
+def _merge(classes: List[str], subjects: Dict[str, Any], new_classes: Iterable[str], new_subjects: Dict[str, Any]):
+    """合并班级和科目，保持原有顺序；同一科目的满分以新的为准"""
+    classes = list(classes)
+    for class_name in new_classes:
+        if class_name is not None and class_name not in classes:
+            classes.append(class_name)
+    subjects = dict(subjects)
+    for subject, full_score in new_subjects.items():
+        if full_score is not None or subject not in subjects:
+            subjects[subject] = full_score
+    return classes, subjects
+
+
+# ----------------------------------------------------------------------
+# 登记
+# ----------------------------------------------------------------------
+def register_exam(conn, teacher_account: str, exam_name: str, classes: Iterable[str],
+                  subjects: Dict[str, Any], joined: int = 0) -> int:
+    """
+    登记考试，已登记时合并班级和科目（在写成绩的同一事务中、锁住学生行之后调用，不提交事务）
+
+    参数:
+    classes: 参加考试的班级
+    subjects: {科目: 满分}
+    joined: 新参加该考试的学生数
+
+    返回:
+    int: 考试编号
+    """
+    classes = [class_name for class_name in dict.fromkeys(classes) if class_name is not None]
+    cursor = conn.cursor()
+    # 先插入（已存在时只增加学生数），同时锁住该行，避免两个事务同时登记同一考试时互相等待间隙锁
+    cursor.execute(f'''
+        INSERT INTO `{EXAM_TABLE}` (`teacher`, `exam_name`, `classes`, `subjects`, `students`)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE `students` = `students` + %s
+    ''', (teacher_account, exam_name,
+          json.dumps(classes, ensure_ascii=False), json.dumps(subjects, ensure_ascii=False), joined, joined))
+    cursor.execute(f'''
+        SELECT `id`, `classes`, `subjects` FROM `{EXAM_TABLE}`
+        WHERE `teacher` = %s AND `exam_name` = %s
+    ''', (teacher_account, exam_name))
+    exam_id, old_classes, old_subjects = cursor.fetchone()
+    old_classes = _loads(old_classes, [])
+    old_subjects = _loads(old_subjects, {})
+    merged_classes, merged_subjects = _merge(old_classes, old_subjects, classes, subjects)
+    if merged_classes != old_classes or merged_subjects != old_subjects:
+        cursor.execute(f'''
+            UPDATE `{EXAM_TABLE}` SET `classes` = %s, `subjects` = %s
+            WHERE `teacher` = %s AND `exam_name` = %s
+        ''', (json.dumps(merged_classes, ensure_ascii=False), json.dumps(merged_subjects, ensure_ascii=False),
+              teacher_account, exam_name))
+    return exam_id
+
+
+def register_student_exams(conn, teacher_account: str, class_name: str, old_dict: Optional[dict], new_dict: dict):
+    """
+    单个学生写入成绩时登记新出现的考试或科目（不提交事务）
+
+    只修改分数时科目和满分不变，不产生任何查询。
+    旧数据无法解析时 old_dict 为 None，全部考试按新参加计数（只会多计，考试不会被误注销，补登时修正）。
+    """
+    old_dict = old_dict or {}
+    for exam_name, exam_data in new_dict.items():
+        layout = exam_layout(exam_data)
+        if exam_name in old_dict and exam_layout(old_dict[exam_name]) == layout:
+            continue
+        register_exam(conn, teacher_account, exam_name, [class_name], layout,
+                      joined=0 if exam_name in old_dict else 1)
+
+
+def _exam_has_students(conn, teacher_account: str, exam_name: str) -> bool:
+    """是否还有学生参加该考试（索引查询：exam_scores 表，或登记表中的学生数）"""
+    cursor = conn.cursor()
+    if use_score_table():
+        cursor.execute(f'''
+            SELECT 1 FROM `{SCORE_TABLE}` WHERE `teacher` = %s AND `exam_name` = %s LIMIT 1
+        ''', (teacher_account, exam_name))
+        return cursor.fetchone() is not None
+    cursor.execute(f'''
+        SELECT `students` FROM `{EXAM_TABLE}` WHERE `teacher` = %s AND `exam_name` = %s
+    ''', (teacher_account, exam_name))
+    row = cursor.fetchone()
+    return row is not None and row[0] > 0
+
+
+def unregister_unused_exams(conn, teacher_account: str, exam_names: Iterable[str]) -> List[str]:
+    """
+    每个考试减少一名参加的学生，注销已经没有学生参加的考试（在删除成绩的同一事务中、写入学生数据之后调用，不提交事务）
+
+    参数:
+    exam_names: 有一名学生不再参加的考试
+
+    返回:
+    list: 注销的考试名
+    """
+    removed = []
+    cursor = conn.cursor()
+    for exam_name in dict.fromkeys(exam_names):
+        cursor.execute(f'''
+            UPDATE `{EXAM_TABLE}` SET `students` = `students` - 1
+            WHERE `teacher` = %s AND `exam_name` = %s AND `students` > 0
+        ''', (teacher_account, exam_name))
+        if _exam_has_students(conn, teacher_account, exam_name):
+            continue
+        cursor.execute(f'''
+            DELETE FROM `{EXAM_TABLE}` WHERE `teacher` = %s AND `exam_name` = %s
+        ''', (teacher_account, exam_name))
+        removed.append(exam_name)
+    return removed
+
+
+def unregister_removed_exams(conn, teacher_account: str, old_dict: Optional[dict], new_dict: Optional[dict]):
+    """
+    单个学生的考试字典中删除了考试（或删除了学生，new_dict 为 None）时注销没有学生参加的考试（不提交事务）
+
+    没有删除考试时不产生任何查询。
+    """
+    new_dict = new_dict or {}
+    removed = [exam_name for exam_name in (old_dict or {}) if exam_name not in new_dict]
+    if removed:
+        unregister_unused_exams(conn, teacher_account, removed)
+
+
+# ----------------------------------------------------------------------
+# 补登
+# ----------------------------------------------------------------------
+def rebuild_exam_registry(conn, teacher_account: str) -> int:
+    """
+    从学生表补登教师的全部考试（已登记的考试保留编号和创建时间，只合并班级和科目，学生数重新计算；
+    已经没有学生参加的考试删除）
+
+    返回:
+    int: 学生表中的考试数
+    """
+    snapshot = load_teacher_snapshot(conn, teacher_account)
+    exams = {}      # 考试名 -> (班级列表, {科目: 满分})，按首次出现的顺序
+    students = {}   # 考试名 -> 参加的学生数
+    for class_name in snapshot.classes:
+        for student in snapshot.class_students(class_name):
+            for exam_name, exam_data in student["考试"].items():
+                classes, subjects = exams.setdefault(exam_name, ([], {}))
+                exams[exam_name] = _merge(classes, subjects, [class_name], exam_layout(exam_data))
+                students[exam_name] = students.get(exam_name, 0) + 1
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'UPDATE `{EXAM_TABLE}` SET `students` = 0 WHERE `teacher` = %s', (teacher_account,))
+        for exam_name, (classes, subjects) in exams.items():
+            register_exam(conn, teacher_account, exam_name, classes, subjects, joined=students[exam_name])
+        cursor.execute(f'SELECT `exam_name` FROM `{EXAM_TABLE}` WHERE `teacher` = %s', (teacher_account,))
+        for (exam_name,) in cursor.fetchall():
+            if exam_name not in exams:
+                cursor.execute(f'''
+                    DELETE FROM `{EXAM_TABLE}` WHERE `teacher` = %s AND `exam_name` = %s
+                ''', (teacher_account, exam_name))
+        cursor.execute(f'''
+            INSERT INTO `{STATE_TABLE}` (`teacher`, `built`) VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE `built` = 1
+        ''', (teacher_account,))
+        conn.commit()
+        _built_teachers.add(teacher_account)
+        return len(exams)
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def ensure_exam_registry(conn, teacher_account: str):
+    """教师的已有考试尚未补登时先补登（本进程确认过的教师不再查询状态表）"""
+    if teacher_account in _built_teachers:
+        return
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT `built` FROM `{STATE_TABLE}` WHERE `teacher` = %s', (teacher_account,))
+    state = cursor.fetchone()
+    if not state or not state[0]:
+        rebuild_exam_registry(conn, teacher_account)
+    else:
+        _built_teachers.add(teacher_account)
+
+
+# ----------------------------------------------------------------------
+# 读取
+# ----------------------------------------------------------------------
+def _exam_info(row) -> Dict[str, Any]:
+    exam_id, exam_name, created_at, classes, subjects = row
+    return {
+        'id': exam_id,
+        'name': exam_name,
+        'createdAt': created_at.strftime('%Y-%m-%d %H:%M:%S') if created_at else None,
+        'classes': _loads(classes, []),
+        'subjects': _loads(subjects, {})
+    }
+
+
+def exam_exists(conn, teacher_account: str, exam_name: str) -> bool:
+    """考试是否存在（主键查询）"""
+    ensure_exam_registry(conn, teacher_account)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT 1 FROM `{EXAM_TABLE}` WHERE `teacher` = %s AND `exam_name` = %s
+    ''', (teacher_account, exam_name))
+    return cursor.fetchone() is not None
+
+
+def read_exam_names(conn, teacher_account: str) -> List[str]:
+    """教师的全部考试名，按创建顺序"""
+    ensure_exam_registry(conn, teacher_account)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT `exam_name` FROM `{EXAM_TABLE}` WHERE `teacher` = %s ORDER BY `id`
+    ''', (teacher_account,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def read_exam_registry(conn, teacher_account: str) -> Dict[str, Dict[str, Any]]:
+    """
+    教师的全部考试登记信息
+
+    返回:
+    dict: {考试名: {'id', 'name', 'createdAt', 'classes', 'subjects'}}，按创建顺序
+    """
+    ensure_exam_registry(conn, teacher_account)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT `id`, `exam_name`, `created_at`, `classes`, `subjects` FROM `{EXAM_TABLE}`
+        WHERE `teacher` = %s ORDER BY `id`
+    ''', (teacher_account,))
+    return {row[1]: _exam_info(row) for row in cursor.fetchall()}
+
+
+def get_exam_by_id(conn, teacher_account: str, exam_id: int) -> Optional[Dict[str, Any]]:
+    """按编号查找教师的考试，不存在（或不属于该教师）时返回 None"""
+    ensure_exam_registry(conn, teacher_account)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT `id`, `exam_name`, `created_at`, `classes`, `subjects` FROM `{EXAM_TABLE}`
+        WHERE `id` = %s AND `teacher` = %s
+    ''', (exam_id, teacher_account))
+    row = cursor.fetchone()
+    return _exam_info(row) if row else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='从学生表补登考试')
+    parser.add_argument('--teacher', action='append', help='只补登指定教师（可重复）')
+    args = parser.parse_args(argv)
+
+    from ALL_function import connect_db
+
+    conn = connect_db()
+    try:
+        create_exam_registry_tables(conn)
+        teachers = args.teacher
+        if not teachers:
+            cursor = conn.cursor()
+            cursor.execute('SELECT `账户` FROM `teachers` ORDER BY `账户`')
+            teachers = [row[0] for row in cursor.fetchall()]
+        failed = 0
+        for teacher in teachers:
+            if not re.match(r'^[a-zA-Z0-9_]+$', teacher):
+                print(f"❌ 无效的教师账户: {teacher}")
+                failed += 1
+                continue
+            try:
+                count = rebuild_exam_registry(conn, teacher)
+                print(f"✅ 教师 {teacher} 补登完成，共 {count} 次考试")
+            except Exception as e:
+                print(f"❌ 教师 {teacher} 补登失败: {e}")
+                failed += 1
+        return 1 if failed else 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+考试成绩规范化存储 - 用 exam_scores 表代替 student_{teacher}.`考试` 文本字段
+
+每行一个 (学生, 考试, 科目) 成绩，按考试/科目查询走索引，不再需要解析每个学生的全部考试记录。
+读取接口返回与 read_student_exam 相同的字典结构：{考试名: {科目: [分数, 满分]}}
+"""
+import os
+import re
+from typing import Dict, Any, List, Optional
+
+
+# 成绩存储方式（可通过环境变量 SMSF_SCORE_BACKEND 切换）
+#   blob  : 只使用 student_{teacher}.`考试` 字段（默认，兼容旧数据）
+#   dual  : 从 `考试` 字段读取，写入时同时写 exam_scores 表（迁移期间使用）
+#   table : 只使用 exam_scores 表（数据迁移完成后使用）
+SCORE_BACKEND = os.getenv('SMSF_SCORE_BACKEND', 'blob').lower()
+
+SCORE_TABLE = 'exam_scores'
+
+
+def use_score_table() -> bool:
+    """读取成绩时是否使用 exam_scores 表"""
+    return SCORE_BACKEND == 'table'
+
+
+def create_exam_scores_table(conn):
+    """创建规范化成绩表"""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{SCORE_TABLE}` (
+            `id`              BIGINT AUTO_INCREMENT,
+            `teacher`         VARCHAR(255) NOT NULL,
+            `student_account` VARCHAR(255) NOT NULL,
+            `exam_name`       VARCHAR(255) NOT NULL,
+            `subject`         VARCHAR(255) NOT NULL,
+            `score`           DOUBLE,
+            `score_text`      VARCHAR(64),
+            `full_score`      DOUBLE,
+            PRIMARY KEY (`id`),
+            UNIQUE KEY `uk_student_exam_subject` (`student_account`, `exam_name`, `subject`),
+            KEY `idx_teacher_exam_subject` (`teacher`, `exam_name`, `subject`),
+            KEY `idx_teacher_subject` (`teacher`, `subject`)
+        )
+    ''')
+    conn.commit()
+
+
+def teacher_of(student_account: str) -> str:
+    """从学生账号（teacher@N）中取出教师账户"""
+    teacher = student_account.split('@')[0]
+    # 验证teacher_account只包含字母数字和下划线
+    if not re.match(r'^[a-zA-Z0-9_]+$', teacher):
+        raise ValueError("Invalid teacher account name")
+    return teacher
+
+
+# ----------------------------------------------------------------------
+# 数值转换：表中存 DOUBLE，读出时整数值还原为 int，与原字典保持一致
+# ----------------------------------------------------------------------
+def _to_number(value):
+    """转换为数字，无法转换时返回 None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _from_number(value):
+    """DOUBLE 读出后还原：整数值返回 int"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def score_rows(teacher: str, student_account: str, score_dict: Dict[str, Dict[str, Any]]) -> List[tuple]:
+    """
+    把考试字典展开为 exam_scores 表的行
+
+    返回:
+    list: [(teacher, student_account, exam_name, subject, score, score_text, full_score), ...]
+    """
+    rows = []
+    for exam_name, subjects in (score_dict or {}).items():
+        if not isinstance(subjects, dict):
+            continue
+        for subject, value in subjects.items():
+            if isinstance(value, (list, tuple)):
+                raw_score = value[0] if len(value) > 0 else None
+                raw_full = value[1] if len(value) > 1 else None
+            else:
+                raw_score, raw_full = value, None
+            score = _to_number(raw_score)
+            # 非数字成绩（如"缺考"）原样保存在 score_text 中
+            score_text = None if score is not None or raw_score is None else str(raw_score)[:64]
+            rows.append((teacher, student_account, str(exam_name), str(subject),
+                         score, score_text, _to_number(raw_full)))
+    return rows
+
+
+def _cell(score, score_text, full_score):
+    """把一行还原为 [分数, 满分]"""
+    return [score_text if score_text is not None else _from_number(score), _from_number(full_score)]
+
+
+# ----------------------------------------------------------------------
+# 读取
+# ----------------------------------------------------------------------
+def read_exam_scores(conn, student_account: str) -> Dict[str, Dict[str, list]]:
+    """
+    读取学生全部考试成绩
+
+    返回:
+    dict: {考试名: {科目: [分数, 满分]}}，与 read_student_exam 结构相同
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT `exam_name`, `subject`, `score`, `score_text`, `full_score`
+        FROM `{SCORE_TABLE}` WHERE `student_account` = %s ORDER BY `id`
+    ''', (student_account,))
+    result = {}
+    for exam_name, subject, score, score_text, full_score in cursor.fetchall():
+        result.setdefault(exam_name, {})[subject] = _cell(score, score_text, full_score)
+    return result
+
+
+def read_students_exam_scores(conn, student_accounts: List[str]) -> Dict[str, Dict[str, Dict[str, list]]]:
+    """
+    批量读取多个学生的考试成绩
+
+    返回:
+    dict: {学生账号: {考试名: {科目: [分数, 满分]}}}，没有成绩的学生为空字典
+    """
+    result = {account: {} for account in student_accounts}
+    if not student_accounts:
+        return result
+    cursor = conn.cursor()
+    placeholders = ', '.join(['%s'] * len(student_accounts))
+    cursor.execute(f'''
+        SELECT `student_account`, `exam_name`, `subject`, `score`, `score_text`, `full_score`
+        FROM `{SCORE_TABLE}` WHERE `student_account` IN ({placeholders}) ORDER BY `id`
+    ''', tuple(student_accounts))
+    for account, exam_name, subject, score, score_text, full_score in cursor.fetchall():
+        result[account].setdefault(exam_name, {})[subject] = _cell(score, score_text, full_score)
+    return result
+
+
+def read_teacher_scores(conn, teacher_account: str) -> Dict[str, Dict[str, Dict[str, list]]]:
+    """
+    一次读取教师名下所有学生的成绩
+
+    返回:
+    dict: {学生账号: {考试名: {科目: [分数, 满分]}}}
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT `student_account`, `exam_name`, `subject`, `score`, `score_text`, `full_score`
+        FROM `{SCORE_TABLE}` WHERE `teacher` = %s ORDER BY `id`
+    ''', (teacher_account,))
+    result = {}
+    for account, exam_name, subject, score, score_text, full_score in cursor.fetchall():
+        result.setdefault(account, {}).setdefault(exam_name, {})[subject] = _cell(score, score_text, full_score)
+    return result
+
+
+def read_exam_scores_by_exam(conn, teacher_account: str, exam_name: str,
+                             subject: Optional[str] = None) -> Dict[str, Dict[str, list]]:
+    """
+    读取某次考试所有学生的成绩（走 teacher, exam_name, subject 索引）
+
+    返回:
+    dict: {学生账号: {科目: [分数, 满分]}}
+    """
+    cursor = conn.cursor()
+    sql = f'''
+        SELECT `student_account`, `subject`, `score`, `score_text`, `full_score`
+        FROM `{SCORE_TABLE}` WHERE `teacher` = %s AND `exam_name` = %s
+    '''
+    params = [teacher_account, exam_name]
+    if subject is not None:
+        sql += ' AND `subject` = %s'
+        params.append(subject)
+    cursor.execute(sql + ' ORDER BY `id`', tuple(params))
+    result = {}
+    for account, subj, score, score_text, full_score in cursor.fetchall():
+        result.setdefault(account, {})[subj] = _cell(score, score_text, full_score)
+    return result
+
+
+def read_subject_scores(conn, teacher_account: str, subject: str) -> Dict[str, Dict[str, list]]:
+    """
+    读取某科目所有学生历次考试的成绩（走 teacher, subject 索引）
+
+    返回:
+    dict: {学生账号: {考试名: [分数, 满分]}}
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT `student_account`, `exam_name`, `score`, `score_text`, `full_score`
+        FROM `{SCORE_TABLE}` WHERE `teacher` = %s AND `subject` = %s ORDER BY `id`
+    ''', (teacher_account, subject))
+    result = {}
+    for account, exam_name, score, score_text, full_score in cursor.fetchall():
+        result.setdefault(account, {})[exam_name] = _cell(score, score_text, full_score)
+    return result
+
+
+def read_teacher_exam_names(conn, teacher_account: str) -> List[str]:
+    """读取教师名下出现过的所有考试名（按首次录入顺序）"""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT `exam_name` FROM `{SCORE_TABLE}` WHERE `teacher` = %s
+        GROUP BY `exam_name` ORDER BY MIN(`id`)
+    ''', (teacher_account,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+# ----------------------------------------------------------------------
+# 写入（不提交事务，由调用方 commit）
+# ----------------------------------------------------------------------
+def write_exam_scores(conn, student_account: str, score_dict: Dict[str, Dict[str, Any]]) -> int:
+    """
+    用考试字典覆盖学生在 exam_scores 表中的成绩
+
+    只删除字典中已不存在的 (考试, 科目)，其余行按唯一键更新，保留原有的录入顺序。
+
+    返回:
+    int: 写入的成绩条数
+    """
+    teacher = teacher_of(student_account)
+    rows = score_rows(teacher, student_account, score_dict)
+    cursor = conn.cursor()
+
+    cursor.execute(f'''
+        SELECT `id`, `exam_name`, `subject` FROM `{SCORE_TABLE}`
+        WHERE `student_account` = %s FOR UPDATE
+    ''', (student_account,))
+    wanted = {(row[2], row[3]) for row in rows}
+    stale_ids = [row[0] for row in cursor.fetchall() if (row[1], row[2]) not in wanted]
+    if stale_ids:
+        placeholders = ', '.join(['%s'] * len(stale_ids))
+        cursor.execute(f'DELETE FROM `{SCORE_TABLE}` WHERE `id` IN ({placeholders})', tuple(stale_ids))
+
+    if rows:
+        cursor.executemany(f'''
+            INSERT INTO `{SCORE_TABLE}`
+                (`teacher`, `student_account`, `exam_name`, `subject`, `score`, `score_text`, `full_score`)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                `score` = VALUES(`score`),
+                `score_text` = VALUES(`score_text`),
+                `full_score` = VALUES(`full_score`)
+        ''', rows)
+    return len(rows)
+
+
+def replace_exam_rows(conn, teacher_account: str, exam_name: str,
+                      students: Dict[str, Dict[str, Any]]) -> int:
+    """
+    批量覆盖多个学生在一次考试中的成绩（不提交事务）
+
+    参数:
+    students: {学生账号: {科目: [分数, 满分]}}
+
+    返回:
+    int: 写入的成绩条数
+    """
+    if not students:
+        return 0
+    cursor = conn.cursor()
+    accounts = list(students)
+    placeholders = ', '.join(['%s'] * len(accounts))
+    cursor.execute(f'''
+        DELETE FROM `{SCORE_TABLE}`
+        WHERE `teacher` = %s AND `exam_name` = %s AND `student_account` IN ({placeholders})
+    ''', (teacher_account, exam_name, *accounts))
+
+    rows = []
+    for account, exam_data in students.items():
+        rows.extend(score_rows(teacher_account, account, {exam_name: exam_data}))
+    if rows:
+        cursor.executemany(f'''
+            INSERT INTO `{SCORE_TABLE}`
+                (`teacher`, `student_account`, `exam_name`, `subject`, `score`, `score_text`, `full_score`)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', rows)
+    return len(rows)
+
+
+def upsert_score_cells(conn, teacher_account: str, cells: List[tuple]) -> int:
+    """
+    用一条多行 INSERT ... ON DUPLICATE KEY UPDATE 写入多个成绩格（不提交事务）
+
+    参数:
+    cells: [(学生账号, 考试名, 科目, 分数, 满分), ...]
+
+    返回:
+    int: 写入的成绩条数
+    """
+    if not cells:
+        return 0
+    rows = []
+    for account, exam_name, subject, score, full_score in cells:
+        rows.extend(score_rows(teacher_account, account, {exam_name: {subject: [score, full_score]}}))
+    cursor = conn.cursor()
+    cursor.executemany(f'''
+        INSERT INTO `{SCORE_TABLE}`
+            (`teacher`, `student_account`, `exam_name`, `subject`, `score`, `score_text`, `full_score`)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            `score` = VALUES(`score`), `score_text` = VALUES(`score_text`), `full_score` = VALUES(`full_score`)
+    ''', rows)
+    return len(rows)
+
+
+def delete_student_scores(conn, student_account: str) -> int:
+    """删除学生的全部成绩"""
+    cursor = conn.cursor()
+    cursor.execute(f'DELETE FROM `{SCORE_TABLE}` WHERE `student_account` = %s', (student_account,))
+    return cursor.rowcount
@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+"""
+考试汇总表 - 按 (教师, 考试, 科目, 班级) 增量维护 人数 / 总分 / 平方和 / 最低分 / 最高分
+
+写成绩时根据新旧成绩字典的差异更新汇总行，考试列表只需要按教师读一次汇总表。
+另有一行科目为 __total__ 的汇总记录每个学生在该考试中的总分，其人数即参考人数。
+
+最低分/最高分无法随删除减量维护：被删掉（或被修改）的正好是最低分或最高分时，
+table 模式下在同一事务中用 exam_scores 的索引只重新计算这一行的最低分/最高分；
+blob 模式下没有可用的索引，该行标记为 stale，由修复命令（--stale）按考试重新计算。
+读取不加锁也不写表：汇总未构建或有 stale 行时，这部分改为从教师快照计算。
+
+修复命令:
+    python exam_summary.py                 # 重建所有教师的汇总
+    python exam_summary.py --teacher t1    # 只重建指定教师
+    python exam_summary.py --stale         # 只重建未构建的教师、重新计算 stale 的考试
+"""
+import argparse
+import re
+import sys
+from typing import Dict, Any, List, Optional, Tuple
+
+from exam_scores import SCORE_TABLE, use_score_table
+from snapshot_cache import get_teacher_snapshot
+from teacher_snapshot import load_teacher_snapshot
+
+
+SUMMARY_TABLE = 'exam_summary'
+STATE_TABLE = 'exam_summary_state'
+TOTAL_SUBJECT = '__total__'
+
+
+def create_exam_summary_tables(conn):
+    """创建考试汇总表和构建状态表"""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{SUMMARY_TABLE}` (
+            `id`          BIGINT AUTO_INCREMENT,
+            `teacher`     VARCHAR(255) NOT NULL,
+            `exam_name`   VARCHAR(255) NOT NULL,
+            `subject`     VARCHAR(255) NOT NULL,
+            `class_name`  VARCHAR(255) NOT NULL,
+            `cnt`         INT NOT NULL DEFAULT 0,
+            `total`       DOUBLE NOT NULL DEFAULT 0,
+            `sumsq`       DOUBLE NOT NULL DEFAULT 0,
+            `min_score`   DOUBLE,
+            `max_score`   DOUBLE,
+            `stale`       TINYINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (`id`),
+            UNIQUE KEY `uk_summary` (`teacher`, `exam_name`, `subject`, `class_name`)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{STATE_TABLE}` (
+            `teacher`     VARCHAR(255) NOT NULL,
+            `built`       TINYINT NOT NULL DEFAULT 0,
+            `updated_at`  TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (`teacher`)
+        )
+    ''')
+    conn.commit()
+
+
+def _number(value):
+    """取出可以参与统计的分数，非数字返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _from_number(value):
+    """DOUBLE 读出后还原：整数值返回 int"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def summary_cells(score_dict: Optional[Dict[str, Dict[str, Any]]]) -> Dict[Tuple[str, str], float]:
+    """
+    把考试字典展开为参与汇总的分数
+
+    返回:
+    dict: {(考试名, 科目): 分数}，另含 (考试名, __total__): 该学生本次考试总分
+    """
+    cells = {}
+    for exam_name, subjects in (score_dict or {}).items():
+        if not isinstance(subjects, dict):
+            continue
+        exam_total = 0
+        for subject, value in subjects.items():
+            score = _number(value[0] if isinstance(value, (list, tuple)) and value else value)
+            if score is None:
+                continue
+            cells[(exam_name, subject)] = score
+            exam_total += score
+        cells[(exam_name, TOTAL_SUBJECT)] = exam_total
+    return cells
+
+
+def summary_delta(old_class: Optional[str], old_dict, new_class: Optional[str], new_dict) -> List[tuple]:
+    """
+    计算一个学生成绩变化对汇总表的增量
+
+    返回:
+    list: [(exam_name, subject, class_name, d_cnt, d_total, d_sumsq, added_score, removed_score), ...]，按键排序
+    """
+    old_cells = summary_cells(old_dict) if old_class is not None else {}
+    new_cells = summary_cells(new_dict) if new_class is not None else {}
+    deltas = {}
+
+    def add(key, class_name, d_cnt, d_total, d_sumsq, added, removed):
+        row = deltas.setdefault((key[0], key[1], class_name), [0, 0, 0, None, None])
+        row[0] += d_cnt
+        row[1] += d_total
+        row[2] += d_sumsq
+        if added is not None:
+            row[3] = added
+        if removed is not None:
+            row[4] = removed
+
+    for key in set(old_cells) | set(new_cells):
+        old = old_cells.get(key)
+        new = new_cells.get(key)
+        if old_class == new_class and old == new:
+            continue
+        if old is not None:
+            add(key, old_class, -1, -old, -old * old, None, old)
+        if new is not None:
+            add(key, new_class, 1, new, new * new, new, None)
+
+    return [(exam, subject, class_name, *values) for (exam, subject, class_name), values in sorted(deltas.items())]
+
+
+def lock_summary_state(conn, teacher_account: str) -> bool:
+    """
+    对教师的汇总状态加共享锁，返回汇总是否已构建
+
+    写操作必须在锁住学生行之后调用，与 rebuild 的加锁顺序一致；
+    rebuild 进行中时会等待其提交，未构建时不需要写增量（构建时会包含这次修改）。
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT `built` FROM `{STATE_TABLE}` WHERE `teacher` = %s LOCK IN SHARE MODE
+    ''', (teacher_account,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def apply_summary_delta(conn, teacher_account: str, rows: List[tuple]):
+    """把增量写入汇总表（不提交事务）"""
+    if not rows:
+        return
+    cursor = conn.cursor()
+
+    # 删除的分数正好是当前最低分或最高分时，该行的最低分/最高分失效，需要重新计算
+    stale_keys = set()
+    removed_rows = [row for row in rows if row[7] is not None]
+    if removed_rows:
+        exam_names = sorted({row[0] for row in removed_rows})
+        placeholders = ', '.join(['%s'] * len(exam_names))
+        cursor.execute(f'''
+            SELECT `exam_name`, `subject`, `class_name`, `min_score`, `max_score` FROM `{SUMMARY_TABLE}`
+            WHERE `teacher` = %s AND `exam_name` IN ({placeholders}) FOR UPDATE
+        ''', (teacher_account, *exam_names))
+        bounds = {(row[0], row[1], row[2]): (row[3], row[4]) for row in cursor.fetchall()}
+        for exam, subject, class_name, *_, removed in removed_rows:
+            min_score, max_score = bounds.get((exam, subject, class_name), (None, None))
+            if min_score is None or removed <= min_score or removed >= max_score:
+                stale_keys.add((exam, subject, class_name))
+
+    cursor.executemany(f'''
+        INSERT INTO `{SUMMARY_TABLE}`
+            (`teacher`, `exam_name`, `subject`, `class_name`, `cnt`, `total`, `sumsq`, `min_score`, `max_score`, `stale`)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            `cnt` = `cnt` + VALUES(`cnt`),
+            `total` = `total` + VALUES(`total`),
+            `sumsq` = `sumsq` + VALUES(`sumsq`),
+            `min_score` = LEAST(COALESCE(`min_score`, VALUES(`min_score`)), COALESCE(VALUES(`min_score`), `min_score`)),
+            `max_score` = GREATEST(COALESCE(`max_score`, VALUES(`max_score`)), COALESCE(VALUES(`max_score`), `max_score`)),
+            `stale` = `stale` OR VALUES(`stale`)
+    ''', [(teacher_account, exam, subject, class_name, d_cnt, d_total, d_sumsq, added, added,
+           int((exam, subject, class_name) in stale_keys))
+          for exam, subject, class_name, d_cnt, d_total, d_sumsq, added, removed in rows])
+    if stale_keys and use_score_table():
+        _recompute_bounds(cursor, teacher_account, sorted(stale_keys))
+
+
+def _recompute_bounds(cursor, teacher_account: str, keys: List[tuple]):
+    """
+    table 模式下按 exam_scores 的索引重新计算这几行的最低分/最高分并清除 stale（不提交事务）
+
+    调用方已在同一事务中写入 exam_scores；加共享锁读取最新提交的成绩，避免使用事务开始时的快照。
+    """
+    # 验证teacher_account只包含字母数字和下划线
+    if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
+        raise ValueError("Invalid teacher account name")
+    table_name = f"student_{teacher_account}"
+    for exam, subject, class_name in keys:
+        if subject == TOTAL_SUBJECT:
+            # 每个学生本次考试的总分（一个班级的学生数），在这里取最低/最高
+            cursor.execute(f'''
+                SELECT SUM(COALESCE(e.`score`, 0))
+                FROM `{SCORE_TABLE}` e JOIN `{table_name}` s ON s.`账号` = e.`student_account`
+                WHERE e.`teacher` = %s AND e.`exam_name` = %s AND s.`班级` = %s
+                GROUP BY e.`student_account`
+                LOCK IN SHARE MODE
+            ''', (teacher_account, exam, class_name))
+            totals = [row[0] for row in cursor.fetchall()]
+            min_score, max_score = (min(totals), max(totals)) if totals else (None, None)
+        else:
+            cursor.execute(f'''
+                SELECT MIN(e.`score`), MAX(e.`score`)
+                FROM `{SCORE_TABLE}` e JOIN `{table_name}` s ON s.`账号` = e.`student_account`
+                WHERE e.`teacher` = %s AND e.`exam_name` = %s AND e.`subject` = %s AND s.`班级` = %s
+                LOCK IN SHARE MODE
+            ''', (teacher_account, exam, subject, class_name))
+            min_score, max_score = cursor.fetchone() or (None, None)
+        cursor.execute(f'''
+            UPDATE `{SUMMARY_TABLE}` SET `min_score` = %s, `max_score` = %s, `stale` = 0
+            WHERE `teacher` = %s AND `exam_name` = %s AND `subject` = %s AND `class_name` = %s
+        ''', (min_score, max_score, teacher_account, exam, subject, class_name))
+
+
+def record_student_change(conn, teacher_account: str, old_class, old_dict, new_class, new_dict):
+    """
+    记录一个学生的成绩或班级变化（在写成绩的同一事务中、锁住学生行之后调用）
+
+    参数:
+    old_class/old_dict: 修改前的班级和考试字典（新增学生时 old_class 为 None）
+    new_class/new_dict: 修改后的班级和考试字典（删除学生时 new_class 为 None）
+    """
+    if not lock_summary_state(conn, teacher_account):
+        return
+    apply_summary_delta(conn, teacher_account, summary_delta(old_class, old_dict, new_class, new_dict))
+
+
+def record_students_change(conn, teacher_account: str, changes: List[tuple]):
+    """
+    批量记录多个学生的变化，合并为一次增量写入（批量操作在同一事务中调用）
+
+    参数:
+    changes: [(old_class, old_dict, new_class, new_dict), ...]
+    """
+    if not changes or not lock_summary_state(conn, teacher_account):
+        return
+    rows = []
+    for old_class, old_dict, new_class, new_dict in changes:
+        rows.extend(summary_delta(old_class, old_dict, new_class, new_dict))
+    # 同一行的多个增量在一条 INSERT ... ON DUPLICATE KEY UPDATE 中依次累加，按键排序保持加锁顺序
+    rows.sort(key=lambda row: row[:3])
+    apply_summary_delta(conn, teacher_account, rows)
+
+
+def invalidate_exam_summary(conn, teacher_account: str):
+    """无法计算增量时（例如旧的考试数据无法解析）标记为未构建，由修复命令整体重建（不提交事务）"""
+    cursor = conn.cursor()
+    cursor.execute(f'UPDATE `{STATE_TABLE}` SET `built` = 0 WHERE `teacher` = %s', (teacher_account,))
+
+
+# ----------------------------------------------------------------------
+# 重建
+# ----------------------------------------------------------------------
+def _compute_groups(snapshot, exam_name: Optional[str] = None) -> Dict[tuple, list]:
+    """从快照计算汇总行 {(exam, subject, class): [cnt, total, sumsq, min, max]}，按首次出现的顺序"""
+    groups = {}
+    for class_name in snapshot.classes:
+        for student in snapshot.class_students(class_name):
+            exams = student["考试"]
+            if exam_name is not None:
+                exams = {exam_name: exams[exam_name]} if exam_name in exams else {}
+            for (exam, subject), score in summary_cells(exams).items():
+                group = groups.setdefault((exam, subject, class_name), [0, 0, 0, None, None])
+                group[0] += 1
+                group[1] += score
+                group[2] += score * score
+                group[3] = score if group[3] is None else min(group[3], score)
+                group[4] = score if group[4] is None else max(group[4], score)
+    return groups
+
+
+def _lock_for_rebuild(conn, teacher_account: str):
+    """取得教师汇总状态的排他锁（阻塞写操作的增量，直到重建提交）"""
+    cursor = conn.cursor()
+    cursor.execute(f'INSERT IGNORE INTO `{STATE_TABLE}` (`teacher`, `built`) VALUES (%s, 0)', (teacher_account,))
+    conn.commit()
+    cursor.execute(f'SELECT `built` FROM `{STATE_TABLE}` WHERE `teacher` = %s FOR UPDATE', (teacher_account,))
+    return cursor
+
+
+def rebuild_exam_summary(conn, teacher_account: str) -> int:
+    """
+    从学生表重新计算教师的全部汇总
+
+    返回:
+    int: 汇总行数
+    """
+    cursor = _lock_for_rebuild(conn, teacher_account)
+    try:
+        groups = _compute_groups(load_teacher_snapshot(conn, teacher_account))
+        cursor.execute(f'DELETE FROM `{SUMMARY_TABLE}` WHERE `teacher` = %s', (teacher_account,))
+        if groups:
+            cursor.executemany(f'''
+                INSERT INTO `{SUMMARY_TABLE}`
+                    (`teacher`, `exam_name`, `subject`, `class_name`, `cnt`, `total`, `sumsq`, `min_score`, `max_score`)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ''', [(teacher_account, *key, *values) for key, values in groups.items()])
+        cursor.execute(f'UPDATE `{STATE_TABLE}` SET `built` = 1 WHERE `teacher` = %s', (teacher_account,))
+        conn.commit()
+        return len(groups)
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def refresh_stale_exams(conn, teacher_account: str, exam_names: List[str]):
+    """重新计算被标记为 stale 的考试（原地更新，保留原有的行顺序）"""
+    cursor = _lock_for_rebuild(conn, teacher_account)
+    try:
+        snapshot = load_teacher_snapshot(conn, teacher_account)
+        for exam_name in exam_names:
+            groups = _compute_groups(snapshot, exam_name)
+            cursor.execute(f'''
+                UPDATE `{SUMMARY_TABLE}`
+                SET `cnt` = 0, `total` = 0, `sumsq` = 0, `min_score` = NULL, `max_score` = NULL, `stale` = 0
+                WHERE `teacher` = %s AND `exam_name` = %s
+            ''', (teacher_account, exam_name))
+            if groups:
+                cursor.executemany(f'''
+                    INSERT INTO `{SUMMARY_TABLE}`
+                        (`teacher`, `exam_name`, `subject`, `class_name`, `cnt`, `total`, `sumsq`, `min_score`, `max_score`)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        `cnt` = VALUES(`cnt`), `total` = VALUES(`total`), `sumsq` = VALUES(`sumsq`),
+                        `min_score` = VALUES(`min_score`), `max_score` = VALUES(`max_score`), `stale` = 0
+                ''', [(teacher_account, *key, *values) for key, values in groups.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def repair_exam_summary(conn, teacher_account: str) -> bool:
+    """
+    修复一个教师的汇总（修复命令 --stale 使用）：未构建时整体重建，有 stale 行时重新计算这些考试
+
+    失败时只打印警告，修复前读取时从快照计算。
+
+    返回:
+    bool: 汇总是否已是最新
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT `built` FROM `{STATE_TABLE}` WHERE `teacher` = %s', (teacher_account,))
+        state = cursor.fetchone()
+        if not state or not state[0]:
+            rebuild_exam_summary(conn, teacher_account)
+            return True
+        cursor.execute(f'''
+            SELECT DISTINCT `exam_name` FROM `{SUMMARY_TABLE}` WHERE `teacher` = %s AND `stale` = 1
+        ''', (teacher_account,))
+        stale_exams = [row[0] for row in cursor.fetchall()]
+        if stale_exams:
+            refresh_stale_exams(conn, teacher_account, stale_exams)
+        return True
+    except Exception as e:
+        print(f"⚠️ 教师 {teacher_account} 考试汇总修复失败: {e}")
+        return False
+
+
+# ----------------------------------------------------------------------
+# 读取
+# ----------------------------------------------------------------------
+def read_summary_rows(conn, teacher_account: str) -> List[tuple]:
+    """
+    读取教师的汇总行（只读；未构建时整体从快照计算，stale 的考试从快照重新计算）
+
+    返回:
+    list: [(exam_name, subject, class_name, cnt, total, sumsq, min_score, max_score), ...]，按首次出现的顺序
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT `built` FROM `{STATE_TABLE}` WHERE `teacher` = %s', (teacher_account,))
+    state = cursor.fetchone()
+    if not state or not state[0]:
+        groups = _compute_groups(get_teacher_snapshot(conn, teacher_account))
+        return [(*key, *values) for key, values in groups.items()]
+
+    cursor.execute(f'''
+        SELECT `exam_name`, `subject`, `class_name`, `cnt`, `total`, `sumsq`, `min_score`, `max_score`, `stale`
+        FROM `{SUMMARY_TABLE}` WHERE `teacher` = %s ORDER BY `id`
+    ''', (teacher_account,))
+    rows = cursor.fetchall()
+    stale_exams = list(dict.fromkeys(row[0] for row in rows if row[8]))
+    if not stale_exams:
+        return [row[:8] for row in rows]
+
+    # 与 refresh_stale_exams 相同：原有的行原地替换，新出现的行排在后面
+    snapshot = get_teacher_snapshot(conn, teacher_account)
+    fresh = {}
+    for exam_name in stale_exams:
+        fresh.update(_compute_groups(snapshot, exam_name))
+    stale = set(stale_exams)
+    result = []
+    for row in rows:
+        if row[0] not in stale:
+            result.append(row[:8])
+            continue
+        values = fresh.pop(row[:3], [0, 0, 0, None, None])
+        result.append((*row[:3], *values))
+    result.extend((*key, *values) for key, values in fresh.items())
+    return result
+
+
+def read_exam_list(conn, teacher_account: str) -> List[Dict[str, Any]]:
+    """
+    读取教师的考试列表（/api/exams 使用）
+
+    返回:
+    list: [{'name', 'subject', 'className', 'participants', 'avgScore', 'highestScore', 'lowestScore'}, ...]
+    """
+    exams = {}
+    for exam_name, subject, class_name, cnt, total, sumsq, min_score, max_score in read_summary_rows(conn, teacher_account):
+        if cnt <= 0:
+            continue
+        exam = exams.setdefault(exam_name, {
+            'name': exam_name,
+            'subject': '',
+            'className': '',
+            'participants': 0,
+            'total_score': 0,
+            'score_count': 0,
+            'highest_score': None,
+            'lowest_score': None,
+        })
+        if subject == TOTAL_SUBJECT:
+            exam['participants'] += cnt
+            if not exam['className']:
+                exam['className'] = class_name
+            continue
+        exam['total_score'] += total
+        exam['score_count'] += cnt
+        if not exam['subject']:
+            exam['subject'] = subject
+        if max_score is not None and (exam['highest_score'] is None or max_score > exam['highest_score']):
+            exam['highest_score'] = max_score
+        if min_score is not None and (exam['lowest_score'] is None or min_score < exam['lowest_score']):
+            exam['lowest_score'] = min_score
+
+    result = []
+    for exam in exams.values():
+        if exam['participants'] <= 0:
+            continue
+        avg_score = exam['total_score'] / exam['score_count'] if exam['score_count'] > 0 else 0
+        result.append({
+            'name': exam['name'],
+            'subject': exam['subject'],
+            'className': exam['className'],
+            'participants': exam['participants'],
+            'avgScore': round(avg_score, 1),
+            'highestScore': _from_number(exam['highest_score']) if exam['highest_score'] is not None else 0,
+            'lowestScore': _from_number(exam['lowest_score']) if exam['lowest_score'] is not None else 0,
+        })
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='重建考试汇总表')
+    parser.add_argument('--teacher', action='append', help='只重建指定教师（可重复）')
+    parser.add_argument('--stale', action='store_true', help='只重建未构建的教师、重新计算 stale 的考试')
+    args = parser.parse_args(argv)
+
+    from ALL_function import connect_db
+
+    conn = connect_db()
+    try:
+        create_exam_summary_tables(conn)
+        teachers = args.teacher
+        if not teachers:
+            cursor = conn.cursor()
+            cursor.execute('SELECT `账户` FROM `teachers` ORDER BY `账户`')
+            teachers = [row[0] for row in cursor.fetchall()]
+        failed = 0
+        for teacher in teachers:
+            if not re.match(r'^[a-zA-Z0-9_]+$', teacher):
+                print(f"❌ 无效的教师账户: {teacher}")
+                failed += 1
+                continue
+            if args.stale:
+                if repair_exam_summary(conn, teacher):
+                    print(f"✅ 教师 {teacher} 汇总已修复")
+                else:
+                    failed += 1
+                continue
+            try:
+                count = rebuild_exam_summary(conn, teacher)
+                print(f"✅ 教师 {teacher} 汇总重建完成，共 {count} 行")
+            except Exception as e:
+                print(f"❌ 教师 {teacher} 汇总重建失败: {e}")
+                failed += 1
+        return 1 if failed else 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
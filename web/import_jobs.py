@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+成绩导入后台任务 - 上传后立即返回任务 ID，由后台线程执行导入，前端轮询进度
+
+- 上传的文件保存在 IMPORT_UPLOAD_DIR（所有 worker 共享的目录）
+- 任务状态保存在 Redis 哈希 smsf_import_job:{id} 中，任何 worker 都能查询
+- 队列使用 BRPOPLPUSH 把任务移到处理中列表；执行中的任务持有一个带过期时间的锁并定期续期，
+  worker 被回收（max_requests）或崩溃后锁会过期，其他 worker 的后台线程会把任务放回队列重新执行。
+  执行出错（数据库或 Redis 暂不可用）时放回队列重新执行；任务在放回队列或结束之前一直留在处理中列表。
+  导入在一个事务中提交，中断时整体回滚，重新执行不会重复写入。
+
+后台线程在每个 gunicorn worker 中启动（见 production_server.py 的 post_fork），
+也可以单独运行: python import_jobs.py --threads 2
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional
+
+from ALL_function import connect_db
+from score_import import import_scores_csv, count_data_rows, detect_file_subjects, EXCEL_ENABLED
+
+try:
+    import redis
+    from redis_manager import redis_session_manager
+    IMPORT_JOBS_ENABLED = True
+except ImportError as e:
+    IMPORT_JOBS_ENABLED = False
+    print(f"⚠️  成绩导入后台任务未启用: {e}")
+
+
+JOB_PREFIX = 'smsf_import_job:'
+LOCK_PREFIX = 'smsf_import_lock:'
+QUEUE_KEY = 'smsf_import_queue'
+PROCESSING_KEY = 'smsf_import_processing'
+
+UPLOAD_DIR = os.getenv('IMPORT_UPLOAD_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'imports'))
+WORKER_THREADS = int(os.getenv('IMPORT_WORKER_THREADS', 1))     # 每个进程的导入线程数
+JOB_TTL = int(os.getenv('IMPORT_JOB_TTL', 7 * 24 * 3600))       # 任务记录保存时间（秒）
+LOCK_TTL = 60               # 执行锁过期时间（秒），持有者每 LOCK_TTL/3 秒续期一次
+POLL_TIMEOUT = 5            # 等待队列的阻塞时间（秒）
+MAX_ATTEMPTS = 3            # 任务最多执行次数（被中断后重新执行也计入）
+MAX_STORED_ERRORS = 200     # 任务记录中最多保存的逐行错误数
+
+ALLOWED_SUFFIXES = ('.csv', '.xlsx', '.xlsm')
+FINAL_STATUSES = ('finished', 'failed')
+
+
+class ImportJobManager:
+    """成绩导入任务管理器"""
+
+    def __init__(self):
+        self._client = None
+        self._stop = threading.Event()
+        self._threads = []
+        self._running = set()       # 本进程正在执行的任务 ID
+        self._lock = threading.Lock()
+
+    def _redis(self):
+        """获取 Redis 客户端（阻塞读取队列，读写超时要大于 POLL_TIMEOUT）"""
+        if not IMPORT_JOBS_ENABLED or not redis_session_manager.host:
+            return None
+        if self._client is None:
+            manager = redis_session_manager
+            self._client = redis.Redis(
+                host=manager.host,
+                port=manager.port,
+                password=manager.password,
+                db=manager.db,
+                socket_connect_timeout=3,
+                socket_timeout=POLL_TIMEOUT + 5,
+                health_check_interval=30,
+                decode_responses=True,
+            )
+        return self._client
+
+    def available(self) -> bool:
+        """Redis 是否可用"""
+        client = self._redis()
+        if client is None:
+            return False
+        try:
+            return bool(client.ping())
+        except redis.RedisError:
+            return False
+
+    # ------------------------------------------------------------------
+    # 创建与查询
+    # ------------------------------------------------------------------
+    def create_job(self, teacher_account: str, class_name: str, exam_name: str,
+                   filename: str, stream, full_scores: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        保存上传的文件并创建导入任务
+
+        参数:
+        filename: 上传的文件名（只用来判断类型）
+        stream: 文件内容（有 save() 方法的上传对象或二进制文件对象）
+        full_scores: 满分字典，None 时科目取表头，满分默认 100
+
+        返回:
+        dict: 任务信息（见 get_job）
+        """
+        client = self._redis()
+        if client is None:
+            raise RuntimeError("导入任务需要 Redis")
+        suffix = os.path.splitext(filename or '')[1].lower()
+        if suffix not in ALLOWED_SUFFIXES:
+            raise ValueError("只支持 CSV 或 Excel（.xlsx）文件")
+        if suffix != '.csv' and not EXCEL_ENABLED:
+            raise ValueError("服务器未安装 openpyxl，请上传 CSV 文件")
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        path = os.path.join(UPLOAD_DIR, f"{job_id}{suffix}")
+        if hasattr(stream, 'save'):
+            stream.save(path)
+        else:
+            with open(path, 'wb') as handle:
+                handle.write(stream.read())
+
+        try:
+            total_rows = count_data_rows(path)
+            subjects = detect_file_subjects(path)
+        except Exception as e:
+            os.remove(path)
+            raise ValueError(f"无法读取文件: {e}")
+
+        key = f"{JOB_PREFIX}{job_id}"
+        pipe = client.pipeline()
+        pipe.hset(key, mapping={
+            'id': job_id,
+            'teacher': teacher_account,
+            'class_name': class_name,
+            'exam_name': exam_name,
+            'filename': filename,
+            'path': path,
+            'full_scores': json.dumps(full_scores, ensure_ascii=False) if full_scores is not None else '',
+            'subjects': json.dumps(subjects, ensure_ascii=False),
+            'status': 'queued',
+            'phase': 'queued',
+            'total_rows': total_rows,
+            'rows': 0,
+            'attempts': 0,
+            'created_at': time.time(),
+        })
+        pipe.expire(key, JOB_TTL)
+        pipe.lpush(QUEUE_KEY, job_id)
+        pipe.execute()
+        print(f"✅ 已创建导入任务 {job_id}（{teacher_account} {class_name} {exam_name}，{total_rows} 行）")
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        查询任务状态
+
+        返回:
+        dict: id, status(queued/running/finished/failed), phase, rows, totalRows, percent, etaSeconds,
+              updated, created, unchanged, errors, warnings, message 等；任务不存在时返回 None
+        """
+        client = self._redis()
+        if client is None:
+            return None
+        data = client.hgetall(f"{JOB_PREFIX}{job_id}")
+        if not data:
+            return None
+
+        rows = int(data.get('rows', 0))
+        total_rows = int(data.get('total_rows', 0))
+        started_at = float(data['started_at']) if data.get('started_at') else None
+        eta = None
+        if data['status'] == 'running' and started_at and rows > 0 and total_rows > rows:
+            eta = round((time.time() - started_at) / rows * (total_rows - rows), 1)
+        elif data['status'] in FINAL_STATUSES or (total_rows and rows >= total_rows):
+            eta = 0
+        return {
+            'id': job_id,
+            'teacher': data.get('teacher'),
+            'className': data.get('class_name'),
+            'examName': data.get('exam_name'),
+            'filename': data.get('filename'),
+            'status': data['status'],
+            'phase': data.get('phase'),
+            'rows': rows,
+            'totalRows': total_rows,
+            'percent': round(rows / total_rows * 100, 1) if total_rows else (100.0 if data['status'] == 'finished' else 0.0),
+            'etaSeconds': eta,
+            'attempts': int(data.get('attempts', 0)),
+            'subjects': json.loads(data['subjects']) if data.get('subjects') else [],
+            'updated': int(data.get('updated', 0)),
+            'created': int(data.get('created', 0)),
+            'unchanged': int(data.get('unchanged', 0)),
+            'errors': json.loads(data['errors']) if data.get('errors') else [],
+            'errorCount': int(data.get('error_count', 0)),
+            'warnings': json.loads(data['warnings']) if data.get('warnings') else [],
+            'message': data.get('message', ''),
+            'elapsedMs': float(data['elapsed_ms']) if data.get('elapsed_ms') else None,
+        }
+
+    def _save_progress(self, job_id: str, result: Dict[str, Any], **fields):
+        """把导入结果写入任务记录"""
+        mapping = {
+            'phase': result.get('phase', ''),
+            'rows': result.get('rows', 0),
+            'updated': result.get('updated', 0),
+            'created': result.get('created', 0),
+            'unchanged': result.get('unchanged', 0),
+            'error_count': len(result.get('errors', [])),
+            'errors': json.dumps(result.get('errors', [])[:MAX_STORED_ERRORS], ensure_ascii=False),
+            'warnings': json.dumps(result.get('warnings', [])[:MAX_STORED_ERRORS], ensure_ascii=False),
+        }
+        mapping.update(fields)
+        self._redis().hset(f"{JOB_PREFIX}{job_id}", mapping=mapping)
+
+    # ------------------------------------------------------------------
+    # 执行
+    # ------------------------------------------------------------------
+    def run_job(self, job_id: str) -> bool:
+        """
+        执行一个任务（已被其他线程执行或已结束的任务直接跳过）
+
+        返回:
+        bool: 任务已结束、已放回队列或由其他线程执行时返回 True（可以从处理中列表删除）；
+              无法放回队列时返回 False，任务留在处理中列表，锁过期后由 requeue_stalled 放回
+        """
+        client = self._redis()
+        key = f"{JOB_PREFIX}{job_id}"
+        job = client.hgetall(key)
+        if not job or job.get('status') in FINAL_STATUSES:
+            return True
+        if not client.set(f"{LOCK_PREFIX}{job_id}", os.getpid(), nx=True, ex=LOCK_TTL):
+            return True     # 另一个线程正在执行
+
+        with self._lock:
+            self._running.add(job_id)
+        attempts = 0
+        resolved = True
+        try:
+            attempts = client.hincrby(key, 'attempts', 1)
+            if attempts > MAX_ATTEMPTS:
+                client.hset(key, mapping={'status': 'failed', 'phase': 'failed',
+                                          'message': f'任务已中断 {MAX_ATTEMPTS} 次，不再重试'})
+                self._remove_file(job.get('path'))
+                return True
+
+            client.hset(key, mapping={'status': 'running', 'phase': 'reading', 'rows': 0,
+                                      'started_at': time.time(), 'worker': f"{os.getpid()}"})
+            full_scores = json.loads(job['full_scores']) if job.get('full_scores') else None
+            conn = connect_db()
+            try:
+                result = import_scores_csv(
+                    conn, job['path'], job['class_name'], job['teacher'], job['exam_name'], full_scores,
+                    progress=lambda result: self._save_progress(job_id, result))
+            finally:
+                conn.close()
+
+            status = 'finished' if result['success'] else 'failed'
+            self._save_progress(job_id, result, status=status, message=result.get('message', ''),
+                                elapsed_ms=result['elapsed_ms'], finished_at=time.time())
+            self._remove_file(job.get('path'))
+            print(f"{'✅' if result['success'] else '❌'} 导入任务 {job_id} {status}: 共 {result['rows']} 行")
+        except Exception as e:
+            print(f"❌ 导入任务 {job_id} 执行出错: {e}")
+            resolved = self._retry_later(job, attempts, str(e))
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+            try:
+                client.delete(f"{LOCK_PREFIX}{job_id}")
+            except redis.RedisError:
+                pass    # 锁会自然过期
+        return resolved
+
+    def _retry_later(self, job: Dict[str, Any], attempts: int, message: str) -> bool:
+        """
+        执行出错（数据库或 Redis 出错）后放回队列，已执行 MAX_ATTEMPTS 次时标记为失败
+
+        返回:
+        bool: 是否已放回队列或标记为失败（Redis 也不可用时返回 False）
+        """
+        job_id = job['id']
+        key = f"{JOB_PREFIX}{job_id}"
+        try:
+            client = self._redis()
+            if attempts >= MAX_ATTEMPTS:
+                client.hset(key, mapping={'status': 'failed', 'phase': 'failed',
+                                          'message': f'任务已执行 {attempts} 次仍然出错: {message}'})
+                self._remove_file(job.get('path'))
+                return True
+            pipe = client.pipeline()
+            pipe.hset(key, mapping={'status': 'queued', 'phase': 'queued', 'message': message})
+            pipe.rpush(QUEUE_KEY, job_id)     # 放到队首，尽快重新执行
+            pipe.execute()
+            print(f"⚠️  导入任务 {job_id} 已放回队列（第 {attempts} 次执行出错）")
+            return True
+        except redis.RedisError as e:
+            print(f"⚠️  导入任务 {job_id} 无法放回队列，等待执行锁过期后重新排队: {e}")
+            return False
+
+    @staticmethod
+    def _remove_file(path: Optional[str]):
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"⚠️  删除导入文件失败: {e}")
+
+    def requeue_stalled(self) -> int:
+        """把执行锁已过期（执行者已退出）的任务放回队列，返回放回的任务数"""
+        client = self._redis()
+        requeued = 0
+        for job_id in client.lrange(PROCESSING_KEY, 0, -1):
+            if client.exists(f"{LOCK_PREFIX}{job_id}"):
+                continue
+            if job_id in self._running:
+                continue
+            if client.lrem(PROCESSING_KEY, 1, job_id) == 0:
+                continue    # 已被其他线程处理
+            status = client.hget(f"{JOB_PREFIX}{job_id}", 'status')
+            if status and status not in FINAL_STATUSES:
+                client.hset(f"{JOB_PREFIX}{job_id}", mapping={'status': 'queued', 'phase': 'queued'})
+                client.rpush(QUEUE_KEY, job_id)     # 放到队首优先执行
+                requeued += 1
+                print(f"⚠️  导入任务 {job_id} 的执行者已退出，重新排队")
+        return requeued
+
+    def process_next(self, timeout: float = POLL_TIMEOUT) -> Optional[str]:
+        """
+        从队列取出一个任务执行，队列为空时把被中断的任务放回队列
+
+        返回:
+        str: 取出的任务 ID，队列为空时返回 None
+        """
+        client = self._redis()
+        job_id = client.brpoplpush(QUEUE_KEY, PROCESSING_KEY, timeout=timeout)
+        if job_id is None:
+            self.requeue_stalled()
+            return None
+        # 任务放回队列或结束之后才从处理中列表删除，否则留给 requeue_stalled
+        if self.run_job(job_id):
+            client.lrem(PROCESSING_KEY, 1, job_id)
+        return job_id
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.process_next()
+            except redis.RedisError as e:
+                print(f"⚠️  导入任务队列暂不可用: {e}")
+                self._stop.wait(POLL_TIMEOUT)
+
+    def _heartbeat_loop(self):
+        """为本进程正在执行的任务续期执行锁"""
+        client = self._redis()
+        while not self._stop.wait(LOCK_TTL / 3):
+            with self._lock:
+                running = list(self._running)
+            for job_id in running:
+                try:
+                    client.expire(f"{LOCK_PREFIX}{job_id}", LOCK_TTL)
+                except redis.RedisError as e:
+                    print(f"⚠️  导入任务 {job_id} 续期失败: {e}")
+
+    def start_workers(self, threads: int = WORKER_THREADS) -> bool:
+        """启动后台导入线程（每个进程调用一次）"""
+        if threads <= 0 or self._redis() is None:
+            return False
+        with self._lock:
+            if self._threads:
+                return True
+            self._stop.clear()
+            for i in range(threads):
+                thread = threading.Thread(target=self._worker_loop, name=f"import-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            heartbeat = threading.Thread(target=self._heartbeat_loop, name="import-heartbeat", daemon=True)
+            heartbeat.start()
+            self._threads.append(heartbeat)
+        print(f"✅ 成绩导入后台线程已启动: {threads} 个（进程 {os.getpid()}）")
+        return True
+
+    def stop_workers(self, timeout: float = POLL_TIMEOUT + 1):
+        """停止后台线程（正在执行的任务会在锁过期后由其他进程重新执行）"""
+        self._stop.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+
+# 全局任务管理器实例
+import_job_manager = ImportJobManager()
+
+
+# 便捷函数
+def create_import_job(teacher_account: str, class_name: str, exam_name: str, filename: str, stream,
+                      full_scores: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """创建导入任务"""
+    return import_job_manager.create_job(teacher_account, class_name, exam_name, filename, stream, full_scores)
+
+
+def get_import_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """查询导入任务"""
+    return import_job_manager.get_job(job_id)
+
+
+def start_import_workers(threads: int = WORKER_THREADS) -> bool:
+    """启动当前进程的后台导入线程"""
+    return import_job_manager.start_workers(threads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='运行成绩导入后台任务')
+    parser.add_argument('--threads', type=int, default=max(WORKER_THREADS, 1), help='导入线程数')
+    args = parser.parse_args(argv)
+
+    if not import_job_manager.start_workers(args.threads):
+        print("❌ Redis 未配置，无法运行导入任务")
+        return 1
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("正在停止导入线程...")
+        import_job_manager.stop_workers()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus 指标 - /metrics 输出各路由的延迟和状态码、数据库和 Redis 调用耗时、连接池使用情况、缓存命中率和密码哈希耗时
+
+Gunicorn 的多个 worker 各自计数，Prometheus 每次只会抓到其中一个 worker。
+设置 PROMETHEUS_MULTIPROC_DIR 后 prometheus_client 使用多进程模式：每个进程把数值写入该目录下的 mmap 文件，
+/metrics 读取目录中所有文件汇总。production_server.py 在导入应用之前把它设为 worker_tmp_dir（/dev/shm）下的目录，
+启动时清空，worker 退出时删除它的存活型 Gauge 文件。
+
+指标（均以 smsf_ 开头）:
+    http_requests_total{method, route, status}          请求数（route 为路由模板，如 /api/exam-details/<int:exam_id>）
+    http_request_duration_seconds{method, route}        请求耗时分布
+    db_query_duration_seconds{operation}                SQL 耗时分布（select / insert / update / delete / other）
+    redis_command_duration_seconds{command}             Redis 命令耗时分布（管道整体记为 PIPELINE）
+    password_hash_duration_seconds                      PBKDF2 耗时分布（注册、登录、修改密码）
+    auth_duration_seconds{source}                       每个请求解析登录用户的耗时（redis / token / flask / none）
+    db_pool_connections{database, state}                连接池中使用中 / 空闲的连接数（各 worker 相加）
+    db_pool_max_connections{database}                   连接池容量（各 worker 相加）
+    db_pool_timeouts_total{database}                    借连接超时次数
+    cache_requests_total{cache, result}                 缓存查询次数，result 为 hit / hit_redis / miss / bypass
+    worker_processes                                    存活的 worker 数
+
+命中率在 Prometheus 中计算，例如:
+    sum(rate(smsf_cache_requests_total{result=~"hit.*"}[5m])) by (cache) / sum(rate(smsf_cache_requests_total[5m])) by (cache)
+
+未安装 prometheus_client 时所有函数都是空操作，/metrics 返回 404。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry, REGISTRY,
+                                   generate_latest, CONTENT_TYPE_LATEST)
+    from prometheus_client import multiprocess
+    METRICS_ENABLED = True
+except ImportError as e:
+    METRICS_ENABLED = False
+    print(f"⚠️  prometheus_client 未安装，/metrics 不可用: {e}")
+
+from sql_trace import set_statement_observer
+
+
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR') or os.getenv('prometheus_multiproc_dir')
+STATS_SYNC_INTERVAL = 1.0   # 连接池和缓存统计最多每秒同步一次（秒）
+
+DB_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0)
+REDIS_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .5, 1.0, 5.0)
+HASH_BUCKETS = (.01, .025, .05, .075, .1, .15, .2, .3, .5, 1.0)
+
+# 各缓存 stats() 中的计数字段 -> result 标签
+CACHE_RESULTS = {
+    'snapshot': {'local_hits': 'hit', 'redis_hits': 'hit_redis', 'misses': 'miss', 'bypassed': 'bypass'},
+    'exam_ranking': {'hits': 'hit', 'builds': 'miss'},
+    'teacher_groups': {'hits': 'hit', 'misses': 'miss', 'bypassed': 'bypass'},
+    'session': {'hits': 'hit', 'misses': 'miss', 'bypassed': 'bypass'},
+}
+
+_SQL_OPERATIONS = {'select', 'insert', 'update', 'delete', 'replace'}
+
+
+def _sql_operation(query) -> str:
+    """语句类型（SQL 第一个关键字）"""
+    if isinstance(query, bytes):
+        query = query[:16].decode('ascii', 'replace')
+    keyword = query.lstrip()[:7].lower()
+    for operation in _SQL_OPERATIONS:
+        if keyword.startswith(operation):
+            return operation
+    return 'other'
+
+
+def _command_name(args) -> str:
+    if not args:
+        return 'UNKNOWN'
+    name = args[0]
+    if isinstance(name, bytes):
+        name = name.decode('ascii', 'replace')
+    return str(name).split(' ', 1)[0].upper()
+
+
+class AppMetrics:
+    """应用指标（每个进程一个实例，多进程模式下由 prometheus_client 汇总）"""
+
+    def __init__(self):
+        self.requests = Counter('smsf_http_requests_total', '请求数',
+                                ['method', 'route', 'status'])
+        self.request_seconds = Histogram('smsf_http_request_duration_seconds', '请求耗时',
+                                         ['method', 'route'])
+        self.db_seconds = Histogram('smsf_db_query_duration_seconds', 'SQL 语句耗时',
+                                    ['operation'], buckets=DB_BUCKETS)
+        self.redis_seconds = Histogram('smsf_redis_command_duration_seconds', 'Redis 命令耗时',
+                                       ['command'], buckets=REDIS_BUCKETS)
+        self.hash_seconds = Histogram('smsf_password_hash_duration_seconds', 'PBKDF2 密码哈希耗时',
+                                      buckets=HASH_BUCKETS)
+        self.auth_seconds = Histogram('smsf_auth_duration_seconds', '解析登录用户耗时',
+                                      ['source'], buckets=REDIS_BUCKETS)
+        # 存活型 Gauge：只汇总仍在运行的进程，worker 退出后它的数值不再计入
+        self.pool_connections = Gauge('smsf_db_pool_connections', '连接池中的连接数',
+                                      ['database', 'state'], multiprocess_mode='livesum')
+        self.pool_max = Gauge('smsf_db_pool_max_connections', '连接池容量',
+                              ['database'], multiprocess_mode='livesum')
+        self.pool_timeouts = Counter('smsf_db_pool_timeouts', '借连接超时次数', ['database'])
+        self.cache_requests = Counter('smsf_cache_requests', '缓存查询次数', ['cache', 'result'])
+        self.workers = Gauge('smsf_worker_processes', '存活的 worker 数', multiprocess_mode='livesum')
+
+        self._db_children: Dict[str, Any] = {}
+        self._redis_children: Dict[str, Any] = {}
+        self._synced_counts: Dict[Tuple[str, ...], int] = {}    # 上次同步时的累计值，用于计算增量
+        self._next_sync = 0.0
+        self._sync_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # 请求
+    # ------------------------------------------------------------------
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        self.requests.labels(method, route, str(status)).inc()
+        self.request_seconds.labels(method, route).observe(seconds)
+
+    # ------------------------------------------------------------------
+    # 数据库 / Redis / 密码哈希
+    # ------------------------------------------------------------------
+    def observe_statement(self, query, elapsed_ms: float):
+        """sql_trace 的语句观察者"""
+        try:
+            operation = _sql_operation(query)
+            child = self._db_children.get(operation)
+            if child is None:
+                child = self._db_children.setdefault(operation, self.db_seconds.labels(operation))
+            child.observe(elapsed_ms / 1000)
+        except Exception:
+            pass
+
+    def observe_redis(self, command: str, seconds: float):
+        child = self._redis_children.get(command)
+        if child is None:
+            child = self._redis_children.setdefault(command, self.redis_seconds.labels(command))
+        child.observe(seconds)
+
+    def instrument_redis(self):
+        """给 redis-py 的命令执行和管道执行加上计时（所有模块创建的客户端都生效）"""
+        try:
+            import redis
+            from redis.client import Pipeline
+        except ImportError:
+            return
+        if getattr(redis.Redis.execute_command, '_smsf_timed', False):
+            return
+        execute_command = redis.Redis.execute_command
+        execute_pipeline = Pipeline.execute
+        observe = self.observe_redis
+
+        def timed_execute_command(client, *args, **options):
+            started = time.perf_counter()
+            try:
+                return execute_command(client, *args, **options)
+            finally:
+                observe(_command_name(args), time.perf_counter() - started)
+
+        def timed_execute_pipeline(pipe, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return execute_pipeline(pipe, *args, **kwargs)
+            finally:
+                observe('PIPELINE', time.perf_counter() - started)
+
+        timed_execute_command._smsf_timed = True
+        redis.Redis.execute_command = timed_execute_command
+        Pipeline.execute = timed_execute_pipeline
+
+    @contextmanager
+    def time_password_hash(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.hash_seconds.observe(time.perf_counter() - started)
+
+    # ------------------------------------------------------------------
+    # 连接池和缓存统计
+    # ------------------------------------------------------------------
+    def _sync_count(self, counter, labels: Tuple[str, ...], value: int):
+        """把累计计数的增量加到 Counter 上（各模块的 stats() 只提供累计值）"""
+        last = self._synced_counts.get(labels, 0)
+        if value > last:
+            counter.labels(*labels[1:]).inc(value - last)
+        # 缓存实例被重建时累计值会变小，从新的值重新开始
+        self._synced_counts[labels] = value
+
+    def sync_runtime_stats(self, force: bool = False):
+        """同步连接池使用情况和缓存命中计数（每个请求结束时调用，按 STATS_SYNC_INTERVAL 限频）"""
+        now = time.monotonic()
+        if not force and now < self._next_sync:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = now + STATS_SYNC_INTERVAL
+            from db_pool import pool_stats
+            from snapshot_cache import snapshot_cache
+            from exam_ranking import exam_ranking_cache
+            from teacher_groups import teacher_group_cache
+            from redis_manager import redis_session_manager
+
+            for database, stats in pool_stats().items():
+                self.pool_connections.labels(database, 'in_use').set(stats['in_use'])
+                self.pool_connections.labels(database, 'idle').set(stats['idle'])
+                self.pool_max.labels(database).set(stats['max_size'])
+                self._sync_count(self.pool_timeouts, ('pool', database), stats['timeouts'])
+
+            caches = {'snapshot': snapshot_cache, 'exam_ranking': exam_ranking_cache,
+                      'teacher_groups': teacher_group_cache, 'session': redis_session_manager.local_cache}
+            for cache_name, cache in caches.items():
+                stats = cache.stats()
+                for field, result in CACHE_RESULTS[cache_name].items():
+                    self._sync_count(self.cache_requests, ('cache', cache_name, result), stats.get(field, 0))
+        except Exception as e:
+            print(f"⚠️  同步运行统计失败: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def worker_started(self):
+        """worker 进程启动时调用（Gunicorn post_fork）"""
+        self._synced_counts.clear()
+        self._next_sync = 0.0
+        self.workers.set(1)
+
+    # ------------------------------------------------------------------
+    # 输出
+    # ------------------------------------------------------------------
+    def render(self) -> Tuple[bytes, str]:
+        self.sync_runtime_stats(force=True)
+        if MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# 全局指标实例
+app_metrics: Optional[AppMetrics] = None
+if METRICS_ENABLED:
+    app_metrics = AppMetrics()
+    app_metrics.instrument_redis()
+    set_statement_observer(app_metrics.observe_statement)
+    if MULTIPROC_DIR:
+        print(f"✅ Prometheus 多进程模式，指标目录: {MULTIPROC_DIR}")
+
+
+# ----------------------------------------------------------------------
+# 便捷函数
+# ----------------------------------------------------------------------
+def observe_request(method: str, route: str, status: int, seconds: float):
+    if app_metrics is not None:
+        app_metrics.observe_request(method, route, status, seconds)
+        app_metrics.sync_runtime_stats()
+
+
+def observe_auth(source: str, seconds: float):
+    if app_metrics is not None:
+        app_metrics.auth_seconds.labels(source).observe(seconds)
+
+
+@contextmanager
+def time_password_hash():
+    """统计 PBKDF2 的耗时"""
+    if app_metrics is None:
+        yield
+        return
+    with app_metrics.time_password_hash():
+        yield
+
+
+def worker_started():
+    if app_metrics is not None:
+        app_metrics.worker_started()
+
+
+def mark_worker_dead(pid: int):
+    """Gunicorn child_exit 中调用：删除已退出 worker 的存活型 Gauge 文件"""
+    if METRICS_ENABLED and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid, MULTIPROC_DIR)
+
+
+def metrics_response() -> Optional[Tuple[bytes, str]]:
+    """/metrics 的内容和 Content-Type，未启用时返回 None"""
+    if app_metrics is None:
+        return None
+    return app_metrics.render()
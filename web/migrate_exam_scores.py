@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+考试成绩迁移工具 - 把 student_{teacher}.`考试` 字段在线迁移到 exam_scores 表
+
+按 `序号` 分批读取每个教师的学生表，在进程池中解析 `考试` 字段，批量写入 exam_scores，
+每批与进度记录在同一个事务中提交，中途停止后再次运行会从上次的位置继续。
+
+迁移期间请以 SMSF_SCORE_BACKEND=dual 运行服务，update_student_score 会同时写两种存储；
+全部迁移完成后切换为 SMSF_SCORE_BACKEND=table。
+
+用法:
+    python migrate_exam_scores.py                  # 迁移所有教师
+    python migrate_exam_scores.py --teacher t1     # 只迁移指定教师
+    python migrate_exam_scores.py --restart        # 忽略进度记录，从头迁移
+"""
+import argparse
+import ast
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from ALL_function import connect_db
+from exam_scores import SCORE_TABLE, create_exam_scores_table, score_rows
+
+
+CHECKPOINT_TABLE = 'exam_scores_migration'
+
+
+def parse_exam_blob(blob):
+    """
+    解析 `考试` 字段（在进程池中运行）
+
+    返回:
+    tuple: (考试字典, 错误信息)，解析失败时考试字典为 None
+    """
+    if blob is None or not str(blob).strip():
+        return {}, None
+    try:
+        value = ast.literal_eval(blob)
+    except (ValueError, SyntaxError) as e:
+        return None, str(e)
+    if not isinstance(value, dict):
+        return None, f"不是字典: {type(value).__name__}"
+    return value, None
+
+
+class ExamScoreMigrator:
+    """考试成绩迁移器"""
+
+    def __init__(self, batch_size: int = 500, workers: int = 4, restart: bool = False):
+        """
+        初始化迁移器
+
+        Args:
+            batch_size: 每批处理的学生数
+            workers: 解析 `考试` 字段的进程数（1 表示在当前进程解析）
+            restart: 是否忽略已有进度从头迁移
+        """
+        self.batch_size = batch_size
+        self.workers = workers
+        self.restart = restart
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+        # 统计数据
+        self.total_students = 0
+        self.total_rows = 0
+        self.failed_students = []
+        self.started_at = None
+
+    def init_tables(self, conn):
+        """创建成绩表和进度表"""
+        create_exam_scores_table(conn)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS `{CHECKPOINT_TABLE}` (
+                `teacher`       VARCHAR(255) NOT NULL,
+                `last_seq`      INT NOT NULL DEFAULT 0,
+                `students`      INT NOT NULL DEFAULT 0,
+                `score_rows`    BIGINT NOT NULL DEFAULT 0,
+                `finished`      TINYINT NOT NULL DEFAULT 0,
+                `updated_at`    TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (`teacher`)
+            )
+        ''')
+        conn.commit()
+
+    def list_teachers(self, conn) -> List[str]:
+        """读取所有教师账户"""
+        cursor = conn.cursor()
+        cursor.execute('SELECT `账户` FROM `teachers` ORDER BY `账户`')
+        return [row[0] for row in cursor.fetchall() if re.match(r'^[a-zA-Z0-9_]+$', row[0])]
+
+    def load_checkpoint(self, conn, teacher: str) -> tuple:
+        """读取教师的迁移进度 (last_seq, finished)"""
+        cursor = conn.cursor()
+        if self.restart:
+            cursor.execute(f'DELETE FROM `{CHECKPOINT_TABLE}` WHERE `teacher` = %s', (teacher,))
+            conn.commit()
+            return 0, False
+        cursor.execute(f'''
+            SELECT `last_seq`, `finished` FROM `{CHECKPOINT_TABLE}` WHERE `teacher` = %s
+        ''', (teacher,))
+        row = cursor.fetchone()
+        if row is None:
+            return 0, False
+        return row[0], bool(row[1])
+
+    def parse_blobs(self, blobs):
+        """解析一批 `考试` 字段"""
+        if self.executor is None:
+            return [parse_exam_blob(blob) for blob in blobs]
+        chunksize = max(1, len(blobs) // (self.workers * 4))
+        return list(self.executor.map(parse_exam_blob, blobs, chunksize=chunksize))
+
+    def migrate_batch(self, conn, teacher: str, last_seq: int) -> Optional[int]:
+        """
+        迁移一批学生，与进度记录在同一事务中提交
+
+        返回:
+        int: 本批最后一个学生的序号，没有更多学生时返回 None
+        """
+        table_name = f"student_{teacher}"
+        cursor = conn.cursor()
+        # 锁住本批学生行：迁移期间的双写会先更新 `考试` 字段，两边按同样的顺序加锁
+        cursor.execute(f'''
+            SELECT `序号`, `账号`, `考试` FROM `{table_name}`
+            WHERE `序号` > %s ORDER BY `序号` LIMIT %s FOR UPDATE
+        ''', (last_seq, self.batch_size))
+        students = cursor.fetchall()
+        if not students:
+            conn.rollback()
+            return None
+
+        parsed = self.parse_blobs([row[2] for row in students])
+        accounts = []
+        rows = []
+        for (seq, account, _), (score_dict, error) in zip(students, parsed):
+            if score_dict is None:
+                self.failed_students.append((account, error))
+                print(f"⚠️  学生 {account} 的考试数据无法解析，已跳过: {error}")
+                continue
+            accounts.append(account)
+            rows.extend(score_rows(teacher, account, score_dict))
+
+        if accounts:
+            placeholders = ', '.join(['%s'] * len(accounts))
+            cursor.execute(f'''
+                DELETE FROM `{SCORE_TABLE}` WHERE `student_account` IN ({placeholders})
+            ''', tuple(accounts))
+        if rows:
+            cursor.executemany(f'''
+                INSERT INTO `{SCORE_TABLE}`
+                    (`teacher`, `student_account`, `exam_name`, `subject`, `score`, `score_text`, `full_score`)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ''', rows)
+
+        new_seq = students[-1][0]
+        cursor.execute(f'''
+            INSERT INTO `{CHECKPOINT_TABLE}` (`teacher`, `last_seq`, `students`, `score_rows`)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                `last_seq` = VALUES(`last_seq`),
+                `students` = `students` + VALUES(`students`),
+                `score_rows` = `score_rows` + VALUES(`score_rows`)
+        ''', (teacher, new_seq, len(accounts), len(rows)))
+        conn.commit()
+
+        self.total_students += len(accounts)
+        self.total_rows += len(rows)
+        return new_seq
+
+    def mark_finished(self, conn, teacher: str):
+        """标记教师迁移完成"""
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            INSERT INTO `{CHECKPOINT_TABLE}` (`teacher`, `finished`) VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE `finished` = 1
+        ''', (teacher,))
+        conn.commit()
+
+    def migrate_teacher(self, conn, teacher: str):
+        """迁移一个教师的全部学生"""
+        last_seq, finished = self.load_checkpoint(conn, teacher)
+        if finished:
+            print(f"✅ 教师 {teacher} 已迁移完成，跳过")
+            return
+        if last_seq:
+            print(f"教师 {teacher} 从序号 {last_seq} 之后继续迁移")
+
+        cursor = conn.cursor()
+        cursor.execute('SHOW TABLES LIKE %s', (f"student_{teacher}",))
+        if cursor.fetchone() is None:
+            self.mark_finished(conn, teacher)
+            return
+
+        while True:
+            new_seq = self.migrate_batch(conn, teacher, last_seq)
+            if new_seq is None:
+                break
+            last_seq = new_seq
+            self.report(teacher, last_seq)
+        self.mark_finished(conn, teacher)
+        print(f"✅ 教师 {teacher} 迁移完成")
+
+    def report(self, teacher: str, last_seq: int):
+        """打印迁移速度"""
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        print(f"  {teacher} 序号 {last_seq}: 学生 {self.total_students} 个，成绩 {self.total_rows} 条，"
+              f"{self.total_rows / elapsed:.0f} 条/秒，{self.total_students / elapsed:.0f} 个学生/秒")
+
+    def run(self, teachers: Optional[List[str]] = None):
+        """执行迁移"""
+        self.started_at = time.monotonic()
+        conn = connect_db()
+        try:
+            self.init_tables(conn)
+            for teacher in teachers or self.list_teachers(conn):
+                if not re.match(r'^[a-zA-Z0-9_]+$', teacher):
+                    print(f"❌ 无效的教师账户: {teacher}")
+                    continue
+                self.migrate_teacher(conn, teacher)
+        except KeyboardInterrupt:
+            # 未提交的批次会回滚，下次运行从最后一个已提交的批次继续
+            conn.rollback()
+            print("⚠️  迁移已中断，再次运行将从上次进度继续")
+        finally:
+            conn.close()
+            if self.executor is not None:
+                self.executor.shutdown()
+
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        print("=" * 50)
+        print(f"迁移学生: {self.total_students} 个")
+        print(f"写入成绩: {self.total_rows} 条")
+        print(f"解析失败: {len(self.failed_students)} 个")
+        print(f"耗时: {elapsed:.1f} 秒，平均 {self.total_rows / elapsed:.0f} 条/秒")
+        print("=" * 50)
+        return not self.failed_students
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='把学生表的 `考试` 字段迁移到 exam_scores 表')
+    parser.add_argument('--teacher', action='append', help='只迁移指定教师（可重复）')
+    parser.add_argument('--batch-size', type=int, default=500, help='每批处理的学生数')
+    parser.add_argument('--workers', type=int, default=4, help='解析 `考试` 字段的进程数')
+    parser.add_argument('--restart', action='store_true', help='忽略进度记录，从头迁移')
+    args = parser.parse_args(argv)
+
+    migrator = ExamScoreMigrator(batch_size=args.batch_size, workers=args.workers, restart=args.restart)
+    return 0 if migrator.run(args.teacher) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
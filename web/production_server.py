@@ -7,8 +7,34 @@ SMSF 生产环境服务器启动脚本
 
 import os
 import sys
+import shutil
 import platform
+
+
+def prepare_metrics_dir():
+    """
+    Gunicorn 多进程模式下的 Prometheus 指标目录（worker_tmp_dir 所在的 /dev/shm 下）
+
+    prometheus_client 在导入时根据 PROMETHEUS_MULTIPROC_DIR 决定是否使用多进程模式，
+    所以必须在导入应用之前设置；上次运行留下的文件会被计入汇总，启动时先清空。
+    """
+    if platform.system().lower() == 'windows':
+        return None     # Waitress 是单进程多线程，不需要
+    default_dir = '/dev/shm/smsf_metrics' if os.path.isdir('/dev/shm') else '/tmp/smsf_metrics'
+    path = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', default_dir)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+if __name__ == '__main__':
+    prepare_metrics_dir()
+
 from web_server import app
+from db_pool import close_all_pools, reset_all_pools
+from import_jobs import start_import_workers
+from session_sweeper import start_session_sweeper
+from metrics import worker_started, mark_worker_dead
 
 def start_production_server():
     """启动生产环境服务器"""
@@ -35,6 +61,9 @@ def start_production_server():
         try:
             from waitress import serve
             print("使用 Waitress 服务器启动...")
+            start_import_workers()
+            start_session_sweeper()
+            worker_started()
             serve(app, host=HOST, port=PORT, threads=WORKERS*4)
         except ImportError:
             print("错误: 请先安装 waitress")
@@ -60,6 +89,20 @@ def start_production_server():
                 def load(self):
                     return self.application
 
+            def post_fork(server, worker):
+                # worker 丢弃从主进程继承的数据库连接，各自建立自己的连接池
+                reset_all_pools()
+                # 每个 worker 运行自己的后台导入线程，worker 被回收后未完成的任务由其他 worker 接手
+                start_import_workers()
+                # 定时增量清理过期会话（调度锁保证每个间隔只有一个 worker 执行）
+                start_session_sweeper()
+                # 存活的 worker 数（Prometheus 多进程模式下按进程汇总）
+                worker_started()
+
+            def child_exit(server, worker):
+                # 删除已退出 worker 的存活型指标文件，连接池等 Gauge 不再计入它的数值
+                mark_worker_dead(worker.pid)
+
             # Gunicorn配置
             options = {
                 'bind': f'{HOST}:{PORT}',
@@ -71,8 +114,13 @@ def start_production_server():
                 'max_requests_jitter': 100,
                 'preload_app': True,
                 'worker_tmp_dir': '/dev/shm' if system == 'linux' else None,
+                'post_fork': post_fork,
+                'child_exit': child_exit,
             }
-            
+
+            # 主进程预加载应用时建立的连接不能被 worker 共用，fork 前先关闭
+            close_all_pools()
+
             print("使用 Gunicorn 服务器启动...")
             StandaloneApplication(app, options).run()
             
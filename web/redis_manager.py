@@ -7,7 +7,50 @@ import json
 import uuid
 from datetime import datetime, timedelta
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
+
+from session_cache import SessionCache
+from session_tokens import SessionTokenManager, SESSION_MODE, is_session_token
+
+
+# 一次往返完成会话校验：读取会话、剩余时间不足时延长、按间隔写入最后活动时间
+# KEYS[1] 会话键
+# ARGV[1] 当前时间戳（秒）        ARGV[2] 当前时间（ISO 格式）
+# ARGV[3] 最后活动时间写入间隔（秒） ARGV[4] 剩余有效期低于多少秒时延长
+# ARGV[5] 延长后的有效期（秒）     ARGV[6] 延长后的过期时间（ISO 格式）
+# 返回 {用户账号, 用户类型}（没有用户类型时为空字符串），会话无效返回 nil
+VALIDATE_AND_TOUCH_LUA = """
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    return false
+end
+local ok, data = pcall(cjson.decode, raw)
+if not ok or type(data) ~= 'table' or type(data['user_account']) ~= 'string' then
+    return false
+end
+local now = tonumber(ARGV[1])
+local ttl = redis.call('TTL', KEYS[1])
+local extend = ttl >= 0 and ttl < tonumber(ARGV[4])
+local touch = now - (tonumber(data['last_activity_ts']) or 0) >= tonumber(ARGV[3])
+if extend or touch then
+    data['last_activity'] = ARGV[2]
+    data['last_activity_ts'] = now
+    if extend then
+        data['expires_at'] = ARGV[6]
+        redis.call('SET', KEYS[1], cjson.encode(data), 'EX', ARGV[5])
+    elseif ttl > 0 then
+        redis.call('SET', KEYS[1], cjson.encode(data), 'EX', ttl)
+    else
+        redis.call('SET', KEYS[1], cjson.encode(data))
+    end
+end
+local user_type = data['user_type']
+if type(user_type) ~= 'string' then
+    user_type = ''
+end
+return {data['user_account'], user_type}
+"""
+
 
 class RedisSessionManager:
     """Redis 会话管理类"""
@@ -27,6 +70,18 @@ class RedisSessionManager:
         self._connection_status = None  # 缓存连接状态
         self._last_check_time = 0       # 上次检查时间
         self._check_interval = 30       # 检查间隔（秒）
+
+        # 会话校验（validate_and_touch）配置
+        self.touch_interval = 300               # 最后活动时间最多每 5 分钟写入一次（秒）
+        self.extend_threshold = 12 * 3600       # 剩余有效期不足 12 小时时延长（秒）
+        self.session_lifetime = 24 * 3600       # 延长后的有效期（秒）
+        self._validate_script = None
+
+        # 进程内会话缓存，删除会话时通过 Redis 频道通知所有 worker
+        self.local_cache = SessionCache()
+        # 签名令牌（SMSF_SESSION_MODE=token 时签发；两种会话 ID 都能识别，切换模式后已登录的用户不受影响）
+        self.session_mode = SESSION_MODE
+        self.tokens = SessionTokenManager(lambda: self.redis_client if self.is_connected() else None)
         
         self._initialize_connection()
     
@@ -49,6 +104,8 @@ class RedisSessionManager:
             
             # 创建客户端
             self.redis_client = redis.Redis(connection_pool=self.connection_pool)
+            # 注册会话校验脚本（执行时使用 EVALSHA，服务器上没有缓存时自动改用 EVAL）
+            self._validate_script = self.redis_client.register_script(VALIDATE_AND_TOUCH_LUA)
             
             # 快速测试连接
             self.redis_client.ping()
@@ -87,19 +144,29 @@ class RedisSessionManager:
         """生成唯一的会话ID"""
         return str(uuid.uuid4())
     
-    def create_session(self, user_account: str, expires_in_hours: int = 24) -> Optional[str]:
+    def create_session(self, user_account: str, expires_in_hours: int = 24,
+                       user_type: Optional[str] = None) -> Optional[str]:
         """
         创建用户会话
         
         Args:
             user_account: 用户账号
             expires_in_hours: 会话过期时间（小时），默认24小时
+            user_type: 用户类型（teacher / free）
             
         Returns:
-            session_id: 会话ID，失败返回None
+            session_id: 会话ID（token 模式下为签名令牌），失败返回None
         """
         if not self.is_connected():
             return None
+
+        if self.session_mode == 'token':
+            token = self.tokens.issue(user_account, user_type, expires_in_hours)
+            if token:
+                print(f"✅ 用户 {user_account} 会话令牌签发成功")
+                return token
+            # 取不到共享密钥时签发的令牌在其他 worker 上无法校验，改用 Redis 会话
+            print("⚠️  无法读取共享的会话令牌密钥，改用 Redis 会话")
             
         try:
             # 生成会话ID
@@ -108,9 +175,11 @@ class RedisSessionManager:
             # 准备会话数据
             session_data = {
                 'user_account': user_account,
+                'user_type': user_type,
                 'created_at': datetime.now().isoformat(),
                 'expires_at': (datetime.now() + timedelta(hours=expires_in_hours)).isoformat(),
                 'last_activity': datetime.now().isoformat(),
+                'last_activity_ts': int(time.time()),
                 'ip_address': None,  # 可以记录用户IP
                 'user_agent': None   # 可以记录用户浏览器信息
             }
@@ -145,10 +214,18 @@ class RedisSessionManager:
         Returns:
             session_data: 会话数据字典，不存在或过期返回None
         """
+        if is_session_token(session_id):
+            return self.tokens.session_data(session_id)
         if not self.is_connected():
             return None
+
+        self.local_cache.ensure_listener(self.redis_client)
+        session_data = self.local_cache.get_data(session_id)
+        if session_data is not None:
+            return session_data
             
         try:
+            generation = self.local_cache.generation()
             key = f"{self.prefix}{session_id}"
             session_json = self.redis_client.get(key)
             
@@ -164,6 +241,7 @@ class RedisSessionManager:
                 
                 # 更新最后活动时间
                 session_data['last_activity'] = datetime.now().isoformat()
+                session_data['last_activity_ts'] = int(time.time())
                 # 重新设置过期时间（延长会话有效期）
                 remaining_time = int((expires_at - datetime.now()).total_seconds())
                 if remaining_time > 0:
@@ -173,6 +251,7 @@ class RedisSessionManager:
                         json.dumps(session_data, ensure_ascii=False)
                     )
                 
+                self.local_cache.put(session_id, session_data.get('user_account'), session_data, generation)
                 return session_data
             else:
                 return None
@@ -181,6 +260,63 @@ class RedisSessionManager:
             print(f"❌ 获取会话失败: {e}")
             return None
     
+    def validate_and_touch(self, session_id: str) -> Optional[str]:
+        """
+        校验会话并刷新有效期，返回用户账号（见 validate_identity）
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            user_account: 用户账号，会话不存在或已过期返回None
+        """
+        identity = self.validate_identity(session_id)
+        return identity[0] if identity else None
+
+    def validate_identity(self, session_id: str) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        校验会话并刷新有效期（一次 Redis 往返）
+
+        替代每个请求的 get_session + extend_session（四五条命令、两次 JSON 编码）：
+        由服务器端脚本读取会话，剩余有效期不足 extend_threshold 时延长为 session_lifetime，
+        最后活动时间最多每 touch_interval 秒写入一次，其余请求只读不写。
+        进程内会话缓存命中时不访问 Redis。
+        
+        Args:
+            session_id: 会话ID
+            
+        Returns:
+            tuple: (用户账号, 用户类型)，会话中没有用户类型时为 None；会话不存在或已过期返回None
+        """
+        if is_session_token(session_id):
+            claims = self.tokens.verify(session_id)
+            return (claims['a'], claims.get('t')) if claims else None
+        if not session_id or not self.is_connected() or self._validate_script is None:
+            return None
+
+        self.local_cache.ensure_listener(self.redis_client)
+        identity = self.local_cache.get_identity(session_id)
+        if identity:
+            return identity
+            
+        try:
+            generation = self.local_cache.generation()
+            now = datetime.now()
+            extended_expires = now + timedelta(seconds=self.session_lifetime)
+            result = self._validate_script(
+                keys=[f"{self.prefix}{session_id}"],
+                args=[int(time.time()), now.isoformat(), self.touch_interval,
+                      self.extend_threshold, self.session_lifetime, extended_expires.isoformat()]
+            )
+            if not result:
+                return None
+            user_account, user_type = result[0], result[1] or None
+            self.local_cache.put(session_id, user_account, generation=generation, user_type=user_type)
+            return user_account, user_type
+        except Exception as e:
+            print(f"❌ 校验会话失败: {e}")
+            return None
+    
     def delete_session(self, session_id: str) -> bool:
         """
         删除会话
@@ -191,6 +327,8 @@ class RedisSessionManager:
         Returns:
             bool: 删除是否成功
         """
+        if is_session_token(session_id):
+            return self.tokens.revoke(session_id)
         if not self.is_connected():
             return False
             
@@ -210,15 +348,26 @@ class RedisSessionManager:
                 
                 # 删除会话
                 self.redis_client.delete(key)
+                self.publish_invalidation(session_id)
                 print(f"✅ 会话 {session_id} 已删除")
                 return True
             else:
+                # Redis 中已不存在（例如已过期），其他 worker 的本地缓存中可能还有
+                self.publish_invalidation(session_id)
                 return False
                 
         except Exception as e:
             print(f"❌ 删除会话失败: {e}")
             return False
     
+    def publish_invalidation(self, session_id: str):
+        """删除本进程的缓存条目，并通知所有 worker 删除"""
+        self.local_cache.evict(session_id)
+        try:
+            self.redis_client.publish(self.local_cache.channel, session_id)
+        except Exception as e:
+            print(f"❌ 发布会话失效通知失败: {e}")
+    
     def delete_user_all_sessions(self, user_account: str) -> int:
         """
         删除用户的所有会话（强制下线）
@@ -232,6 +381,9 @@ class RedisSessionManager:
         if not self.is_connected():
             return 0
             
+        # 同时撤销该用户已签发的全部令牌
+        self.tokens.revoke_user(user_account)
+
         try:
             user_sessions_key = f"user_sessions:{user_account}"
             session_ids = self.redis_client.smembers(user_sessions_key)
@@ -262,6 +414,9 @@ class RedisSessionManager:
         Returns:
             bool: 延长是否成功
         """
+        if is_session_token(session_id):
+            # 令牌的有效期写在令牌里，不能延长
+            return self.tokens.verify(session_id) is not None
         if not self.is_connected():
             return False
             
@@ -346,51 +501,25 @@ class RedisSessionManager:
     
     def cleanup_expired_sessions(self) -> int:
         """
-        清理所有过期的会话（定时任务使用）
+        清理所有过期的会话（完整扫描一遍，使用 SCAN 分批进行，不阻塞 Redis）
+
+        后台定时清理见 session_sweeper.py
         
         Returns:
             int: 清理的会话数量
         """
-        if not self.is_connected():
-            return 0
-            
-        try:
-            # 获取所有会话键
-            pattern = f"{self.prefix}*"
-            session_keys = self.redis_client.keys(pattern)
-            
-            cleaned_count = 0
-            for key in session_keys:
-                session_json = self.redis_client.get(key)
-                if session_json:
-                    try:
-                        session_data = json.loads(session_json)
-                        expires_at = datetime.fromisoformat(session_data['expires_at'])
-                        if datetime.now() > expires_at:
-                            # 会话已过期
-                            session_id = key.replace(self.prefix, '')
-                            self.delete_session(session_id)
-                            cleaned_count += 1
-                    except:
-                        # 数据格式错误，删除无效键
-                        self.redis_client.delete(key)
-                        cleaned_count += 1
-            
-            if cleaned_count > 0:
-                print(f"✅ 已清理 {cleaned_count} 个过期会话")
-            return cleaned_count
-            
-        except Exception as e:
-            print(f"❌ 清理会话失败: {e}")
-            return 0
+        from session_sweeper import sweep_all_sessions
+
+        stats = sweep_all_sessions()
+        return stats['expired'] + stats['invalid']
 
 # 全局 Redis 会话管理器实例
 redis_session_manager = RedisSessionManager()
 
 # 便捷函数
-def create_user_session(user_account: str, expires_in_hours: int = 24) -> Optional[str]:
+def create_user_session(user_account: str, expires_in_hours: int = 24, user_type: Optional[str] = None) -> Optional[str]:
     """创建会话的便捷函数"""
-    return redis_session_manager.create_session(user_account, expires_in_hours)
+    return redis_session_manager.create_session(user_account, expires_in_hours, user_type)
 
 def get_user_session(session_id: str) -> Optional[Dict[str, Any]]:
     """获取会话的便捷函数"""
@@ -406,4 +535,12 @@ def force_logout_user(user_account: str) -> int:
 
 def extend_user_session(session_id: str, additional_hours: int = 24) -> bool:
     """延长时间的便捷函数"""
-    return redis_session_manager.extend_session(session_id, additional_hours)
\ No newline at end of file
+    return redis_session_manager.extend_session(session_id, additional_hours)
+
+def validate_user_session(session_id: str) -> Optional[str]:
+    """校验会话并刷新有效期的便捷函数，返回用户账号"""
+    return redis_session_manager.validate_and_touch(session_id)
+
+def validate_user_identity(session_id: str) -> Optional[Tuple[str, Optional[str]]]:
+    """校验会话并刷新有效期的便捷函数，返回 (用户账号, 用户类型)"""
+    return redis_session_manager.validate_identity(session_id)
\ No newline at end of file
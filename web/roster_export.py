@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+花名册与成绩导出 - 一条查询 + 流式游标，逐批生成 CSV 文本
+
+export_student_account_and_password_to_csv 原来先 read_single_class，再为每个学生单独查询密码，
+并写到服务器上的文件。这里用一条 SELECT 配合 SSCursor（不把结果集整体读入内存）逐行生成 CSV，
+接口直接把生成器作为响应返回，不产生临时文件，内存占用与学生数无关。
+
+生成器产出 str，第一段以 UTF-8 BOM 开头（与原来的 utf-8-sig 文件一致，Excel 能正确识别中文）。
+"""
+import ast
+import csv
+import re
+from typing import Iterator, Iterable, List, Optional
+
+import pymysql
+
+from exam_scores import SCORE_TABLE, use_score_table, _cell
+
+
+BATCH_ROWS = 200        # 每次产出的行数
+BOM = '\ufeff'
+
+
+class _Line:
+    """csv.writer 的输出目标：writerow 直接返回格式化后的行"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(rows: Iterable[list]) -> Iterator[str]:
+    """把行分批格式化为 CSV 文本"""
+    writer = csv.writer(_Line())
+    batch = []
+    for row in rows:
+        batch.append(writer.writerow(row))
+        if len(batch) >= BATCH_ROWS:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def _table_name(teacher_account: str) -> str:
+    # 验证teacher_account只包含字母数字和下划线
+    if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
+        raise ValueError("Invalid teacher account name")
+    return f"student_{teacher_account}"
+
+
+def _stream(conn, sql: str, params: tuple) -> Iterator[tuple]:
+    """
+    用流式游标执行查询并返回逐行迭代器，读完或中途停止时关闭游标
+
+    查询在调用时立即执行（不是等到第一次迭代），出错直接抛给调用方。
+    """
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute(sql, params)
+    except Exception:
+        cursor.close()
+        raise
+    return _rows(cursor)
+
+
+def _rows(cursor) -> Iterator[tuple]:
+    try:
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+def stream_roster_csv(conn, teacher_account: str, class_name: Optional[str] = None) -> Iterator[str]:
+    """
+    导出学生账号和密码
+
+    参数:
+    conn: 数据库连接对象（生成器结束后由调用方关闭）
+    teacher_account: 教师账户
+    class_name: 班级名称；None 时导出教师名下全部班级，并增加 班级 列
+
+    返回:
+    Iterator[str]: CSV 文本片段
+    """
+    table_name = _table_name(teacher_account)
+    if class_name is None:
+        header = ['姓名', '账号', '密码', '班级']
+        sql = f'SELECT `名称`, `账号`, `密码`, `班级` FROM `{table_name}` ORDER BY `班级`, `序号`'
+        params = ()
+    else:
+        header = ['姓名', '账号', '密码']
+        sql = f'SELECT `名称`, `账号`, `密码` FROM `{table_name}` WHERE `班级` = %s ORDER BY `序号`'
+        params = (class_name,)
+
+    # 先执行查询再产出 BOM：调用方取第一段时查询出错还能返回 JSON 错误
+    rows = _stream(conn, sql, params)
+    yield BOM
+    yield from _csv_lines(_with_header(header, (list(row) for row in rows)))
+
+
+def _with_header(header: list, rows: Iterable[list]) -> Iterator[list]:
+    yield header
+    yield from rows
+
+
+def exam_subjects(conn, teacher_account: str, exam_name: str, class_name: Optional[str] = None) -> List[str]:
+    """
+    考试包含的科目（按首次出现的顺序）
+
+    table 模式下查询 exam_scores 表；否则流式扫描一遍 `考试` 字段，只保留科目名，内存占用与学生数无关。
+    """
+    table_name = _table_name(teacher_account)
+    class_filter = 'AND s.`班级` = %s' if class_name is not None else ''
+    params = (exam_name, class_name) if class_name is not None else (exam_name,)
+    subjects = {}
+    if use_score_table():
+        rows = _stream(conn, f'''
+            SELECT e.`subject` FROM `{SCORE_TABLE}` e JOIN `{table_name}` s ON s.`账号` = e.`student_account`
+            WHERE e.`exam_name` = %s {class_filter} GROUP BY e.`subject` ORDER BY MIN(e.`id`)
+        ''', params)
+        return [row[0] for row in rows]
+
+    where = 'WHERE `班级` = %s' if class_name is not None else ''
+    for (blob,) in _stream(conn, f'SELECT `考试` FROM `{table_name}` {where} ORDER BY `序号`',
+                           (class_name,) if class_name is not None else ()):
+        exam = _parse_exam(blob).get(exam_name)
+        if exam:
+            subjects.update(dict.fromkeys(exam))
+    return list(subjects)
+
+
+def _parse_exam(blob) -> dict:
+    if not blob:
+        return {}
+    try:
+        return ast.literal_eval(blob)
+    except (ValueError, SyntaxError):
+        return {}
+
+
+def stream_exam_scores_csv(conn, teacher_account: str, exam_name: str,
+                           class_name: Optional[str] = None) -> Iterator[str]:
+    """
+    导出一次考试的成绩：姓名, 账号, 班级, 各科目..., 总分
+
+    只包含参加了该考试的学生，按 班级 → 序号 排列；class_name 为 None 时导出全部班级。
+    """
+    table_name = _table_name(teacher_account)
+    subjects = exam_subjects(conn, teacher_account, exam_name, class_name)
+    header = ['姓名', '账号', '班级'] + subjects + ['总分']
+
+    if use_score_table():
+        rows = _table_score_rows(conn, table_name, exam_name, class_name, subjects)
+    else:
+        rows = _blob_score_rows(conn, table_name, exam_name, class_name, subjects)
+    # 与 stream_roster_csv 相同，查询已在产出 BOM 之前执行
+    yield BOM
+    yield from _csv_lines(_with_header(header, rows))
+
+
+def _score_row(name, account, class_name, scores: dict, subjects: List[str]) -> list:
+    total = sum(score for score in scores.values()
+                if isinstance(score, (int, float)) and not isinstance(score, bool))
+    return [name, account, class_name] + [scores.get(subject, '') for subject in subjects] + [total]
+
+
+def _blob_score_rows(conn, table_name, exam_name, class_name, subjects) -> Iterator[list]:
+    where = 'WHERE `班级` = %s' if class_name is not None else ''
+    sql = f'SELECT `名称`, `账号`, `班级`, `考试` FROM `{table_name}` {where} ORDER BY `班级`, `序号`'
+    return _blob_rows(_stream(conn, sql, (class_name,) if class_name is not None else ()), exam_name, subjects)
+
+
+def _blob_rows(rows: Iterable[tuple], exam_name, subjects) -> Iterator[list]:
+    for name, account, student_class, blob in rows:
+        exam = _parse_exam(blob).get(exam_name)
+        if exam is None:
+            continue
+        yield _score_row(name, account, student_class, {subject: value[0] for subject, value in exam.items()}, subjects)
+
+
+def _table_score_rows(conn, table_name, exam_name, class_name, subjects) -> Iterator[list]:
+    class_filter = 'AND s.`班级` = %s' if class_name is not None else ''
+    params = (exam_name, class_name) if class_name is not None else (exam_name,)
+    sql = f'''
+        SELECT s.`名称`, s.`账号`, s.`班级`, e.`subject`, e.`score`, e.`score_text`, e.`full_score`
+        FROM `{table_name}` s JOIN `{SCORE_TABLE}` e ON e.`student_account` = s.`账号`
+        WHERE e.`exam_name` = %s {class_filter}
+        ORDER BY s.`班级`, s.`序号`, e.`id`
+    '''
+    return _table_rows(_stream(conn, sql, params), subjects)
+
+
+def _table_rows(rows: Iterable[tuple], subjects) -> Iterator[list]:
+    # 同一学生的成绩行相邻，凑齐一个学生后输出一行
+    current = None
+    scores = {}
+    for name, account, student_class, subject, score, score_text, full_score in rows:
+        if current is not None and current[1] != account:
+            yield _score_row(*current, scores, subjects)
+            scores = {}
+        current = (name, account, student_class)
+        scores[subject] = _cell(score, score_text, full_score)[0]
+    if current is not None:
+        yield _score_row(*current, scores, subjects)
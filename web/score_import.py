@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+CSV/Excel 成绩导入 - 单次读取文件，一次查询花名册，所有修改在一个事务中批量写入
+
+原来的 csv_updata 每读一行就调用 read_csv_and_update_scores，后者重新打开并扫描整个文件找同一个学生，
+再按科目逐个调用 update_student_score（每次都提交整个 `考试` 字段），50 名学生 × 9 科就要上千次查询。
+现在按行流式读取 CSV，先在内存中算出每个学生的新考试字典，最后通过 persist_exam_changes 批量写入并提交一次。
+
+CSV 格式（Excel 文件读取第一个工作表，格式相同）:
+    姓名,学号,语文,数学,英语
+    张三,001,85,92,78
+"""
+import ast
+import csv
+import math
+import re
+import time
+from typing import Dict, Any, List, Optional, Callable, Iterator
+
+from ALL_function import persist_exam_changes
+from exam_scores import use_score_table, read_students_exam_scores
+from snapshot_cache import bump_teacher_version
+from student_roster import insert_students
+
+try:
+    import openpyxl
+    EXCEL_ENABLED = True
+except ImportError as e:
+    EXCEL_ENABLED = False
+    print(f"⚠️  openpyxl 未安装，成绩导入只支持 CSV: {e}")
+
+
+NAME_COLUMNS = ["姓名", "学生姓名", "Name", "student_name"]
+ACCOUNT_COLUMNS = ["账号", "student_id"]
+# 标识列（非科目列），与 detect_csv_subjects 相同
+IDENTIFIER_COLUMNS = ["姓名", "学号", "ID", "学生姓名", "账号", "Name", "student_name", "student_id"]
+DEFAULT_FULL_SCORE = 100
+PROGRESS_EVERY = 100        # 每处理多少行报告一次进度
+EXCEL_SUFFIXES = ('.xlsx', '.xlsm')
+
+
+def _is_excel(source) -> bool:
+    return isinstance(source, str) and source.lower().endswith(EXCEL_SUFFIXES)
+
+
+def _cell_text(value) -> str:
+    """Excel 单元格转换为与 CSV 相同的文本（整数值的浮点数去掉小数部分）"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+class ScoreRows:
+    """成绩文件的数据行迭代器，用完后调用 close() 关闭文件"""
+
+    def __init__(self, rows: Iterator[Dict[str, str]], close: Callable[[], None]):
+        self._rows = rows
+        self._close = close
+
+    def __iter__(self):
+        return self._rows
+
+    def close(self):
+        self._close()
+
+
+def open_score_table(source) -> tuple:
+    """
+    打开成绩文件
+
+    参数:
+    source: CSV/Excel 文件路径，或已打开的 CSV 文本文件对象
+
+    返回:
+    tuple: (表头列表, ScoreRows)，每行是 {表头: 文本}
+    """
+    if _is_excel(source):
+        if not EXCEL_ENABLED:
+            raise ValueError("读取 Excel 文件需要安装 openpyxl")
+        workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        values = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = [_cell_text(value) for value in (next(values, None) or ())]
+        rows = ({header: _cell_text(value) for header, value in zip(headers, row) if header}
+                for row in values if any(value is not None for value in row))
+        return headers, ScoreRows(rows, workbook.close)
+
+    if isinstance(source, str):
+        handle = open(source, 'r', encoding='utf-8-sig', newline='')
+        close = handle.close
+    else:
+        handle = source
+        close = lambda: None
+    reader = csv.DictReader(handle)
+    return reader.fieldnames or [], ScoreRows(iter(reader), close)
+
+
+def count_data_rows(path: str) -> int:
+    """统计成绩文件的数据行数（不含表头），用于估算剩余时间"""
+    if _is_excel(path):
+        if not EXCEL_ENABLED:
+            return 0
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        try:
+            return max((workbook.worksheets[0].max_row or 1) - 1, 0)
+        finally:
+            workbook.close()
+    with open(path, 'r', encoding='utf-8-sig', newline='') as handle:
+        return max(sum(1 for _ in csv.reader(handle)) - 1, 0)
+
+
+def detect_file_subjects(path: str) -> List[str]:
+    """检测成绩文件中的科目列（与 detect_csv_subjects 相同，支持 Excel）"""
+    headers, rows = open_score_table(path)
+    rows.close()
+    return [header for header in headers if header not in IDENTIFIER_COLUMNS]
+
+
+class CsvScoreImporter:
+    """CSV 成绩导入器"""
+
+    def __init__(self, conn, teacher_account: str, class_name: str, exam_name: str,
+                 full_scores: Optional[Dict[str, Any]] = None,
+                 progress: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        初始化导入器
+
+        Args:
+            conn: 数据库连接对象
+            teacher_account: 教师账户
+            class_name: 班级名称（CSV 中不存在于班级的学生会被创建到该班级）
+            exam_name: 考试名称
+            full_scores: 满分字典 {科目: 满分}；为 None 时科目取 CSV 表头，满分默认 100
+            progress: 进度回调，参数为当前的统计结果
+        """
+        # 验证teacher_account只包含字母数字和下划线
+        if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
+            raise ValueError("Invalid teacher account name")
+        self.conn = conn
+        self.teacher = teacher_account
+        self.table_name = f"student_{teacher_account}"
+        self.class_name = class_name
+        self.exam_name = exam_name
+        self.full_scores = full_scores
+        self.progress = progress
+
+        self.result = {
+            'success': False,
+            'phase': 'reading',
+            'rows': 0,              # 已读取的数据行数
+            'updated': 0,           # 成绩发生变化的已有学生数
+            'created': 0,           # 新创建的学生数
+            'unchanged': 0,         # 成绩没有变化的学生数
+            'score_rows': 0,        # 写入 exam_scores 的成绩条数
+            'statements': 0,        # 执行的写语句数
+            'errors': [],           # [{'line': 行号, 'name': 姓名, 'message': 错误}]
+            'warnings': [],
+            'elapsed_ms': 0.0
+        }
+
+    def _row_error(self, line: int, name: str, message: str):
+        self.result['errors'].append({'line': line, 'name': name, 'message': message})
+
+    def _report(self, phase: Optional[str] = None):
+        if phase:
+            self.result['phase'] = phase
+        if self.progress:
+            self.progress(self.result)
+
+    def load_roster(self) -> tuple:
+        """
+        一次读出班级的全部学生并加锁
+
+        返回:
+        tuple: ({学生账号: (姓名, 考试字典)}, {姓名: 学生账号})，考试数据无法解析的学生考试字典为 None
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT `账号`, `名称`, `考试` FROM `{self.table_name}`
+            WHERE `班级` = %s ORDER BY `序号` FOR UPDATE
+        ''', (self.class_name,))
+        rows = cursor.fetchall()
+        if use_score_table():
+            scores = read_students_exam_scores(self.conn, [row[0] for row in rows])
+            roster = {account: (name, scores[account]) for account, name, _ in rows}
+        else:
+            roster = {}
+            for account, name, blob in rows:
+                try:
+                    roster[account] = (name, ast.literal_eval(blob) if blob else {})
+                except (ValueError, SyntaxError) as e:
+                    print(f"⚠️  学生 {account} 的考试数据无法解析: {e}")
+                    roster[account] = (name, None)
+
+        by_name = {}
+        for account, (name, _) in roster.items():
+            if name in by_name:
+                self.result['warnings'].append(f"班级中有重名学生 {name}，按姓名匹配时使用 {account}")
+            by_name[name] = account
+        return roster, by_name
+
+    def _parse_score(self, line, name, subject, value):
+        """解析单元格中的分数，空白返回 None，无法解析时记录错误并返回 False"""
+        if value is None or value.strip() == "":
+            return None
+        try:
+            score = float(value)
+        except ValueError:
+            score = None
+        # nan / inf 写入 `考试` 字段后无法用 literal_eval 读回
+        if score is None or not math.isfinite(score):
+            self._row_error(line, name, f"科目 {subject} 的成绩 '{value}' 不是有效数字")
+            return False
+        return score
+
+    def build_exam(self, line, name, row, subjects, old_exam):
+        """
+        按 CSV 行计算学生在本次考试中的新成绩
+
+        考试不存在时按满分字典（或表头）创建，缺少或无效的成绩记为 0 分；
+        考试已存在时只更新已有科目中有有效成绩的单元格。
+        """
+        if old_exam is None:
+            if self.full_scores is not None:
+                full = self.full_scores
+            else:
+                full = {subject: DEFAULT_FULL_SCORE for subject in subjects}
+            exam = {}
+            for subject, full_score in full.items():
+                score = self._parse_score(line, name, subject, row.get(subject))
+                exam[subject] = [score if score else 0, full_score]
+            return exam
+
+        exam = {subject: list(value) for subject, value in old_exam.items()}
+        for subject in subjects:
+            score = self._parse_score(line, name, subject, row.get(subject))
+            if score is None or score is False:
+                continue
+            if subject in exam:
+                exam[subject] = [score, exam[subject][1]]
+        return exam
+
+    def run(self, source) -> Dict[str, Any]:
+        """
+        执行导入
+
+        参数:
+        source: CSV/Excel 文件路径或已打开的 CSV 文本文件对象
+
+        返回:
+        dict: 导入结果（见 __init__ 中的 result）
+        """
+        started = time.perf_counter()
+        rows = None
+        try:
+            headers, rows = open_score_table(source)
+            self._import(headers, rows)
+        except Exception as e:
+            print(f"导入成绩时发生错误: {e}")
+            try:
+                self.conn.rollback()
+            except Exception:
+                pass
+            self.result['success'] = False
+            self.result['message'] = str(e)
+        finally:
+            if rows is not None:
+                rows.close()
+            self.result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        self._report('finished' if self.result['success'] else 'failed')
+        return self.result
+
+    def _import(self, headers, reader):
+        name_col = next((col for col in headers if col in NAME_COLUMNS), None)
+        if name_col is None:
+            self.result['message'] = "文件中未找到学生姓名列"
+            print("错误：文件中未找到学生姓名列")
+            return
+        account_col = next((col for col in headers if col in ACCOUNT_COLUMNS), None)
+        subjects = [header for header in headers if header not in IDENTIFIER_COLUMNS]
+
+        roster, by_name = self.load_roster()
+        new_exams: Dict[str, dict] = {}         # 已有学生账号 -> 新的考试成绩
+        new_students: Dict[str, dict] = {}      # 新学生姓名 -> 考试成绩
+        seen_lines: Dict[str, int] = {}
+
+        # 第 1 行是表头
+        for line, row in enumerate(reader, start=2):
+            self.result['rows'] += 1
+            name = (row.get(name_col) or "").strip()
+            account = (row.get(account_col) or "").strip() if account_col else ""
+            if not name and not account:
+                self._row_error(line, name, "缺少学生姓名")
+                continue
+            if account not in roster:
+                account = by_name.get(name, "")
+            if not account and not name:
+                self._row_error(line, name, "账号不在该班级中且缺少学生姓名")
+                continue
+
+            key = account or f"新学生:{name}"
+            if key in seen_lines:
+                self.result['warnings'].append(f"第 {line} 行与第 {seen_lines[key]} 行是同一个学生 {name}，使用后一行")
+            seen_lines[key] = line
+
+            if account:
+                old_dict = roster[account][1]
+                if old_dict is None:
+                    self._row_error(line, name, "该学生已有的考试数据无法解析，未导入")
+                    continue
+                new_exams[account] = self.build_exam(line, name, row, subjects, old_dict.get(self.exam_name))
+            else:
+                new_students[name] = self.build_exam(line, name, row, subjects, None)
+
+            if self.result['rows'] % PROGRESS_EVERY == 0:
+                self._report()
+
+        self._report('writing')
+        changes = []
+        for account, exam in new_exams.items():
+            old_dict = roster[account][1]
+            if old_dict.get(self.exam_name) == exam:
+                self.result['unchanged'] += 1
+                continue
+            new_dict = dict(old_dict)
+            new_dict[self.exam_name] = exam
+            changes.append((account, self.class_name, old_dict, self.class_name, new_dict))
+        self.result['updated'] = len(changes)
+        if new_students:
+            changes.extend(self.insert_students(new_students))
+
+        written = persist_exam_changes(self.conn, self.teacher, self.exam_name, changes)
+        self.result['score_rows'] = written['score_rows']
+        self.result['statements'] += written['statements']
+        self.conn.commit()
+        bump_teacher_version(self.teacher, [self.exam_name])
+        self.result['success'] = True
+        print(f"✅ CSV数据更新完成: 更新 {self.result['updated']} 名，新建 {self.result['created']} 名，"
+              f"错误 {len(self.result['errors'])} 行")
+
+    def insert_students(self, new_students: Dict[str, dict]) -> List[tuple]:
+        """
+        在同一事务中批量创建 CSV 中有、班级中没有的学生（账号编号从 student_sequences 原子分配）
+
+        返回:
+        list: 新学生的变化记录，供 persist_exam_changes 写入考试成绩
+        """
+        created = insert_students(self.conn, self.teacher,
+                                  [(name, self.class_name, "{}") for name in new_students])
+        changes = [(student['account'], None, {}, self.class_name, {self.exam_name: new_students[student['name']]})
+                   for student in created]
+        self.result['created'] = len(created)
+        self.result['statements'] += 2
+        return changes
+
+
+def import_scores_csv(conn, source, class_name: str, teacher_account: str, exam_name: str,
+                      full_scores: Optional[Dict[str, Any]] = None,
+                      progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """从 CSV/Excel 导入一个班级的考试成绩，返回导入结果"""
+    importer = CsvScoreImporter(conn, teacher_account, class_name, exam_name, full_scores, progress)
+    return importer.run(source)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+进程内会话缓存 - 在 Redis 前面缓存已校验过的会话，命中时不访问 Redis
+
+每个 gunicorn worker 有自己的一份有界 LRU，条目最多保存 SESSION_CACHE_TTL 秒。
+删除会话（退出登录、强制下线、清理过期会话）时在 Redis 频道上发布会话 ID，
+每个 worker 的订阅线程收到后立即删除本地条目，强制下线在毫秒级内对所有 worker 生效。
+
+订阅连接断开期间收不到失效通知，此时不使用本地缓存（全部回到 Redis 校验），
+重新订阅成功后清空缓存再启用。
+
+环境变量:
+    SESSION_CACHE_TTL    本地条目的最长保存时间（秒，默认 30，设为 0 关闭本地缓存）
+    SESSION_CACHE_SIZE   每个进程最多缓存的会话数（默认 10000）
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+
+INVALIDATE_CHANNEL = 'smsf_session_invalidate'
+INVALIDATE_ALL = '*'                                            # 清空所有 worker 的本地缓存
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 30))
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+RETRY_INTERVAL = 5                                              # 订阅断开后多久重连（秒）
+
+
+class SessionCache:
+    """进程内会话缓存（session_id -> 用户账号、用户类型和会话数据）"""
+
+    def __init__(self, ttl: float = SESSION_CACHE_TTL, size: int = SESSION_CACHE_SIZE,
+                 channel: str = INVALIDATE_CHANNEL):
+        self.ttl = ttl
+        self.size = size
+        self.channel = channel
+        self._entries = OrderedDict()   # session_id -> (过期时间, 用户账号, 会话数据或 None, 用户类型)
+        self._lock = threading.Lock()
+        self._generation = 0            # 每次失效加一，防止校验期间被删除的会话又被写回缓存
+        self._listening = False
+        self._listener_pid = None
+
+        # 统计数据
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self._listening
+
+    # ------------------------------------------------------------------
+    # 读写
+    # ------------------------------------------------------------------
+    def _lookup(self, session_id: str):
+        if not self.enabled:
+            self.bypassed += 1
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[session_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry
+
+    def get_account(self, session_id: str) -> Optional[str]:
+        """缓存的用户账号，未命中返回 None"""
+        entry = self._lookup(session_id)
+        return entry[1] if entry is not None else None
+
+    def get_identity(self, session_id: str) -> Optional[Tuple[str, Optional[str]]]:
+        """缓存的 (用户账号, 用户类型)，未命中返回 None"""
+        entry = self._lookup(session_id)
+        return (entry[1], entry[3]) if entry is not None else None
+
+    def get_data(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """缓存的会话数据（副本），未命中或只缓存了账号时返回 None"""
+        entry = self._lookup(session_id)
+        if entry is None or entry[2] is None:
+            return None
+        return dict(entry[2])
+
+    def generation(self) -> int:
+        """查询 Redis 之前取得，写入缓存时传给 put"""
+        return self._generation
+
+    def put(self, session_id: str, user_account: str, session_data: Optional[Dict[str, Any]] = None,
+            generation: Optional[int] = None, user_type: Optional[str] = None):
+        """
+        缓存校验通过的会话
+
+        参数:
+        generation: 查询 Redis 之前的 generation()；期间发生过失效时不写入
+        user_type: 用户类型（传入 session_data 时取其中的 user_type）
+        """
+        if not self.enabled or not user_account:
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            entry = self._entries.get(session_id)
+            if session_data is None and entry is not None and entry[1] == user_account:
+                session_data = entry[2]
+            if session_data is not None:
+                user_type = session_data.get('user_type')
+            self._entries[session_id] = (expires, user_account,
+                                         dict(session_data) if session_data is not None else None, user_type)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def evict(self, session_id: str):
+        """删除本地条目（INVALIDATE_ALL 清空全部）"""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if session_id == INVALIDATE_ALL:
+                self._entries.clear()
+            else:
+                self._entries.pop(session_id, None)
+
+    def clear(self):
+        self.evict(INVALIDATE_ALL)
+
+    def stats(self):
+        """缓存命中情况"""
+        with self._lock:
+            size = len(self._entries)
+        return {'hits': self.hits, 'misses': self.misses, 'bypassed': self.bypassed,
+                'invalidations': self.invalidations, 'size': size, 'listening': self._listening}
+
+    # ------------------------------------------------------------------
+    # 失效通知
+    # ------------------------------------------------------------------
+    def _set_listening(self, listening: bool):
+        # 订阅建立或断开时都清空：断开期间可能漏掉了失效通知
+        self.clear()
+        self._listening = listening
+
+    def ensure_listener(self, client):
+        """
+        确保当前进程有订阅线程（每个请求调用，只比较一次进程号）
+
+        gunicorn 预加载应用后 fork 出的 worker 没有主进程的线程，第一次使用时在 worker 中启动。
+        """
+        if self.ttl <= 0 or client is None:
+            return
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener_pid == pid:
+                return
+            self._listener_pid = pid
+            # 从主进程继承的条目没有经过本进程的订阅保护
+            self._entries.clear()
+            self._listening = False
+        thread = threading.Thread(target=self._listen, args=(client,), name="session-invalidate", daemon=True)
+        thread.start()
+
+    def _listen(self, client):
+        while True:
+            pubsub = None
+            try:
+                pubsub = client.pubsub()
+                pubsub.subscribe(self.channel)
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    if message['type'] == 'subscribe':
+                        self._set_listening(True)
+                    elif message['type'] == 'message':
+                        data = message['data']
+                        if isinstance(data, bytes):
+                            data = data.decode('utf-8', 'replace')
+                        self.evict(data)
+            except Exception as e:
+                if self._listening:
+                    print(f"⚠️  会话失效通知订阅中断，暂停本地会话缓存: {e}")
+                self._set_listening(False)
+                time.sleep(RETRY_INTERVAL)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
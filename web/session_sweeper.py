@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+过期会话清理 - 用 SCAN 增量扫描，替代 KEYS smsf_session:* 的全量清理
+
+原来的 cleanup_expired_sessions 先 KEYS 取出全部会话键（键多时阻塞 Redis），
+再对每个键 GET + delete_session（又一次 GET、SREM、DEL）。这里:
+- 用 SCAN 分批扫描，游标保存在 Redis 中，下一次从上次停下的位置继续（所有 worker 共用）
+- 每批用一次 MGET 读取会话，过期或损坏的会话在一个管道中 DEL + SREM，并发布失效通知
+- 扫描完会话后再扫描 user_sessions:* 集合，删除已经不存在的会话 ID（会话键自然过期后留下的成员）
+- 每次运行有时间预算，超过预算就保存游标退出
+
+每个进程启动一个后台线程，每 SESSION_SWEEP_INTERVAL 秒运行一次；
+调度锁保证同一时间段内只有一个 worker 真正执行。也可以用命令行手动清理:
+    python session_sweeper.py            # 完整扫描一遍
+    python session_sweeper.py --loop     # 前台按间隔持续运行
+
+环境变量:
+    SESSION_SWEEP_INTERVAL     运行间隔（秒，默认 60，设为 0 不启动后台线程）
+    SESSION_SWEEP_BUDGET_MS    每次运行的时间预算（毫秒，默认 50）
+    SESSION_SWEEP_BATCH        每次 SCAN 的 COUNT（默认 500）
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, List, Tuple
+
+from redis_manager import redis_session_manager
+
+
+CURSOR_KEY = 'smsf_session_sweep:cursor'
+SCHEDULE_LOCK_KEY = 'smsf_session_sweep:lock'
+USER_SESSIONS_PREFIX = 'user_sessions:'
+PHASE_SESSIONS = 'sessions'
+PHASE_USERS = 'users'
+SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 60))
+SWEEP_BUDGET_MS = float(os.getenv('SESSION_SWEEP_BUDGET_MS', 50))
+SWEEP_BATCH = int(os.getenv('SESSION_SWEEP_BATCH', 500))
+
+
+class SessionSweeper:
+    """增量清理过期会话和 user_sessions 集合中的失效成员"""
+
+    def __init__(self, manager=redis_session_manager, batch: int = SWEEP_BATCH):
+        self.manager = manager
+        self.batch = batch
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        manager = self.manager
+        return manager.redis_client if manager.is_connected() else None
+
+    # ------------------------------------------------------------------
+    # 单批处理
+    # ------------------------------------------------------------------
+    def _sweep_session_keys(self, client, keys: List[str], stats: Dict[str, int]):
+        """检查一批会话键，删除已过期或无法解析的会话"""
+        if not keys:
+            return
+        stats['scanned'] += len(keys)
+        now = datetime.now()
+        removed: List[Tuple[str, str, Optional[str]]] = []     # (键, 会话ID, 用户账号)
+        for key, session_json in zip(keys, client.mget(keys)):
+            if session_json is None:
+                continue    # 扫描后已被删除或自然过期
+            session_id = key[len(self.manager.prefix):]
+            try:
+                session_data = json.loads(session_json)
+                if now <= datetime.fromisoformat(session_data['expires_at']):
+                    continue
+                removed.append((key, session_id, session_data.get('user_account')))
+                stats['expired'] += 1
+            except (ValueError, KeyError, TypeError):
+                # 数据格式错误，删除无效键
+                removed.append((key, session_id, None))
+                stats['invalid'] += 1
+        if not removed:
+            return
+
+        channel = self.manager.local_cache.channel
+        pipe = client.pipeline(transaction=False)
+        for key, session_id, user_account in removed:
+            pipe.delete(key)
+            if user_account:
+                pipe.srem(f"{USER_SESSIONS_PREFIX}{user_account}", session_id)
+            pipe.publish(channel, session_id)
+        pipe.execute()
+        for _, session_id, _ in removed:
+            self.manager.local_cache.evict(session_id)
+
+    def _sweep_user_sets(self, client, keys: List[str], stats: Dict[str, int]):
+        """删除 user_sessions 集合中对应会话已不存在的成员"""
+        if not keys:
+            return
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.smembers(key)
+        members = [(key, session_id) for key, session_ids in zip(keys, pipe.execute())
+                   for session_id in session_ids]
+        if not members:
+            return
+
+        pipe = client.pipeline(transaction=False)
+        for _, session_id in members:
+            pipe.exists(f"{self.manager.prefix}{session_id}")
+        dangling = [member for member, exists in zip(members, pipe.execute()) if not exists]
+        if not dangling:
+            return
+
+        pipe = client.pipeline(transaction=False)
+        for key, session_id in dangling:
+            pipe.srem(key, session_id)
+        pipe.execute()
+        stats['dangling'] += len(dangling)
+
+    def _sweep(self, client, phase: str, cursor: int, deadline: Optional[float],
+               stats: Dict[str, int]) -> Tuple[str, int]:
+        """
+        从 (phase, cursor) 开始扫描，直到超过 deadline 或扫描完一整遍（会话键和用户会话集合）
+
+        返回:
+        tuple: 下次继续的 (phase, cursor)
+        """
+        while True:
+            if phase == PHASE_SESSIONS:
+                cursor, keys = client.scan(cursor, match=f"{self.manager.prefix}*", count=self.batch)
+                self._sweep_session_keys(client, keys, stats)
+            else:
+                cursor, keys = client.scan(cursor, match=f"{USER_SESSIONS_PREFIX}*", count=self.batch)
+                self._sweep_user_sets(client, keys, stats)
+            if cursor == 0:
+                if phase == PHASE_USERS:
+                    stats['passes'] += 1
+                    return PHASE_SESSIONS, 0
+                phase = PHASE_USERS if phase == PHASE_SESSIONS else PHASE_SESSIONS
+            if deadline is not None and time.perf_counter() >= deadline:
+                return phase, cursor
+
+    @staticmethod
+    def _new_stats() -> Dict[str, int]:
+        return {'scanned': 0, 'expired': 0, 'invalid': 0, 'dangling': 0, 'passes': 0}
+
+    @staticmethod
+    def _report(stats: Dict[str, int]):
+        if stats['expired'] or stats['invalid'] or stats['dangling']:
+            print(f"✅ 会话清理: 过期 {stats['expired']} 个，无效 {stats['invalid']} 个，"
+                  f"失效的用户会话记录 {stats['dangling']} 条")
+
+    # ------------------------------------------------------------------
+    # 运行
+    # ------------------------------------------------------------------
+    def tick(self, budget_ms: float = SWEEP_BUDGET_MS, interval: float = SWEEP_INTERVAL) -> Optional[Dict[str, int]]:
+        """
+        按时间预算运行一次，从保存的游标继续（后台线程调用）
+
+        返回:
+        dict: 本次的统计；Redis 不可用或本时间段已由其他 worker 执行时返回 None
+        """
+        client = self._client()
+        if client is None:
+            return None
+        try:
+            # 调度锁在本时间段结束前自然过期，不主动释放：每个间隔只有一个 worker 执行
+            if interval > 0 and not client.set(SCHEDULE_LOCK_KEY, os.getpid(), nx=True,
+                                               ex=max(1, int(interval * 0.9))):
+                return None
+            saved = client.get(CURSOR_KEY)
+            phase, cursor = PHASE_SESSIONS, 0
+            if saved:
+                saved_phase, _, saved_cursor = saved.partition(':')
+                if saved_phase in (PHASE_SESSIONS, PHASE_USERS) and saved_cursor.isdigit():
+                    phase, cursor = saved_phase, int(saved_cursor)
+
+            stats = self._new_stats()
+            deadline = time.perf_counter() + budget_ms / 1000
+            phase, cursor = self._sweep(client, phase, cursor, deadline, stats)
+            client.set(CURSOR_KEY, f"{phase}:{cursor}")
+            self._report(stats)
+            return stats
+        except Exception as e:
+            print(f"❌ 清理会话失败: {e}")
+            return None
+
+    def sweep_all(self) -> Dict[str, int]:
+        """完整扫描一遍（不受时间预算限制，不改变后台线程的游标）"""
+        stats = self._new_stats()
+        client = self._client()
+        if client is None:
+            return stats
+        try:
+            self._sweep(client, PHASE_SESSIONS, 0, None, stats)
+            self._report(stats)
+        except Exception as e:
+            print(f"❌ 清理会话失败: {e}")
+        return stats
+
+    def _loop(self, interval: float):
+        # 各 worker 错开启动时间
+        if self._stop.wait(random.uniform(0, interval)):
+            return
+        while True:
+            self.tick(interval=interval)
+            if self._stop.wait(interval):
+                return
+
+    def start(self, interval: float = SWEEP_INTERVAL) -> bool:
+        """启动后台清理线程（每个进程调用一次）"""
+        if interval <= 0 or not self.manager.host:
+            return False
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return True
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, args=(interval,), name="session-sweeper", daemon=True)
+            self._thread.start()
+        print(f"✅ 会话清理后台线程已启动，间隔 {interval:g} 秒（进程 {os.getpid()}）")
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+
+# 全局清理器实例
+session_sweeper = SessionSweeper()
+
+
+# 便捷函数
+def start_session_sweeper(interval: float = SWEEP_INTERVAL) -> bool:
+    """启动当前进程的会话清理线程"""
+    return session_sweeper.start(interval)
+
+
+def sweep_all_sessions() -> Dict[str, int]:
+    """完整清理一遍过期会话"""
+    return session_sweeper.sweep_all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='清理过期会话')
+    parser.add_argument('--loop', action='store_true', help='前台按间隔持续运行')
+    parser.add_argument('--interval', type=float, default=SWEEP_INTERVAL or 60, help='运行间隔（秒）')
+    args = parser.parse_args(argv)
+
+    if not redis_session_manager.is_connected():
+        print("❌ Redis 不可用，无法清理会话")
+        return 1
+    if not args.loop:
+        stats = sweep_all_sessions()
+        print(f"扫描会话 {stats['scanned']} 个，过期 {stats['expired']} 个，无效 {stats['invalid']} 个，"
+              f"失效的用户会话记录 {stats['dangling']} 条")
+        return 0
+    try:
+        while True:
+            session_sweeper.tick(interval=0)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("正在停止会话清理...")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+签名会话令牌 - 无状态会话模式，校验请求不需要访问 Redis
+
+令牌格式: v1.<载荷>.<签名>，载荷是 base64url 编码的 JSON:
+    a 用户账号   t 用户类型   i 签发时间戳   e 过期时间戳   j 令牌编号（随机）
+签名是载荷的 HMAC-SHA256，密钥取自环境变量 SMSF_SESSION_SECRET；
+未设置时在 Redis 中生成一个共享密钥（所有 worker、重启后都相同）。两者都取不到时不签发令牌（改用 Redis 会话），
+令牌也无法校验；密钥不会用进程内随机值代替，下次调用时再从 Redis 读取。
+
+令牌本身无法删除，退出登录和强制下线写入两个很小的 Redis 结构:
+    smsf_revoked_tokens   有序集合，成员为令牌编号，分数为令牌过期时间（过期后自动清理）
+    smsf_revoked_users    哈希，账号 -> 时间戳，该时间之前签发的令牌全部失效（强制下线）
+每个 worker 在本地保存一份副本，每 REVOCATION_REFRESH 秒从 Redis 刷新一次，
+因此其他 worker 上的撤销最多延迟 REVOCATION_REFRESH 秒生效（撤销所在的 worker 立即生效）。
+
+环境变量:
+    SMSF_SESSION_MODE              redis（默认，服务器端会话）或 token（签名令牌）
+    SMSF_SESSION_SECRET            令牌签名密钥
+    SESSION_REVOCATION_REFRESH     撤销列表的刷新间隔（秒，默认 5）
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable
+
+
+SESSION_MODE = os.getenv('SMSF_SESSION_MODE', 'redis').lower()
+TOKEN_PREFIX = 'v1.'
+SECRET_KEY = 'smsf_session_secret'
+REVOKED_TOKENS_KEY = 'smsf_revoked_tokens'
+REVOKED_USERS_KEY = 'smsf_revoked_users'
+REVOCATION_REFRESH = float(os.getenv('SESSION_REVOCATION_REFRESH', 5))
+REVOKED_USER_KEEP = 7 * 24 * 3600      # 强制下线记录的保留时间（秒，须大于令牌的最长有效期）
+
+
+def is_session_token(session_id: Optional[str]) -> bool:
+    """是否为签名令牌（否则是 Redis 会话 ID）"""
+    return bool(session_id) and session_id.startswith(TOKEN_PREFIX)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class SessionTokenManager:
+    """签名会话令牌的签发、校验和撤销"""
+
+    def __init__(self, client_getter: Callable[[], Any]):
+        """
+        参数:
+        client_getter: 返回 Redis 客户端（decode_responses=True）的函数，不可用时返回 None
+        """
+        self._client_getter = client_getter
+        self._secret = os.getenv('SMSF_SESSION_SECRET', '').encode('utf-8') or None
+        self._lock = threading.Lock()
+        self._revoked_tokens = frozenset()
+        self._revoked_users: Dict[str, float] = {}
+        self._next_refresh = 0.0
+
+        # 统计数据
+        self.verified = 0
+        self.rejected = 0
+        self.refreshes = 0
+
+    # ------------------------------------------------------------------
+    # 密钥
+    # ------------------------------------------------------------------
+    def _get_secret(self) -> Optional[bytes]:
+        """
+        签名密钥（所有 worker 共用）
+
+        返回:
+        bytes: 密钥；未设置 SMSF_SESSION_SECRET 且 Redis 不可用时返回 None（不缓存，下次调用再读取）
+        """
+        if self._secret is not None:
+            return self._secret
+        with self._lock:
+            if self._secret is not None:
+                return self._secret
+            client = self._client_getter()
+            if client is None:
+                return None
+            try:
+                client.set(SECRET_KEY, secrets.token_hex(32), nx=True)
+                secret = client.get(SECRET_KEY)
+            except Exception as e:
+                print(f"⚠️  读取会话令牌密钥失败: {e}")
+                return None
+            if not secret:
+                return None
+            self._secret = secret.encode('utf-8')
+            return self._secret
+
+    @staticmethod
+    def _sign(secret: bytes, payload: str) -> str:
+        return _b64encode(hmac.new(secret, payload.encode('ascii'), hashlib.sha256).digest())
+
+    # ------------------------------------------------------------------
+    # 签发和校验
+    # ------------------------------------------------------------------
+    def issue(self, user_account: str, user_type: Optional[str] = None, expires_in_hours: int = 24) -> Optional[str]:
+        """签发令牌，取不到共享密钥时返回 None"""
+        secret = self._get_secret()
+        if secret is None:
+            return None
+        now = time.time()
+        claims = {'a': user_account, 't': user_type, 'i': round(now, 3),
+                  'e': int(now + expires_in_hours * 3600), 'j': secrets.token_hex(8)}
+        payload = _b64encode(json.dumps(claims, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        return f"{TOKEN_PREFIX}{payload}.{self._sign(secret, payload)}"
+
+    def verify(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        校验令牌（签名、有效期、撤销列表），不访问 Redis（撤销列表到期刷新时除外）
+
+        返回:
+        dict: 令牌载荷，无效时返回 None
+        """
+        claims = self._decode(token)
+        if claims is None or claims.get('e', 0) <= time.time() or self._is_revoked(claims):
+            self.rejected += 1
+            return None
+        self.verified += 1
+        return claims
+
+    def _decode(self, token: str) -> Optional[Dict[str, Any]]:
+        if not is_session_token(token):
+            return None
+        secret = self._get_secret()
+        if secret is None:
+            return None
+        try:
+            payload, signature = token[len(TOKEN_PREFIX):].split('.', 1)
+            if not hmac.compare_digest(signature, self._sign(secret, payload)):
+                return None
+            claims = json.loads(_b64decode(payload))
+            return claims if isinstance(claims, dict) and claims.get('a') else None
+        except (ValueError, TypeError, UnicodeError):
+            return None
+
+    def session_data(self, token: str) -> Optional[Dict[str, Any]]:
+        """与 Redis 会话相同格式的会话数据"""
+        claims = self.verify(token)
+        if claims is None:
+            return None
+        return {
+            'user_account': claims['a'],
+            'user_type': claims.get('t'),
+            'created_at': datetime.fromtimestamp(claims['i']).isoformat(),
+            'expires_at': datetime.fromtimestamp(claims['e']).isoformat(),
+            'last_activity': None,
+        }
+
+    # ------------------------------------------------------------------
+    # 撤销
+    # ------------------------------------------------------------------
+    def _is_revoked(self, claims: Dict[str, Any]) -> bool:
+        self._refresh_revocations()
+        if claims.get('j') in self._revoked_tokens:
+            return True
+        revoked_before = self._revoked_users.get(claims['a'])
+        return revoked_before is not None and claims.get('i', 0) <= revoked_before
+
+    def _refresh_revocations(self, force: bool = False):
+        """到期时从 Redis 刷新本地撤销列表（失败时保留旧列表，下个间隔再试）"""
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+        if not self._lock.acquire(blocking=force):
+            return      # 其他线程正在刷新，先用当前列表
+        try:
+            self._next_refresh = now + REVOCATION_REFRESH
+            client = self._client_getter()
+            if client is None:
+                return
+            pipe = client.pipeline(transaction=False)
+            pipe.zremrangebyscore(REVOKED_TOKENS_KEY, '-inf', time.time())
+            pipe.zrange(REVOKED_TOKENS_KEY, 0, -1)
+            pipe.hgetall(REVOKED_USERS_KEY)
+            _, token_ids, users = pipe.execute()
+            self._revoked_tokens = frozenset(token_ids)
+            self._revoked_users = {account: float(ts) for account, ts in users.items()}
+            self.refreshes += 1
+        except Exception as e:
+            print(f"⚠️  刷新会话令牌撤销列表失败: {e}")
+        finally:
+            self._lock.release()
+
+    def revoke(self, token: str) -> bool:
+        """撤销单个令牌（退出登录）"""
+        claims = self._decode(token)
+        if claims is None or claims.get('e', 0) <= time.time():
+            return False
+        client = self._client_getter()
+        if client is None:
+            return False
+        try:
+            client.zadd(REVOKED_TOKENS_KEY, {claims['j']: claims['e']})
+            self._revoked_tokens = self._revoked_tokens | {claims['j']}
+            print(f"✅ 用户 {claims['a']} 的会话令牌已撤销")
+            return True
+        except Exception as e:
+            print(f"❌ 撤销会话令牌失败: {e}")
+            return False
+
+    def revoke_user(self, user_account: str) -> bool:
+        """撤销用户此前签发的全部令牌（强制下线）"""
+        client = self._client_getter()
+        if client is None:
+            return False
+        now = time.time()
+        try:
+            client.hset(REVOKED_USERS_KEY, user_account, now)
+            revoked_users = dict(self._revoked_users)
+            revoked_users[user_account] = now
+            self._revoked_users = revoked_users
+            # 顺便清理已超过令牌最长有效期的记录
+            stale = [account for account, ts in self._revoked_users.items() if ts < now - REVOKED_USER_KEEP]
+            if stale:
+                client.hdel(REVOKED_USERS_KEY, *stale)
+            return True
+        except Exception as e:
+            print(f"❌ 撤销用户会话令牌失败: {e}")
+            return False
+
+    def stats(self):
+        return {'verified': self.verified, 'rejected': self.rejected, 'refreshes': self.refreshes,
+                'revoked_tokens': len(self._revoked_tokens), 'revoked_users': len(self._revoked_users)}
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+教师快照缓存 - 按 (教师, 版本号) 缓存 TeacherSnapshot
+
+- 版本号保存在 Redis 中，所有写操作提交后 INCR，多个 gunicorn worker 共享
+- 快照的学生数据以 JSON 存入 Redis（不使用 pickle，Redis 中的数据不能执行代码），
+  键中带版本号，版本变化后旧快照自然失效
+- 每个进程内再放一层 LRU，命中时只需要一次 GET 版本号
+- 另外按考试记录版本号（哈希 smsf_exam_ver:{教师}），写操作只增加受影响考试的版本，
+  按考试缓存的数据（例如排名索引）只在该考试的成绩变化后重建
+
+读取时总是先取最新版本号，因此写操作提交并完成 bump 之后，任何 worker 都不会再读到旧快照。
+Redis 不可用时直接查询数据库，不使用任何缓存。
+bump 失败（Redis 出错或处于重试等待期）时记为待补的版本号：该进程在补上之前不使用缓存，
+由后台线程重试（版本号和补写逻辑见 version_counter.py，与分组缓存共用）。
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional, Iterable, Tuple
+
+from teacher_snapshot import TeacherSnapshot, load_teacher_snapshot
+from version_counter import VersionCounter, ALL_FIELDS
+
+try:
+    import redis
+    SNAPSHOT_CACHE_ENABLED = True
+except ImportError as e:
+    SNAPSHOT_CACHE_ENABLED = False
+    print(f"⚠️  教师快照缓存未启用: {e}")
+
+
+VERSION_PREFIX = 'smsf_snapshot_ver:'
+SNAPSHOT_PREFIX = 'smsf_snapshot:'
+EXAM_VERSION_PREFIX = 'smsf_exam_ver:'
+ALL_EXAMS_FIELD = ALL_FIELDS                                         # 无法确定受影响的考试时增加此字段
+SNAPSHOT_TTL = int(os.getenv('SNAPSHOT_CACHE_TTL', 600))             # Redis 中快照的保存时间（秒）
+LOCAL_CACHE_SIZE = int(os.getenv('SNAPSHOT_CACHE_LOCAL_SIZE', 32))   # 进程内最多缓存的快照数
+
+
+class SnapshotCache:
+    """教师快照缓存"""
+
+    def __init__(self):
+        self._local = OrderedDict()     # (teacher, version) -> TeacherSnapshot
+        self._lock = threading.Lock()
+        self.versions = VersionCounter('教师快照缓存', VERSION_PREFIX, field_prefix=EXAM_VERSION_PREFIX,
+                                       on_down=self._clear_local)
+
+        # 统计数据
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def _clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def get(self, conn, teacher_account: str) -> TeacherSnapshot:
+        """
+        获取教师快照（返回的对象是共享的，调用方不要修改）
+
+        参数:
+        conn: 数据库连接对象
+        teacher_account: 教师账户
+        """
+        client = self.versions.client() if SNAPSHOT_CACHE_ENABLED else None
+        if client is None:
+            self.bypassed += 1
+            return load_teacher_snapshot(conn, teacher_account)
+
+        try:
+            version = self.versions.version(client, teacher_account)
+            local_key = (teacher_account, version)
+            with self._lock:
+                snapshot = self._local.get(local_key)
+                if snapshot is not None:
+                    self._local.move_to_end(local_key)
+                    self.local_hits += 1
+                    return snapshot
+
+            redis_key = f"{SNAPSHOT_PREFIX}{teacher_account}:{version}"
+            data = client.get(redis_key)
+            snapshot = self._loads(data) if data is not None else None
+            if snapshot is not None:
+                self.redis_hits += 1
+            else:
+                snapshot = load_teacher_snapshot(conn, teacher_account)
+                client.set(redis_key, self._dumps(snapshot), ex=SNAPSHOT_TTL)
+                self.misses += 1
+        except redis.RedisError as e:
+            self.versions.mark_down(e)
+            self.bypassed += 1
+            return load_teacher_snapshot(conn, teacher_account)
+
+        self._store_local(local_key, snapshot)
+        return snapshot
+
+    @staticmethod
+    def _dumps(snapshot: TeacherSnapshot) -> bytes:
+        """快照只保存教师账号和学生列表（普通的字典和列表），读取时重新建立索引"""
+        return json.dumps({'teacher': snapshot.teacher, 'students': snapshot.students},
+                          ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def _loads(data) -> Optional[TeacherSnapshot]:
+        """反序列化快照，失败（例如代码升级后结构变化）时按未命中处理"""
+        try:
+            payload = json.loads(data)
+            return TeacherSnapshot(payload['teacher'], payload['students'])
+        except Exception as e:
+            print(f"⚠️  教师快照反序列化失败: {e}")
+            return None
+
+    def _store_local(self, key, snapshot):
+        with self._lock:
+            # 同一教师只保留最新版本
+            for stale in [k for k in self._local if k[0] == key[0] and k[1] < key[1]]:
+                del self._local[stale]
+            self._local[key] = snapshot
+            self._local.move_to_end(key)
+            while len(self._local) > LOCAL_CACHE_SIZE:
+                self._local.popitem(last=False)
+
+    def bump(self, teacher_account: str, exams: Optional[Iterable[str]] = None) -> Optional[int]:
+        """
+        教师数据发生变化（写操作提交之后调用），返回新版本号
+
+        参数:
+        teacher_account: 教师账户
+        exams: 成绩发生变化的考试名；None 表示无法确定，所有考试的版本都会变化
+        """
+        with self._lock:
+            for stale in [k for k in self._local if k[0] == teacher_account]:
+                del self._local[stale]
+        if not SNAPSHOT_CACHE_ENABLED:
+            return None
+        return self.versions.bump(teacher_account, exams)
+
+    def exam_version(self, teacher_account: str, exam_name: str) -> Optional[Tuple[int, int]]:
+        """
+        读取考试的版本号，Redis 不可用时返回 None（调用方不应缓存）
+
+        返回:
+        tuple: (全部考试版本, 该考试版本)，任一部分变化都表示该考试的成绩可能已变化
+        """
+        if not SNAPSHOT_CACHE_ENABLED:
+            return None
+        return self.versions.field_version(teacher_account, exam_name)
+
+    def stats(self):
+        """缓存命中情况"""
+        with self._lock:
+            size = len(self._local)
+        return {
+            'local_hits': self.local_hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'bypassed': self.bypassed,
+            'local_size': size,
+            'pending_bumps': self.versions.pending,
+        }
+
+
+# 全局缓存实例
+snapshot_cache = SnapshotCache()
+
+
+# 便捷函数
+def get_teacher_snapshot(conn, teacher_account: str) -> TeacherSnapshot:
+    """获取教师快照（优先使用缓存）"""
+    return snapshot_cache.get(conn, teacher_account)
+
+
+def bump_teacher_version(teacher_account: str, exams: Optional[Iterable[str]] = None) -> Optional[int]:
+    """写操作提交后调用，使教师快照缓存失效（exams 为成绩发生变化的考试，None 表示全部）"""
+    return snapshot_cache.bump(teacher_account, exams)
+
+
+def get_exam_version(teacher_account: str, exam_name: str) -> Optional[Tuple[int, int]]:
+    """读取考试的版本号，Redis 不可用时返回 None"""
+    return snapshot_cache.exam_version(teacher_account, exam_name)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+请求级 SQL 统计 - 记录每个请求的查询次数、数据库耗时、最慢的语句，并发现 N+1 查询
+
+请求作用域内 connect_db() 返回的游标在被采样的请求中包一层计时代理，
+按"语句形状"（去掉空白差异、IN 列表长度差异后的 SQL 模板）汇总；
+同一形状在一个请求中执行次数达到阈值时视为 N+1（例如循环中逐个学生调用 read_student_exam）。
+
+结果写入 Server-Timing 响应头（浏览器开发者工具的 Timing 面板可直接查看），并输出一行 JSON 日志。
+未被采样的请求只多一次 ContextVar 读取，可以在生产环境中按比例开启。
+
+另外可以用 set_statement_observer 注册一个回调（metrics.py 用它统计每条语句的耗时分布），
+注册后所有请求的游标都会计时，回调与采样无关。
+
+环境变量:
+    SQL_TRACE_SAMPLE_RATE   采样比例（0~1，默认 0.01；开发模式下所有请求都统计）
+    SQL_TRACE_REPEAT        同一语句形状达到多少次视为 N+1（默认 10）
+    SQL_TRACE_SLOWEST       日志中保留最慢的几条语句（默认 3）
+"""
+import contextvars
+import json
+import os
+import random
+import re
+import time
+from typing import Dict, Any, List, Optional, Callable
+
+
+SAMPLE_RATE = float(os.getenv('SQL_TRACE_SAMPLE_RATE', 0.01))
+REPEAT_THRESHOLD = int(os.getenv('SQL_TRACE_REPEAT', 10))
+SLOWEST_COUNT = int(os.getenv('SQL_TRACE_SLOWEST', 3))
+SHAPE_CACHE_SIZE = 2048     # 缓存的语句形状数（SQL 模板数量有限，超过后清空重建）
+
+_current_trace = contextvars.ContextVar('sql_request_trace', default=None)
+_shape_cache: Dict[str, str] = {}
+_statement_observer: Optional[Callable[[Any, float], None]] = None
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+_VALUES_LIST = re.compile(r'(\(\s*%s(?:\s*,\s*%s)*\s*\))(?:\s*,\s*\(\s*%s(?:\s*,\s*%s)*\s*\))+')
+
+
+def statement_shape(query) -> str:
+    """
+    语句形状：合并空白，IN (%s, %s, ...) 和多行 VALUES 统一写成一项
+
+    参数已经通过占位符传递，同一模板的不同参数得到相同的形状。
+    """
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    shape = _shape_cache.get(query)
+    if shape is None:
+        shape = _WHITESPACE.sub(' ', query).strip()
+        shape = _VALUES_LIST.sub(r'\1, ...', shape)
+        shape = _PLACEHOLDER_LIST.sub('%s, ...', shape)
+        if len(_shape_cache) >= SHAPE_CACHE_SIZE:
+            _shape_cache.clear()
+        _shape_cache[query] = shape
+    return shape
+
+
+class RequestTrace:
+    """一个请求内执行的 SQL 统计"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.shapes: Dict[str, List[float]] = {}     # 形状 -> [次数, 总耗时 ms, 最长耗时 ms]
+
+    def record(self, query, elapsed_ms: float):
+        shape = statement_shape(query)
+        self.queries += 1
+        self.db_ms += elapsed_ms
+        stats = self.shapes.get(shape)
+        if stats is None:
+            self.shapes[shape] = [1, elapsed_ms, elapsed_ms]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed_ms
+            if elapsed_ms > stats[2]:
+                stats[2] = elapsed_ms
+
+    def repeated(self, threshold: int = None) -> List[Dict[str, Any]]:
+        """执行次数达到阈值的语句形状（疑似 N+1），按次数从多到少"""
+        threshold = REPEAT_THRESHOLD if threshold is None else threshold
+        result = [{'sql': shape, 'count': int(stats[0]), 'ms': round(stats[1], 2)}
+                  for shape, stats in self.shapes.items() if stats[0] >= threshold]
+        result.sort(key=lambda item: -item['count'])
+        return result
+
+    def slowest(self, count: int = None) -> List[Dict[str, Any]]:
+        """单次耗时最长的语句形状"""
+        count = SLOWEST_COUNT if count is None else count
+        ranked = sorted(self.shapes.items(), key=lambda item: -item[1][2])[:count]
+        return [{'sql': shape, 'ms': round(stats[2], 2), 'count': int(stats[0])} for shape, stats in ranked]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'queries': self.queries,
+            'statements': len(self.shapes),
+            'db_ms': round(self.db_ms, 2),
+            'request_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'slowest': self.slowest(),
+            'repeated': self.repeated(),
+        }
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头（只包含数字，SQL 文本只写日志）"""
+        parts = [f'db;dur={self.db_ms:.2f};desc="{self.queries} queries"']
+        repeated = self.repeated()
+        if repeated:
+            parts.append(f'db-repeat;dur={repeated[0]["ms"]:.2f};desc="N+1 x{repeated[0]["count"]}"')
+        return ', '.join(parts)
+
+
+class TracedCursor:
+    """计时游标代理：execute / executemany 计入当前请求的统计，并通知语句观察者"""
+
+    def __init__(self, cursor, trace: Optional[RequestTrace], observer=None):
+        self._cursor = cursor
+        self._trace = trace
+        self._observer = observer
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _record(self, query, started: float):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if self._trace is not None:
+            self._trace.record(query, elapsed_ms)
+        if self._observer is not None:
+            self._observer(query, elapsed_ms)
+
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(query, args)
+        finally:
+            self._record(query, started)
+
+    def executemany(self, query, args):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, args)
+        finally:
+            self._record(query, started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+
+def set_statement_observer(observer: Optional[Callable[[Any, float], None]]):
+    """
+    注册语句观察者 observer(query, elapsed_ms)，每条 execute / executemany 结束后调用（传 None 取消）
+
+    观察者在数据库调用的路径上同步执行，必须足够快且不能抛出异常。
+    """
+    global _statement_observer
+    _statement_observer = observer
+
+
+def trace_cursor(cursor):
+    """当前请求被采样或注册了语句观察者时返回计时代理，否则原样返回"""
+    trace = _current_trace.get()
+    observer = _statement_observer
+    if trace is None and observer is None:
+        return cursor
+    return TracedCursor(cursor, trace, observer)
+
+
+def start_sql_trace(force: bool = False) -> Optional[RequestTrace]:
+    """请求开始时调用：按采样比例决定是否统计本请求，返回统计对象（未采样时为 None）"""
+    if not force and (SAMPLE_RATE <= 0 or random.random() >= SAMPLE_RATE):
+        _current_trace.set(None)
+        return None
+    trace = RequestTrace()
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_sql_trace(trace: Optional[RequestTrace], **fields) -> Optional[Dict[str, Any]]:
+    """
+    请求结束时调用：输出一行 JSON 日志（没有执行 SQL 的请求不输出）并返回统计结果
+
+    参数:
+    fields: 附加到日志中的字段（例如 method、path、status）
+    """
+    _current_trace.set(None)
+    if trace is None:
+        return None
+    summary = trace.summary()
+    if not summary['queries']:
+        return summary
+    line = dict(fields)
+    line.update(summary)
+    prefix = '⚠️  SQL_TRACE' if summary['repeated'] else 'SQL_TRACE'
+    print(f"{prefix} {json.dumps(line, ensure_ascii=False)}")
+    return summary
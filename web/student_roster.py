@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+批量创建学生 - 用序号表原子地分配学生账号
+
+原来的 add_student 先 SELECT COUNT(*) 再插入：并发时两个请求会得到同一个 teacher@N，
+删除学生后编号还会被重复使用，而且每个学生要两次往返和一次提交。
+
+这里每个教师在 student_sequences 表中有一行，记录已分配的最大编号。
+分配 n 个编号只需一条 UPDATE ... LAST_INSERT_ID(last_no + n)，该行锁持有到事务提交，
+并发分配按顺序进行，编号只增不减；全部学生用一条多行 INSERT 写入。
+"""
+import re
+import time
+from typing import Dict, Any, List, Tuple
+
+from snapshot_cache import bump_teacher_version
+
+
+SEQUENCE_TABLE = 'student_sequences'
+MAX_BULK_STUDENTS = 5000    # 一次最多创建的学生数
+
+
+def create_student_sequence_table(conn):
+    """创建学生编号序列表"""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{SEQUENCE_TABLE}` (
+            `teacher`     VARCHAR(255) NOT NULL,
+            `last_no`     BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (`teacher`)
+        )
+    ''')
+    conn.commit()
+
+
+def _table_name(teacher_account: str) -> str:
+    # 验证teacher_account只包含字母数字和下划线
+    if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
+        raise ValueError("Invalid teacher account name")
+    return f"student_{teacher_account}"
+
+
+def allocate_student_numbers(conn, teacher_account: str, count: int) -> int:
+    """
+    分配 count 个连续的学生编号（不提交事务，序号行锁持有到调用方提交或回滚）
+
+    返回:
+    int: 第一个编号，分配到的编号为 first .. first + count - 1
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        UPDATE `{SEQUENCE_TABLE}` SET `last_no` = LAST_INSERT_ID(`last_no` + %s) WHERE `teacher` = %s
+    ''', (count, teacher_account))
+    if cursor.rowcount == 0:
+        # 第一次分配：从学生表中已有的最大编号开始（兼容按 COUNT(*) 生成的旧账号）
+        table_name = _table_name(teacher_account)
+        cursor.execute(f'''
+            SELECT COALESCE(MAX(CAST(SUBSTRING_INDEX(`账号`, '@', -1) AS UNSIGNED)), 0), COUNT(*)
+            FROM `{table_name}`
+        ''')
+        max_no, total = cursor.fetchone()
+        cursor.execute(f'''
+            INSERT IGNORE INTO `{SEQUENCE_TABLE}` (`teacher`, `last_no`) VALUES (%s, %s)
+        ''', (teacher_account, max(int(max_no or 0), int(total or 0))))
+        cursor.execute(f'''
+            UPDATE `{SEQUENCE_TABLE}` SET `last_no` = LAST_INSERT_ID(`last_no` + %s) WHERE `teacher` = %s
+        ''', (count, teacher_account))
+    # UPDATE 中使用 LAST_INSERT_ID(expr) 时，服务器在 OK 包中返回该值
+    return cursor.lastrowid - count + 1
+
+
+def insert_students(conn, teacher_account: str, students: List[Tuple[str, str, str]]) -> List[Dict[str, Any]]:
+    """
+    在当前事务中创建学生（不提交事务）
+
+    参数:
+    students: [(名称, 班级, 考试字段文本)]
+
+    返回:
+    list: [{'account', 'password', 'name', 'className', 'number'}]，顺序与输入相同
+    """
+    if not students:
+        return []
+    table_name = _table_name(teacher_account)
+    first = allocate_student_numbers(conn, teacher_account, len(students))
+    created = []
+    rows = []
+    for number, (name, class_name, exam) in enumerate(students, start=first):
+        account = f"{teacher_account}@{number}"
+        password = account  # 密码默认为账号
+        rows.append((account, password, name, class_name, exam))
+        created.append({'account': account, 'password': password, 'name': name,
+                        'className': class_name, 'number': number})
+    # pymysql 会把 INSERT ... VALUES 的 executemany 合并为多行 INSERT
+    cursor = conn.cursor()
+    cursor.executemany(f'''
+        INSERT INTO `{table_name}` (`账号`, `密码`, `名称`, `班级`, `考试`)
+        VALUES (%s, %s, %s, %s, %s)
+    ''', rows)
+    return created
+
+
+def add_students_bulk(conn, teacher_account: str, students: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """
+    批量创建学生（一个事务）
+
+    参数:
+    students: [(名称, 班级)]
+
+    返回:
+    dict: success, students（创建的学生列表，见 insert_students）, elapsed_ms；失败时带 message
+    """
+    result = {'success': False, 'students': [], 'elapsed_ms': 0.0}
+    started = time.perf_counter()
+    try:
+        result['students'] = insert_students(
+            conn, teacher_account, [(name, class_name, "{}") for name, class_name in students])
+        conn.commit()
+        # 新学生没有考试成绩，各考试的版本号不变
+        bump_teacher_version(teacher_account, [])
+        result['success'] = True
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        print(f"✅ 已创建 {len(result['students'])} 名学生，耗时 {result['elapsed_ms']} ms")
+    except Exception as e:
+        print(f"批量创建学生时发生错误: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        result['message'] = str(e)
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+考试分组和考试模板 - 从 teachers 表的 `分组` / `模板` 文本字段移到独立的表中
+
+- exam_groups:          教师的分组（按创建顺序）
+- exam_group_members:   分组中的考试，每次考试最多属于一个分组，加入/移动/移出都是一条语句
+- exam_templates:       考试模板 {科目: 满分}，保存/删除都是一条语句
+- exam_group_migrations: 已迁移的教师，以及迁移时无法保留的分组成员
+
+读取按教师缓存：Redis 中保存每个教师的版本号（所有 worker 共享），进程内按 (教师, 版本号) 缓存分组和模板，
+写操作提交后增加版本号。Redis 不可用时直接查询数据库。
+版本号的读取、增加和失败后的补写见 version_counter.py（与教师快照缓存共用）。
+
+teachers 表中已有的 `分组` / `模板` 数据在第一次读取时迁移到新表，原字段保持不变（作为备份，之后不再读取）。
+原来的分组允许同一次考试出现在多个分组中，新表中每次考试只能属于一个分组：保留第一个分组，
+其余的成员关系记入 exam_group_migrations.conflicts 并打印警告。
+"""
+import ast
+import copy
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from version_counter import VersionCounter
+
+try:
+    import redis
+    GROUP_CACHE_ENABLED = True
+except ImportError as e:
+    GROUP_CACHE_ENABLED = False
+    print(f"⚠️  分组缓存未启用: {e}")
+
+
+GROUP_TABLE = 'exam_groups'
+MEMBER_TABLE = 'exam_group_members'
+TEMPLATE_TABLE = 'exam_templates'
+MIGRATION_TABLE = 'exam_group_migrations'
+
+VERSION_PREFIX = 'smsf_groups_ver:'
+LOCAL_CACHE_SIZE = 256      # 进程内最多缓存的教师数
+
+
+def create_teacher_group_tables(conn):
+    """创建分组、分组成员和模板表"""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{GROUP_TABLE}` (
+            `id`          BIGINT AUTO_INCREMENT,
+            `teacher`     VARCHAR(255) NOT NULL,
+            `group_name`  VARCHAR(255) NOT NULL,
+            PRIMARY KEY (`id`),
+            UNIQUE KEY `uk_teacher_group` (`teacher`, `group_name`)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{MEMBER_TABLE}` (
+            `id`          BIGINT AUTO_INCREMENT,
+            `teacher`     VARCHAR(255) NOT NULL,
+            `exam_name`   VARCHAR(255) NOT NULL,
+            `group_id`    BIGINT NOT NULL,
+            PRIMARY KEY (`id`),
+            UNIQUE KEY `uk_teacher_exam` (`teacher`, `exam_name`),
+            KEY `idx_group` (`group_id`)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{TEMPLATE_TABLE}` (
+            `id`             BIGINT AUTO_INCREMENT,
+            `teacher`        VARCHAR(255) NOT NULL,
+            `template_name`  VARCHAR(255) NOT NULL,
+            `subjects`       TEXT,
+            PRIMARY KEY (`id`),
+            UNIQUE KEY `uk_teacher_template` (`teacher`, `template_name`)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `{MIGRATION_TABLE}` (
+            `teacher`      VARCHAR(255) NOT NULL,
+            `conflicts`    TEXT,
+            `migrated_at`  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (`teacher`)
+        )
+    ''')
+    conn.commit()
+
+
+class TeacherGroups:
+    """教师的分组和模板（缓存中共享，读取方通过便捷函数拿到副本）"""
+
+    def __init__(self, groups: Dict[str, List[str]], templates: Dict[str, Dict[str, Any]]):
+        self.groups = groups            # 分组名 -> [考试名]，按创建顺序
+        self.templates = templates      # 模板名 -> {科目: 满分}
+
+    def grouped_exams(self) -> set:
+        """已分组的考试名"""
+        return {exam_name for exams in self.groups.values() for exam_name in exams}
+
+
+# ----------------------------------------------------------------------
+# 读取
+# ----------------------------------------------------------------------
+def _parse_blob(text) -> dict:
+    if not text:
+        return {}
+    try:
+        value = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        print(f"⚠️  无法解析的分组/模板数据，已忽略: {text[:50]}")
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+# 本进程中已确认迁移过的教师（迁移只进行一次，之后不再查询迁移表）
+_migrated = set()
+
+
+def _migrate_teacher_blobs(conn, teacher_account: str):
+    """把 teachers 表中的 `分组` / `模板` 迁移到新表（原字段保持不变）"""
+    if teacher_account in _migrated:
+        return
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT 1 FROM `{MIGRATION_TABLE}` WHERE `teacher` = %s', (teacher_account,))
+    if cursor.fetchone():
+        _migrated.add(teacher_account)
+        return
+    try:
+        # 锁住教师行后再检查一次，多个进程同时迁移时只有一个会执行
+        cursor.execute('''
+            SELECT `分组`, `模板` FROM `teachers` WHERE `账户` = %s FOR UPDATE
+        ''', (teacher_account,))
+        row = cursor.fetchone()
+        cursor.execute(f'SELECT 1 FROM `{MIGRATION_TABLE}` WHERE `teacher` = %s', (teacher_account,))
+        if cursor.fetchone():
+            conn.commit()
+            _migrated.add(teacher_account)
+            return
+        group_blob, template_blob = row or (None, None)
+
+        first_group = {}    # 考试名 -> 保留的分组
+        conflicts = []      # [[考试名, 未能保留的分组]]
+        for group_name, exams in _parse_blob(group_blob).items():
+            _insert_group(cursor, teacher_account, group_name)
+            for exam_name in exams or []:
+                kept = first_group.setdefault(exam_name, group_name)
+                if kept == group_name:
+                    _insert_member(cursor, teacher_account, exam_name, group_name)
+                elif [exam_name, group_name] not in conflicts:
+                    conflicts.append([exam_name, group_name])
+        for template_name, subjects in _parse_blob(template_blob).items():
+            _upsert_template(cursor, teacher_account, template_name, subjects)
+        cursor.execute(f'''
+            INSERT INTO `{MIGRATION_TABLE}` (`teacher`, `conflicts`) VALUES (%s, %s)
+        ''', (teacher_account, json.dumps(conflicts, ensure_ascii=False) if conflicts else None))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    _migrated.add(teacher_account)
+    if group_blob or template_blob:
+        print(f"✅ 教师 {teacher_account} 的分组和模板已迁移到独立的表")
+    for exam_name, group_name in conflicts:
+        print(f"⚠️  教师 {teacher_account} 的考试 {exam_name} 已属于分组 {first_group[exam_name]}，"
+              f"未加入分组 {group_name}（原数据保留在 teachers.分组 中）")
+
+
+def load_teacher_groups(conn, teacher_account: str) -> TeacherGroups:
+    """从数据库读取教师的分组和模板（不使用缓存）"""
+    _migrate_teacher_blobs(conn, teacher_account)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT g.`group_name`, m.`exam_name`
+        FROM `{GROUP_TABLE}` g LEFT JOIN `{MEMBER_TABLE}` m ON m.`group_id` = g.`id`
+        WHERE g.`teacher` = %s
+        ORDER BY g.`id`, m.`id`
+    ''', (teacher_account,))
+    groups = {}
+    for group_name, exam_name in cursor.fetchall():
+        exams = groups.setdefault(group_name, [])
+        if exam_name is not None:
+            exams.append(exam_name)
+
+    cursor.execute(f'''
+        SELECT `template_name`, `subjects` FROM `{TEMPLATE_TABLE}` WHERE `teacher` = %s ORDER BY `id`
+    ''', (teacher_account,))
+    templates = {}
+    for template_name, subjects in cursor.fetchall():
+        try:
+            templates[template_name] = json.loads(subjects) if subjects else {}
+        except ValueError:
+            templates[template_name] = {}
+    return TeacherGroups(groups, templates)
+
+
+class TeacherGroupCache:
+    """按 (教师, 版本号) 缓存分组和模板"""
+
+    def __init__(self):
+        self._local = OrderedDict()     # teacher -> (version, TeacherGroups)
+        self._lock = threading.Lock()
+        self.versions = VersionCounter('分组缓存', VERSION_PREFIX, on_down=self._clear_local)
+
+        # 统计数据
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def _clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def get(self, conn, teacher_account: str) -> TeacherGroups:
+        """获取教师的分组和模板（返回的对象是共享的，调用方不要修改）"""
+        client = self.versions.client() if GROUP_CACHE_ENABLED else None
+        if client is None:
+            self.bypassed += 1
+            return load_teacher_groups(conn, teacher_account)
+        try:
+            version = self.versions.version(client, teacher_account)
+        except redis.RedisError as e:
+            self.versions.mark_down(e)
+            self.bypassed += 1
+            return load_teacher_groups(conn, teacher_account)
+
+        with self._lock:
+            cached = self._local.get(teacher_account)
+            if cached is not None and cached[0] == version:
+                self._local.move_to_end(teacher_account)
+                self.hits += 1
+                return cached[1]
+
+        # 先读版本号再读数据库：读取期间若有写入，数据记在旧版本号下，下次读取即重新加载
+        groups = load_teacher_groups(conn, teacher_account)
+        self.misses += 1
+        with self._lock:
+            self._local[teacher_account] = (version, groups)
+            self._local.move_to_end(teacher_account)
+            while len(self._local) > LOCAL_CACHE_SIZE:
+                self._local.popitem(last=False)
+        return groups
+
+    def invalidate(self, teacher_account: str):
+        """分组或模板发生变化（写操作提交之后调用）"""
+        with self._lock:
+            self._local.pop(teacher_account, None)
+        if GROUP_CACHE_ENABLED:
+            self.versions.bump(teacher_account)
+
+    def stats(self):
+        """缓存命中情况"""
+        with self._lock:
+            size = len(self._local)
+        return {'hits': self.hits, 'misses': self.misses, 'bypassed': self.bypassed, 'size': size,
+                'pending': self.versions.pending}
+
+
+# 全局缓存实例
+teacher_group_cache = TeacherGroupCache()
+
+
+# ----------------------------------------------------------------------
+# 写入（每个操作提交事务后使缓存失效）
+# ----------------------------------------------------------------------
+def _insert_group(cursor, teacher_account: str, group_name: str):
+    cursor.execute(f'''
+        INSERT IGNORE INTO `{GROUP_TABLE}` (`teacher`, `group_name`) VALUES (%s, %s)
+    ''', (teacher_account, group_name))
+
+
+def _insert_member(cursor, teacher_account: str, exam_name: str, group_name: str):
+    """把考试放入分组（已在分组中时不变）"""
+    cursor.execute(f'''
+        INSERT IGNORE INTO `{MEMBER_TABLE}` (`teacher`, `exam_name`, `group_id`)
+        SELECT %s, %s, `id` FROM `{GROUP_TABLE}` WHERE `teacher` = %s AND `group_name` = %s
+    ''', (teacher_account, exam_name, teacher_account, group_name))
+
+
+def _move_exam(cursor, teacher_account: str, exam_name: str, group_name: str):
+    """把考试放入分组（已在其他分组中时移动过来，排在该分组最后）"""
+    cursor.execute(f'''
+        REPLACE INTO `{MEMBER_TABLE}` (`teacher`, `exam_name`, `group_id`)
+        SELECT %s, %s, `id` FROM `{GROUP_TABLE}` WHERE `teacher` = %s AND `group_name` = %s
+    ''', (teacher_account, exam_name, teacher_account, group_name))
+
+
+def _upsert_template(cursor, teacher_account: str, template_name: str, subjects: Dict[str, Any]):
+    cursor.execute(f'''
+        INSERT INTO `{TEMPLATE_TABLE}` (`teacher`, `template_name`, `subjects`) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE `subjects` = VALUES(`subjects`)
+    ''', (teacher_account, template_name, json.dumps(subjects, ensure_ascii=False)))
+
+
+def _write(conn, teacher_account: str, operation) -> int:
+    """执行写操作并提交，返回影响的行数"""
+    # 旧字段中的数据先迁移，避免之后迁移时覆盖这次修改
+    _migrate_teacher_blobs(conn, teacher_account)
+    cursor = conn.cursor()
+    try:
+        operation(cursor)
+        rowcount = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    teacher_group_cache.invalidate(teacher_account)
+    return rowcount
+
+
+def add_exam_to_group(conn, teacher_account: str, exam_name: str, group_name: str) -> bool:
+    """把考试放入分组，分组不存在时创建；考试已在其他分组中时移动过来"""
+    def operation(cursor):
+        _insert_group(cursor, teacher_account, group_name)
+        _move_exam(cursor, teacher_account, exam_name, group_name)
+    return _write(conn, teacher_account, operation) > 0
+
+
+def remove_exam_from_groups(conn, teacher_account: str, exam_name: str) -> bool:
+    """把考试移出分组"""
+    def operation(cursor):
+        cursor.execute(f'''
+            DELETE FROM `{MEMBER_TABLE}` WHERE `teacher` = %s AND `exam_name` = %s
+        ''', (teacher_account, exam_name))
+    return _write(conn, teacher_account, operation) > 0
+
+
+def replace_teacher_groups(conn, teacher_account: str, group_data: Optional[Dict[str, List[str]]]) -> bool:
+    """用完整的 {分组名: [考试名]} 替换教师的全部分组（兼容原来整体写入 `分组` 字段的接口）"""
+    def operation(cursor):
+        cursor.execute(f'DELETE FROM `{MEMBER_TABLE}` WHERE `teacher` = %s', (teacher_account,))
+        cursor.execute(f'DELETE FROM `{GROUP_TABLE}` WHERE `teacher` = %s', (teacher_account,))
+        for group_name, exams in (group_data or {}).items():
+            _insert_group(cursor, teacher_account, group_name)
+            for exam_name in exams or []:
+                _move_exam(cursor, teacher_account, exam_name, group_name)
+    _write(conn, teacher_account, operation)
+    return True
+
+
+def save_template(conn, teacher_account: str, template_name: str, subjects: Dict[str, Any]) -> bool:
+    """保存考试模板（同名模板覆盖）"""
+    return _write(conn, teacher_account,
+                  lambda cursor: _upsert_template(cursor, teacher_account, template_name, subjects)) > 0
+
+
+def delete_template(conn, teacher_account: str, template_name: str) -> bool:
+    """删除考试模板"""
+    def operation(cursor):
+        cursor.execute(f'''
+            DELETE FROM `{TEMPLATE_TABLE}` WHERE `teacher` = %s AND `template_name` = %s
+        ''', (teacher_account, template_name))
+    return _write(conn, teacher_account, operation) > 0
+
+
+# 便捷函数
+def get_teacher_groups(conn, teacher_account: str) -> TeacherGroups:
+    """获取教师的分组和模板（共享对象，只读）"""
+    return teacher_group_cache.get(conn, teacher_account)
+
+
+def read_groups(conn, teacher_account: str) -> Dict[str, List[str]]:
+    """教师的分组 {分组名: [考试名]}（副本，可以修改）"""
+    return copy.deepcopy(get_teacher_groups(conn, teacher_account).groups)
+
+
+def read_templates(conn, teacher_account: str) -> Dict[str, Dict[str, Any]]:
+    """教师的考试模板 {模板名: {科目: 满分}}（副本，可以修改）"""
+    return copy.deepcopy(get_teacher_groups(conn, teacher_account).templates)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+教师花名册快照 - 一条 SELECT 读出教师的全部学生，考试数据只解析一次
+
+统计类接口原来的访问方式是 read_class → 每个班级 read_single_class → 每个学生 read_student_exam，
+共 1 + C + S 次查询；改为 load_teacher_snapshot 后只需要一次查询（table 模式下两次）。
+"""
+import ast
+import re
+from typing import Dict, Any, List, Optional
+
+from exam_scores import use_score_table, read_teacher_scores
+
+
+class TeacherSnapshot:
+    """
+    教师名下学生与成绩的内存索引
+
+    students 与 read_single_class 返回的元素结构相同（{"账号", "名称", "考试"}），
+    只是 "考试" 已经解析为字典，另外多了 "班级" 字段。
+    """
+
+    def __init__(self, teacher_account: str, students: List[Dict[str, Any]]):
+        self.teacher = teacher_account
+        self.students = students
+        self.by_student: Dict[str, Dict[str, Any]] = {}
+        self.by_class: Dict[str, List[Dict[str, Any]]] = {}
+        # {考试名: {学生账号: {科目: [分数, 满分]}}}
+        self.by_exam: Dict[str, Dict[str, Dict[str, list]]] = {}
+        # {科目: {学生账号: {考试名: [分数, 满分]}}}
+        self.by_subject: Dict[str, Dict[str, Dict[str, list]]] = {}
+
+        for student in students:
+            self.by_student[student["账号"]] = student
+            self.by_class.setdefault(student["班级"], []).append(student)
+
+        # 按 班级 → 学生 → 考试 的顺序建立索引，与原来逐班级遍历时考试出现的顺序一致
+        for class_students in self.by_class.values():
+            for student in class_students:
+                account = student["账号"]
+                for exam_name, exam_data in student["考试"].items():
+                    self.by_exam.setdefault(exam_name, {})[account] = exam_data
+                    for subject, value in exam_data.items():
+                        self.by_subject.setdefault(subject, {}).setdefault(account, {})[exam_name] = value
+
+    @property
+    def classes(self) -> List[str]:
+        """班级列表（与 read_class 相同）"""
+        return list(self.by_class.keys())
+
+    @property
+    def exam_names(self) -> List[str]:
+        """所有学生参加过的考试名"""
+        return list(self.by_exam.keys())
+
+    def class_students(self, class_name: str) -> List[Dict[str, Any]]:
+        """指定班级的学生（与 read_single_class 相同）"""
+        return self.by_class.get(class_name, [])
+
+    def exams_of(self, student_account: str) -> Dict[str, Dict[str, list]]:
+        """指定学生的考试成绩（与 read_student_exam 相同）"""
+        student = self.by_student.get(student_account)
+        return student["考试"] if student else {}
+
+    def exam_scores(self, exam_name: str) -> Dict[str, Dict[str, list]]:
+        """参加指定考试的学生成绩 {学生账号: {科目: [分数, 满分]}}"""
+        return self.by_exam.get(exam_name, {})
+
+    def subject_scores(self, subject: str) -> Dict[str, Dict[str, list]]:
+        """指定科目的所有成绩 {学生账号: {考试名: [分数, 满分]}}"""
+        return self.by_subject.get(subject, {})
+
+    def ungrouped_exams(self, group_dict: Optional[Dict[str, list]]) -> List[str]:
+        """已创建但没有加入任何分组的考试"""
+        grouped = set()
+        for exams in (group_dict or {}).values():
+            grouped.update(exams)
+        return [exam_name for exam_name in self.by_exam if exam_name not in grouped]
+
+
+def _parse_exam_blob(account: str, blob) -> Dict[str, Dict[str, list]]:
+    """解析 `考试` 字段，无法解析时按没有考试处理"""
+    if blob is None or not str(blob).strip():
+        return {}
+    try:
+        return ast.literal_eval(blob)
+    except (ValueError, SyntaxError) as e:
+        print(f"⚠️  学生 {account} 的考试数据无法解析: {e}")
+        return {}
+
+
+def load_teacher_snapshot(conn, teacher_account: str) -> TeacherSnapshot:
+    """
+    读取教师名下全部学生并建立索引
+
+    参数:
+    conn: 数据库连接对象
+    teacher_account: 教师账户
+
+    返回:
+    TeacherSnapshot: 按班级、学生、考试、科目索引的快照
+    """
+    # 验证teacher_account只包含字母数字和下划线
+    if not re.match(r'^[a-zA-Z0-9_]+$', teacher_account):
+        raise ValueError("Invalid teacher account name")
+    table_name = f"student_{teacher_account}"
+
+    cursor = conn.cursor()
+    if use_score_table():
+        cursor.execute(f'''
+            SELECT `账号`, `名称`, `班级` FROM `{table_name}` ORDER BY `序号`
+        ''')
+        rows = cursor.fetchall()
+        scores = read_teacher_scores(conn, teacher_account)
+        students = [{"账号": account, "名称": name, "班级": class_name, "考试": scores.get(account, {})}
+                    for account, name, class_name in rows]
+    else:
+        cursor.execute(f'''
+            SELECT `账号`, `名称`, `班级`, `考试` FROM `{table_name}` ORDER BY `序号`
+        ''')
+        students = [{"账号": account, "名称": name, "班级": class_name, "考试": _parse_exam_blob(account, blob)}
+                    for account, name, class_name, blob in cursor.fetchall()]
+
+    return TeacherSnapshot(teacher_account, students)
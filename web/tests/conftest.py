@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+测试配置 - web 目录下的模块按顶层模块导入（与 web_server.py 相同），这里把 web 目录加入搜索路径
+
+运行方式（在 web 目录下）:
+    python -m pytest -q tests
+需要 Redis 的测试使用 fakeredis（pip install fakeredis），未安装时跳过。
+"""
+import os
+import sys
+import time
+
+import pytest
+
+WEB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if WEB_DIR not in sys.path:
+    sys.path.insert(0, WEB_DIR)
+
+
+@pytest.fixture
+def session_manager():
+    """连接到 fakeredis 的会话管理器（会话校验脚本需要 lupa）"""
+    fakeredis = pytest.importorskip('fakeredis')
+    from redis_manager import RedisSessionManager, VALIDATE_AND_TOUCH_LUA
+
+    manager = RedisSessionManager()
+    manager.host = 'fakeredis'
+    manager.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    manager._validate_script = manager.redis_client.register_script(VALIDATE_AND_TOUCH_LUA)
+    manager._connection_status = True
+    manager._last_check_time = time.time()
+    manager._check_interval = 3600
+    return manager
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""db_pool：借出/归还、fork 之后丢弃继承的连接、请求作用域共享连接和游标"""
+import pymysql
+import pytest
+from pymysql.constants import SERVER_STATUS
+
+import db_pool
+
+
+class FakeCursor:
+    def __init__(self, raw, cursor_class):
+        self.connection = raw
+        self.cursor_class = cursor_class
+        self._rows = None
+        self.rownumber = 0
+
+    def execute(self, sql, params=None):
+        self._rows = ((1,), (2,))
+        self.rownumber = 0
+
+    def fetchone(self):
+        row = self._rows[self.rownumber]
+        self.rownumber += 1
+        return row
+
+
+class FakeRaw:
+    """pymysql 连接的替身"""
+
+    def __init__(self, **config):
+        self.config = config
+        self.open = True
+        self.server_status = 0
+        self.cursorclass = pymysql.cursors.Cursor
+        self.rollbacks = 0
+        self.force_closed = False
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self, cursor_class or self.cursorclass)
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise pymysql.err.OperationalError(2006, 'gone away')
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.server_status = 0
+
+    def close(self):
+        self.open = False
+
+    def _force_close(self):
+        self.open = False
+        self.force_closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(db_pool.pymysql, 'connect', FakeRaw)
+    return db_pool.MySQLConnectionPool('testdb', {'host': 'db'}, max_size=2, checkout_timeout=0.05)
+
+
+@pytest.fixture
+def pools(monkeypatch, pool):
+    monkeypatch.setattr(db_pool, '_pools', {'testdb': pool})
+    return db_pool._pools
+
+
+def test_connection_returned_and_reused(pool):
+    conn = pool.get_connection()
+    raw = conn._raw
+    assert raw.config['database'] == 'testdb'
+    conn.close()
+    conn.close()    # 重复归还是安全的
+
+    again = pool.get_connection()
+    assert again._raw is raw
+    assert pool.stats()['created'] == 1 and pool.stats()['reused'] == 1
+    with pytest.raises(pymysql.err.InterfaceError):
+        conn.cursor()
+
+
+def test_checkout_times_out_when_exhausted(pool):
+    held = [pool.get_connection(), pool.get_connection()]
+    with pytest.raises(db_pool.PoolTimeoutError):
+        pool.get_connection()
+    held[0].close()
+    assert pool.get_connection()._raw is not None
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_open_transaction_rolled_back_on_release(pool):
+    conn = pool.get_connection()
+    raw = conn._raw
+    raw.server_status = SERVER_STATUS.SERVER_STATUS_IN_TRANS
+    conn.close()
+    assert raw.rollbacks == 1
+    assert pool.get_connection()._raw is raw
+
+
+def test_closed_connection_replaced_on_checkout(pool):
+    conn = pool.get_connection()
+    raw = conn._raw
+    conn.close()
+    raw.open = False
+    assert pool.get_connection()._raw is not raw
+
+
+def test_inherited_connections_dropped_after_fork(pool, pools, monkeypatch):
+    idle = pool.get_connection()
+    idle_raw = idle._raw
+    borrowed = pool.get_connection()
+    borrowed_raw = borrowed._raw
+    idle.close()
+
+    # 模拟 fork：子进程的 pid 不同，at-fork 钩子调用 reset_all_pools
+    monkeypatch.setattr(db_pool.os, 'getpid', lambda: -1)
+    db_pool.reset_all_pools()
+
+    assert idle_raw.force_closed
+    conn = pool.get_connection()
+    assert conn._raw is not idle_raw
+    # fork 之前借出的连接归还时直接关闭，不进入子进程的空闲队列
+    borrowed.close()
+    assert borrowed_raw.force_closed
+    assert pool.stats()['idle'] == 0 and pool.stats()['in_use'] == 1
+
+
+def test_pool_reset_on_first_checkout_in_child(pool, monkeypatch):
+    conn = pool.get_connection()
+    raw = conn._raw
+    conn.close()
+    monkeypatch.setattr(db_pool.os, 'getpid', lambda: -1)
+    assert pool.get_connection()._raw is not raw
+    assert raw.force_closed
+
+
+def test_request_scope_shares_connection_and_cursor(pools):
+    scope = db_pool.begin_request_scope()
+    try:
+        first = db_pool.connect('testdb', {})
+        second = db_pool.connect('testdb', {})
+        assert first._pooled is second._pooled
+        first.close()   # 请求内 close() 不归还连接
+
+        cursor = first.cursor()
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+        # 结果没有读完时不共享
+        assert second.cursor() is not cursor
+        cursor.close()
+        assert second.cursor() is cursor
+        # 流式游标不共享
+        assert second.cursor(pymysql.cursors.SSCursor) is not cursor
+        assert scope.stats() == {'opened': 1, 'used': 1, 'cursor_reused': 1}
+    finally:
+        db_pool.end_request_scope(scope)
+
+    assert db_pool.current_request_scope() is None
+    assert pools['testdb'].stats()['idle'] == 1 and pools['testdb'].stats()['in_use'] == 0
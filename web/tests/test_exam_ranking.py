@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""exam_ranking：名次、百分位、前 k 名、分数分布，以及按考试版本号缓存"""
+import pytest
+
+import exam_ranking
+from exam_ranking import ExamRankingIndex, TOTAL_FIELD
+from teacher_snapshot import TeacherSnapshot
+
+
+def _snapshot():
+    return TeacherSnapshot('t1', [
+        {"账号": "t1@1", "名称": "张三", "班级": "一班", "考试": {"期中": {"数学": [90, 100], "语文": [80, 100]}}},
+        {"账号": "t1@2", "名称": "李四", "班级": "一班", "考试": {"期中": {"数学": [70, 100], "语文": ['缺考', 100]}}},
+        {"账号": "t1@3", "名称": "王五", "班级": "二班", "考试": {"期中": {"数学": [90, 100], "语文": [60, 100]}}},
+        {"账号": "t1@4", "名称": "赵六", "班级": "二班", "考试": {"期末": {"数学": [100, 100]}}},
+    ])
+
+
+def test_ranks_ties_and_percentile():
+    index = ExamRankingIndex(_snapshot(), '期中')
+    assert index.subjects == ['数学', '语文']
+
+    first = index.student_ranks('t1@1')
+    assert first['className'] == '一班'
+    # 数学同分同名次；百分位为不高于该分数的比例
+    assert first['ranks']['数学'] == {'score': 90, 'rank': 1, 'percentile': 100.0, 'count': 3}
+    assert index.student_ranks('t1@3')['ranks']['数学']['rank'] == 1
+    assert index.student_ranks('t1@2')['ranks']['数学'] == {'score': 70, 'rank': 3, 'percentile': 33.3, 'count': 3}
+    # 非数字成绩不参加该科目的排名，但仍计入总分排名
+    assert '语文' not in index.student_ranks('t1@2')['ranks']
+    assert index.all_ranks(TOTAL_FIELD) == {'t1@1': 1, 't1@2': 3, 't1@3': 2}
+    assert index.student_ranks('t1@4') is None
+
+
+def test_top_keeps_class_order_for_ties():
+    index = ExamRankingIndex(_snapshot(), '期中')
+    assert [(row['account'], row['rank']) for row in index.top('数学', 2)] == [('t1@1', 1), ('t1@3', 1)]
+
+
+def test_histogram_buckets():
+    index = ExamRankingIndex(_snapshot(), '期中')
+    histogram = index.histograms(4)['数学']
+    assert [(bucket['min'], bucket['max']) for bucket in histogram] == [(0, 25), (25, 50), (50, 75), (75, 100)]
+    assert [bucket['count'] for bucket in histogram] == [0, 0, 1, 2]
+    assert index.fields[TOTAL_FIELD].full_score == 200
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    versions = {}
+    loads = []
+
+    def load(conn, teacher_account):
+        loads.append(teacher_account)
+        return _snapshot()
+
+    monkeypatch.setattr(exam_ranking, 'get_exam_version', lambda teacher, exam: versions.get((teacher, exam)))
+    monkeypatch.setattr(exam_ranking, 'get_teacher_snapshot', load)
+    return versions, loads
+
+
+def test_cache_rebuilds_only_after_exam_version_changes(versions):
+    versions, loads = versions
+    cache = exam_ranking.ExamRankingCache(size=1)
+    versions[('t1', '期中')] = 1
+    first = cache.get(None, 't1', '期中')
+    assert cache.get(None, 't1', '期中') is first
+    versions[('t1', '期中')] = 2
+    assert cache.get(None, 't1', '期中') is not first
+    assert cache.stats() == {'hits': 1, 'builds': 2, 'size': 1}
+
+
+def test_no_cache_without_version(versions):
+    _, loads = versions
+    cache = exam_ranking.ExamRankingCache()
+    cache.get(None, 't1', '期中')
+    cache.get(None, 't1', '期中')
+    assert len(loads) == 2 and cache.stats()['size'] == 0
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""考试登记表：按参加的学生数注销没有学生参加的考试，不扫描学生表"""
+import pytest
+
+import exam_registry
+
+
+class FakeCursor:
+    """按语句模拟登记表中的学生数 {考试名: 学生数}"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        self.conn.statements.append((sql, params))
+        assert 'student_' not in sql, '不应扫描学生表'
+        counts = self.conn.counts
+        self.result = []
+        if sql.startswith('INSERT'):
+            exam_name, joined = params[1], params[4]
+            counts[exam_name] = counts.get(exam_name, 0) + joined
+        elif sql.startswith('SELECT `id`'):
+            self.result = [(1, '[]', '{}')]
+        elif sql.startswith('SELECT `students`'):
+            self.result = [(counts[params[1]],)] if params[1] in counts else []
+        elif sql.startswith('UPDATE') and '`students` - 1' in sql:
+            if counts.get(params[1], 0) > 0:
+                counts[params[1]] -= 1
+        elif sql.startswith('DELETE'):
+            counts.pop(params[1], None)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+
+class FakeConnection:
+    def __init__(self, **counts):
+        self.counts = dict(counts)
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def deleted(self):
+        return [params[1] for sql, params in self.statements if sql.startswith('DELETE')]
+
+
+@pytest.fixture(autouse=True)
+def blob_backend(monkeypatch):
+    monkeypatch.setattr(exam_registry, 'use_score_table', lambda: False)
+
+
+def test_removed_exam_unregistered_when_no_student_left():
+    conn = FakeConnection(月考=2, 期中=1)
+    old = {'月考': {'数学': [80, 100]}, '期中': {'数学': [70, 100]}}
+    exam_registry.unregister_removed_exams(conn, 't1', old, None)
+    assert conn.deleted() == ['期中']
+    assert conn.counts == {'月考': 1}
+
+
+def test_exam_kept_while_other_students_have_it():
+    conn = FakeConnection(期中=2)
+    exam_registry.unregister_removed_exams(conn, 't1', {'期中': {'数学': [50, 100]}}, {})
+    assert conn.deleted() == []
+    assert conn.counts == {'期中': 1}
+
+
+def test_no_queries_when_no_exam_removed():
+    conn = FakeConnection()
+    exam_registry.unregister_removed_exams(conn, 't1', {'期中': {'数学': [1, 100]}}, {'期中': {'数学': [2, 100]}})
+    assert conn.statements == []
+
+
+def test_only_new_exams_counted_as_joined():
+    conn = FakeConnection(期中=1)
+    old = {'期中': {'数学': [60, 100]}}
+    new = {'期中': {'数学': [60, 100], '语文': [70, 120]}, '月考': {'数学': [80, 100]}}
+    exam_registry.register_student_exams(conn, 't1', '一班', old, new)
+    assert conn.counts == {'期中': 1, '月考': 1}
+
+
+def test_table_backend_checks_exam_scores(monkeypatch):
+    monkeypatch.setattr(exam_registry, 'use_score_table', lambda: True)
+    conn = FakeConnection(期中=1)
+    exam_registry.unregister_removed_exams(conn, 't1', {'期中': {'数学': [50, 100]}}, None)
+    assert any(f'FROM `{exam_registry.SCORE_TABLE}`' in sql for sql, _ in conn.statements)
+    assert conn.deleted() == ['期中']
+
+
+class StateCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=()):
+        self.conn.statements.append(' '.join(sql.split()))
+
+    def fetchone(self):
+        return (1,)
+
+    def fetchall(self):
+        return [('期中',)]
+
+
+class StateConnection:
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return StateCursor(self)
+
+
+def test_built_state_checked_once_per_process(monkeypatch):
+    monkeypatch.setattr(exam_registry, '_built_teachers', set())
+    conn = StateConnection()
+    assert exam_registry.exam_exists(conn, 't1', '期中')
+    assert exam_registry.read_exam_names(conn, 't1') == ['期中']
+    state_reads = [sql for sql in conn.statements if f'FROM `{exam_registry.STATE_TABLE}`' in sql]
+    assert len(state_reads) == 1
+    assert len(conn.statements) == 3
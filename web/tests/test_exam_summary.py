@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""exam_summary：读取只读，未构建或 stale 时从快照计算；写操作提交后修复"""
+import exam_summary
+from teacher_snapshot import TeacherSnapshot
+
+
+SNAPSHOT = TeacherSnapshot('t1', [
+    {"账号": "t1@1", "名称": "张三", "班级": "一班", "考试": {"期中": {"数学": [80, 100]}}},
+    {"账号": "t1@2", "名称": "李四", "班级": "一班", "考试": {"期中": {"数学": [60, 100]}}},
+])
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def execute(self, sql, params=()):
+        self.conn.executed.append(sql)
+        if 'FOR UPDATE' in sql or 'LOCK IN SHARE MODE' in sql:
+            raise AssertionError('读取时不应加锁')
+        if f'FROM `{exam_summary.STATE_TABLE}`' in sql:
+            self.result = [self.conn.state] if self.conn.state is not None else []
+        elif f'FROM `{exam_summary.SUMMARY_TABLE}`' in sql:
+            self.result = list(self.conn.rows)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+class FakeConn:
+    def __init__(self, state, rows=()):
+        self.state = state
+        self.rows = rows
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        raise AssertionError('读取时不应提交')
+
+
+def _use_snapshot(monkeypatch):
+    monkeypatch.setattr(exam_summary, 'get_teacher_snapshot', lambda conn, teacher: SNAPSHOT)
+    monkeypatch.setattr(exam_summary, 'rebuild_exam_summary',
+                        lambda *args: (_ for _ in ()).throw(AssertionError('读取时不应重建')))
+    monkeypatch.setattr(exam_summary, 'refresh_stale_exams',
+                        lambda *args: (_ for _ in ()).throw(AssertionError('读取时不应重新计算')))
+
+
+def test_unbuilt_summary_read_from_snapshot(monkeypatch):
+    _use_snapshot(monkeypatch)
+    rows = exam_summary.read_summary_rows(FakeConn(state=None), 't1')
+    assert ('期中', '数学', '一班', 2, 140, 10000, 60, 80) in rows
+    assert ('期中', exam_summary.TOTAL_SUBJECT, '一班', 2, 140, 10000, 60, 80) in rows
+
+
+def test_stale_exam_replaced_in_place(monkeypatch):
+    _use_snapshot(monkeypatch)
+    conn = FakeConn(state=(1,), rows=[
+        ('月考', '数学', '一班', 1, 90, 8100, 90, 90, 0),
+        ('期中', '数学', '一班', 2, 140, 10000, 50, 80, 1),
+        ('期中', '数学', '二班', 1, 70, 4900, 70, 70, 1),
+    ])
+    rows = exam_summary.read_summary_rows(conn, 't1')
+    assert rows[0] == ('月考', '数学', '一班', 1, 90, 8100, 90, 90)
+    assert rows[1] == ('期中', '数学', '一班', 2, 140, 10000, 60, 80)
+    assert rows[2] == ('期中', '数学', '二班', 0, 0, 0, None, None)
+    assert rows[3][:2] == ('期中', exam_summary.TOTAL_SUBJECT)
+
+
+def test_repair_refreshes_stale_exams(monkeypatch):
+    calls = []
+    monkeypatch.setattr(exam_summary, 'rebuild_exam_summary', lambda conn, teacher: calls.append(('rebuild', teacher)))
+    monkeypatch.setattr(exam_summary, 'refresh_stale_exams',
+                        lambda conn, teacher, exams: calls.append(('refresh', teacher, exams)))
+
+    assert exam_summary.repair_exam_summary(FakeConn(state=None), 't1')
+    conn = FakeConn(state=(1,), rows=[('期中',)])
+    assert exam_summary.repair_exam_summary(conn, 't1')
+    assert calls == [('rebuild', 't1'), ('refresh', 't1', ['期中'])]
+
+
+class WriteCursor:
+    """写路径用：记录语句，按语句返回最低/最高分的查询结果"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.executed = []
+        self.result = []
+
+    def execute(self, sql, params=()):
+        self.executed.append((' '.join(sql.split()), params))
+        if 'FOR UPDATE' in sql:
+            self.result = [(*key, *values) for key, values in self.bounds.items()]
+        elif 'GROUP BY' in sql:
+            self.result = [(150.0,), (60.0,)]
+        elif 'MIN(e.`score`)' in sql:
+            self.result = [(60.0, 90.0)]
+
+    def executemany(self, sql, rows):
+        self.executed.append((' '.join(sql.split()), rows))
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+class WriteConn:
+    def __init__(self, bounds):
+        self.cursor_ = WriteCursor(bounds)
+
+    def cursor(self):
+        return self.cursor_
+
+
+def test_removed_minimum_recomputed_from_score_index(monkeypatch):
+    monkeypatch.setattr(exam_summary, 'use_score_table', lambda: True)
+    monkeypatch.setattr(exam_summary, 'get_teacher_snapshot',
+                        lambda *args: (_ for _ in ()).throw(AssertionError('写入时不应加载快照')))
+    # 新考试全部为 0 分，改掉其中一个 0 分
+    conn = WriteConn({('期中', '数学', '一班'): (0, 0), ('期中', exam_summary.TOTAL_SUBJECT, '一班'): (0, 0)})
+    rows = exam_summary.summary_delta('一班', {'期中': {'数学': [0, 100]}}, '一班', {'期中': {'数学': [90, 100]}})
+    exam_summary.apply_summary_delta(conn, 't1', rows)
+
+    updates = [params for sql, params in conn.cursor_.executed if sql.startswith('UPDATE')]
+    assert updates == [
+        (60.0, 150.0, 't1', '期中', exam_summary.TOTAL_SUBJECT, '一班'),
+        (60.0, 90.0, 't1', '期中', '数学', '一班'),
+    ]
+
+
+def test_removed_minimum_left_stale_in_blob_mode(monkeypatch):
+    monkeypatch.setattr(exam_summary, 'use_score_table', lambda: False)
+    conn = WriteConn({('期中', '数学', '一班'): (0, 0), ('期中', exam_summary.TOTAL_SUBJECT, '一班'): (0, 0)})
+    rows = exam_summary.summary_delta('一班', {'期中': {'数学': [0, 100]}}, '一班', {'期中': {'数学': [90, 100]}})
+    exam_summary.apply_summary_delta(conn, 't1', rows)
+
+    (sql, upserted), = [item for item in conn.cursor_.executed if item[0].startswith('INSERT')]
+    assert [row[-1] for row in upserted] == [1, 1]
+    assert not any(sql.startswith('UPDATE') for sql, _ in conn.cursor_.executed)
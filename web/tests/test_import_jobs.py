@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""成绩导入任务：执行出错后放回队列，不会一直停在 running"""
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('openai')      # import_jobs → ALL_function
+
+import import_jobs
+from import_jobs import ImportJobManager, QUEUE_KEY, PROCESSING_KEY, MAX_ATTEMPTS
+from redis_manager import redis_session_manager
+
+
+@pytest.fixture
+def manager(monkeypatch, tmp_path):
+    monkeypatch.setattr(redis_session_manager, 'host', 'fakeredis')
+    monkeypatch.setattr(import_jobs, 'UPLOAD_DIR', str(tmp_path))
+    job_manager = ImportJobManager()
+    job_manager._client = fakeredis.FakeRedis(decode_responses=True)
+    return job_manager
+
+
+def create_job(manager, tmp_path):
+    source = tmp_path / 'scores.csv'
+    source.write_text('账号,名称,数学\nt1@1,张三,90\n', encoding='utf-8')
+    with open(source, 'rb') as handle:
+        return manager.create_job('t1', '一班', '期中', 'scores.csv', handle)['id']
+
+
+def test_failed_run_is_requeued_until_attempts_exhausted(manager, tmp_path, monkeypatch):
+    def broken_connect_db():
+        raise RuntimeError('数据库不可用')
+    monkeypatch.setattr(import_jobs, 'connect_db', broken_connect_db)
+    job_id = create_job(manager, tmp_path)
+    client = manager._client
+
+    for attempt in range(1, MAX_ATTEMPTS):
+        assert manager.process_next(timeout=1) == job_id
+        job = manager.get_job(job_id)
+        assert job['status'] == 'queued' and job['attempts'] == attempt
+        assert '数据库不可用' in job['message']
+        assert client.lrange(QUEUE_KEY, 0, -1) == [job_id]
+        assert client.llen(PROCESSING_KEY) == 0
+
+    assert manager.process_next(timeout=1) == job_id
+    job = manager.get_job(job_id)
+    assert job['status'] == 'failed' and job['attempts'] == MAX_ATTEMPTS
+    assert client.llen(QUEUE_KEY) == 0 and client.llen(PROCESSING_KEY) == 0
+
+
+def test_job_stays_in_processing_list_when_requeue_fails(manager, tmp_path, monkeypatch):
+    import redis
+    job_id = create_job(manager, tmp_path)
+    client = manager._client
+
+    def broken_connect_db():
+        # 数据库出错的同时 Redis 也不可用，任务无法放回队列
+        monkeypatch.setattr(client, 'pipeline', lambda *args, **kwargs: (_ for _ in ()).throw(
+            redis.ConnectionError('Connection refused')))
+        raise RuntimeError('数据库不可用')
+    monkeypatch.setattr(import_jobs, 'connect_db', broken_connect_db)
+
+    assert manager.process_next(timeout=1) == job_id
+    assert client.lrange(PROCESSING_KEY, 0, -1) == [job_id]
+    assert client.get(f"{import_jobs.LOCK_PREFIX}{job_id}") is None
+
+    # 执行锁已释放，队列空闲时由 requeue_stalled 放回队列
+    assert manager.requeue_stalled() == 1
+    assert client.lrange(QUEUE_KEY, 0, -1) == [job_id]
+    assert manager.get_job(job_id)['status'] == 'queued'
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""roster_export：查询在产出第一段之前执行"""
+import pytest
+
+import roster_export
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.closed = False
+
+    def execute(self, sql, params=()):
+        self.conn.executed.append(sql)
+        if self.conn.error:
+            raise self.conn.error
+        self.rows = list(self.conn.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConn:
+    def __init__(self, rows=(), error=None):
+        self.rows = rows
+        self.error = error
+        self.executed = []
+        self.cursors = []
+
+    def cursor(self, cursor_class=None):
+        cursor = FakeCursor(self)
+        self.cursors.append(cursor)
+        return cursor
+
+
+def test_roster_query_runs_before_first_chunk():
+    conn = FakeConn(rows=[('张三', 's1', 'pw1')])
+    chunks = roster_export.stream_roster_csv(conn, 't1', '一班')
+    assert next(chunks) == roster_export.BOM
+    assert len(conn.executed) == 1
+    assert ''.join(chunks) == '姓名,账号,密码\r\n张三,s1,pw1\r\n'
+    assert all(cursor.closed for cursor in conn.cursors)
+
+
+def test_roster_query_error_raised_from_first_chunk():
+    conn = FakeConn(error=RuntimeError('no such table'))
+    chunks = roster_export.stream_roster_csv(conn, 't1')
+    with pytest.raises(RuntimeError):
+        next(chunks)
+    assert all(cursor.closed for cursor in conn.cursors)
+
+
+def test_exam_scores_query_error_raised_from_first_chunk(monkeypatch):
+    monkeypatch.setattr(roster_export, 'use_score_table', lambda: False)
+    monkeypatch.setattr(roster_export, 'exam_subjects', lambda *args: ['语文'])
+    conn = FakeConn(error=RuntimeError('lost connection'))
+    chunks = roster_export.stream_exam_scores_csv(conn, 't1', '期中')
+    with pytest.raises(RuntimeError):
+        next(chunks)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""写入 `考试` 字段的分数必须能被 literal_eval 读回：拒绝 nan / inf"""
+import ast
+
+import pytest
+
+pytest.importorskip('openai')   # ALL_function 在导入时创建 OpenAI 客户端
+
+from ALL_function import _edit_score
+from score_import import CsvScoreImporter
+
+
+@pytest.mark.parametrize('value', ['nan', 'NaN', 'inf', '-Infinity', '1e999', float('nan'), float('inf')])
+def test_non_finite_edit_rejected(value):
+    assert _edit_score(value) is None
+
+
+def test_finite_edit_round_trips():
+    assert _edit_score(' 95 ') == 95
+    assert _edit_score('87.5') == 87.5
+    assert ast.literal_eval(str({'期中': {'数学': [_edit_score('1e3'), 100]}})) == {'期中': {'数学': [1000, 100]}}
+
+
+def test_import_rejects_non_finite_cells():
+    importer = CsvScoreImporter(None, 't1', '一班', '期中')
+    assert importer._parse_score(2, '张三', '数学', 'inf') is False
+    assert importer._parse_score(3, '李四', '数学', 'nan') is False
+    assert importer._parse_score(4, '王五', '数学', '88') == 88.0
+    assert [error['line'] for error in importer.result['errors']] == [2, 3]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""session_sweeper：按时间预算分批扫描，游标保存在 Redis 中，下次从停下的位置继续"""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from session_sweeper import SessionSweeper, CURSOR_KEY, USER_SESSIONS_PREFIX, PHASE_SESSIONS
+
+
+def _put_session(manager, session_id, user_account, expires_at):
+    client = manager.redis_client
+    client.set(f"{manager.prefix}{session_id}", json.dumps({
+        'user_account': user_account,
+        'expires_at': expires_at.isoformat(),
+    }))
+    client.sadd(f"{USER_SESSIONS_PREFIX}{user_account}", session_id)
+
+
+@pytest.fixture
+def sessions(session_manager):
+    past = datetime.now() - timedelta(hours=1)
+    future = datetime.now() + timedelta(hours=1)
+    for i in range(20):
+        _put_session(session_manager, f"old{i}", f"user{i % 4}", past)
+    for i in range(5):
+        _put_session(session_manager, f"live{i}", f"user{i % 4}", future)
+    session_manager.redis_client.set(f"{session_manager.prefix}broken", 'not json')
+    # 会话键已自然过期，只留下集合成员
+    session_manager.redis_client.sadd(f"{USER_SESSIONS_PREFIX}user9", 'gone')
+    return session_manager
+
+
+def _session_keys(manager):
+    return sorted(key[len(manager.prefix):] for key in manager.redis_client.scan_iter(match=f"{manager.prefix}*"))
+
+
+def test_tick_resumes_from_saved_cursor(sessions):
+    sweeper = SessionSweeper(sessions, batch=3)
+    client = sessions.redis_client
+
+    # 预算为 0：每次只扫描一批就保存游标退出
+    stats = sweeper.tick(budget_ms=0, interval=0)
+    assert stats['scanned'] <= 3 and stats['passes'] == 0
+    phase, _, cursor = client.get(CURSOR_KEY).partition(':')
+    assert phase == PHASE_SESSIONS and int(cursor) > 0
+
+    total = dict(stats)
+    for _ in range(100):
+        stats = sweeper.tick(budget_ms=0, interval=0)
+        for name, value in stats.items():
+            total[name] += value
+        if total['passes']:
+            break
+
+    assert total['passes'] == 1
+    assert total['scanned'] == 26      # 每个会话键只扫描一次
+    assert total['expired'] == 20 and total['invalid'] == 1
+    assert _session_keys(sessions) == [f"live{i}" for i in range(5)]
+    assert client.get(CURSOR_KEY) == f"{PHASE_SESSIONS}:0"
+    assert not client.exists(f"{USER_SESSIONS_PREFIX}user9")
+    assert client.smembers(f"{USER_SESSIONS_PREFIX}user0") == {'live0', 'live4'}
+
+
+def test_invalid_saved_cursor_restarts_scan(sessions):
+    sessions.redis_client.set(CURSOR_KEY, 'garbage')
+    stats = SessionSweeper(sessions, batch=100).tick(budget_ms=1000, interval=0)
+    assert stats['passes'] == 1 and stats['expired'] == 20
+
+
+def test_schedule_lock_runs_once_per_interval(sessions):
+    sweeper = SessionSweeper(sessions, batch=100)
+    assert sweeper.tick(budget_ms=1000, interval=60) is not None
+    assert sweeper.tick(budget_ms=1000, interval=60) is None
+
+
+def test_sweep_all_keeps_background_cursor(sessions):
+    sessions.redis_client.set(CURSOR_KEY, f"{PHASE_SESSIONS}:7")
+    stats = SessionSweeper(sessions, batch=2).sweep_all()
+    assert stats['expired'] == 20 and stats['dangling'] == 1
+    assert sessions.redis_client.get(CURSOR_KEY) == f"{PHASE_SESSIONS}:7"
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""签名会话令牌：签发、校验、撤销和共享密钥"""
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+import session_tokens
+from session_tokens import SessionTokenManager, is_session_token
+
+
+class Worker:
+    """一个 worker 中的令牌管理器，可以模拟 Redis 断开"""
+
+    def __init__(self, server):
+        self.client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        self.connected = True
+        self.tokens = SessionTokenManager(lambda: self.client if self.connected else None)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.delenv('SMSF_SESSION_SECRET', raising=False)
+    monkeypatch.setattr(session_tokens, 'REVOCATION_REFRESH', 0)
+    return fakeredis.FakeServer()
+
+
+def test_issue_and_verify_across_workers(server):
+    worker_a, worker_b = Worker(server), Worker(server)
+    token = worker_a.tokens.issue('t1', 'teacher', 1)
+    assert is_session_token(token)
+    claims = worker_b.tokens.verify(token)
+    assert claims['a'] == 't1' and claims['t'] == 'teacher'
+    data = worker_b.tokens.session_data(token)
+    assert data['user_account'] == 't1' and data['user_type'] == 'teacher'
+
+
+def test_tampered_and_expired_tokens_rejected(server):
+    tokens = Worker(server).tokens
+    token = tokens.issue('t1', 'teacher', 1)
+    prefix, payload, signature = token.split('.')
+    forged = tokens.issue('t2', 'teacher', 1).split('.')[1]
+    assert tokens.verify(f"{prefix}.{forged}.{signature}") is None
+    assert tokens.verify(token[:-2]) is None
+    assert tokens.verify('not-a-token') is None
+    assert tokens.verify(tokens.issue('t1', 'teacher', -1)) is None
+
+
+def test_revoke_single_token_and_user(server):
+    worker_a, worker_b = Worker(server), Worker(server)
+    first = worker_a.tokens.issue('t1', 'teacher', 1)
+    second = worker_a.tokens.issue('t1', 'teacher', 1)
+    other = worker_a.tokens.issue('t2', 'teacher', 1)
+
+    assert worker_a.tokens.revoke(first)
+    assert worker_b.tokens.verify(first) is None
+    assert worker_b.tokens.verify(second) is not None
+
+    time.sleep(0.01)
+    assert worker_a.tokens.revoke_user('t1')
+    assert worker_b.tokens.verify(second) is None
+    assert worker_b.tokens.verify(other) is not None
+    # 强制下线之后重新登录签发的令牌有效
+    time.sleep(0.01)
+    assert worker_b.tokens.verify(worker_a.tokens.issue('t1', 'teacher', 1)) is not None
+
+
+def test_no_process_local_secret_when_redis_unavailable(server):
+    worker_a, worker_b = Worker(server), Worker(server)
+    worker_b.connected = False
+    assert worker_b.tokens.issue('t1', 'teacher', 1) is None
+    token = worker_a.tokens.issue('t1', 'teacher', 1)
+    assert worker_b.tokens.verify(token) is None
+
+    # Redis 恢复后读取共享密钥，两个 worker 的令牌互相可以校验
+    worker_b.connected = True
+    assert worker_b.tokens.verify(token) is not None
+    assert worker_a.tokens.verify(worker_b.tokens.issue('t2', 'free', 1)) is not None
+
+
+def test_secret_from_environment(server, monkeypatch):
+    monkeypatch.setenv('SMSF_SESSION_SECRET', 'shared')
+    issuer = SessionTokenManager(lambda: None)
+    verifier = SessionTokenManager(lambda: None)
+    assert verifier.verify(issuer.issue('t1', 'teacher', 1))['a'] == 't1'
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""会话校验：一次往返返回用户账号和用户类型"""
+import json
+import time
+
+import pytest
+
+
+@pytest.fixture
+def manager(session_manager):
+    pytest.importorskip('lupa')     # fakeredis 执行 Lua 脚本需要 lupa
+    session_manager.local_cache.ttl = 0
+    return session_manager
+
+
+def test_identity_includes_user_type(manager):
+    teacher = manager.create_session('t1', 1, 'teacher')
+    free = manager.create_session('f1', 1, 'free')
+    assert manager.validate_identity(teacher) == ('t1', 'teacher')
+    assert manager.validate_identity(free) == ('f1', 'free')
+    assert manager.validate_and_touch(teacher) == 't1'
+    assert manager.validate_identity('missing') is None
+
+
+def test_session_without_user_type(manager):
+    session_id = manager.create_session('f1', 1)
+    assert manager.validate_identity(session_id) == ('f1', None)
+    # 更早版本创建的会话没有 user_type 字段
+    key = f"{manager.prefix}{session_id}"
+    data = json.loads(manager.redis_client.get(key))
+    del data['user_type']
+    manager.redis_client.set(key, json.dumps(data), ex=3600)
+    assert manager.validate_identity(session_id) == ('f1', None)
+
+
+def test_local_cache_keeps_user_type(manager):
+    manager.local_cache.ttl = 30
+    manager.local_cache.ensure_listener(manager.redis_client)
+    deadline = time.time() + 2
+    while not manager.local_cache.enabled and time.time() < deadline:
+        time.sleep(0.01)
+    assert manager.local_cache.enabled
+
+    session_id = manager.create_session('t1', 1, 'teacher')
+    assert manager.validate_identity(session_id) == ('t1', 'teacher')
+    assert manager.validate_identity(session_id) == ('t1', 'teacher')
+    assert manager.local_cache.hits == 1
+
+
+def test_token_identity(manager):
+    manager.session_mode = 'token'
+    token = manager.create_session('t1', 1, 'teacher')
+    assert manager.validate_identity(token) == ('t1', 'teacher')
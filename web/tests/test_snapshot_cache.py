@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""教师快照缓存：Redis 中的序列化格式和写操作后的失效"""
+import json
+import pickle
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+import redis
+
+import snapshot_cache
+import version_counter
+from snapshot_cache import SnapshotCache
+from teacher_snapshot import TeacherSnapshot
+
+
+TEACHER = 't1'
+
+
+class FakeDatabase:
+    """代替 load_teacher_snapshot 的数据库：记录查询次数"""
+
+    def __init__(self):
+        self.score = 80
+        self.loads = 0
+
+    def load(self, conn, teacher_account):
+        self.loads += 1
+        return TeacherSnapshot(teacher_account, [
+            {"账号": f"{teacher_account}@1", "名称": "张三", "班级": "一班",
+             "考试": {"期中": {"数学": [self.score, 100], "语文": [90, 120]}}},
+            {"账号": f"{teacher_account}@2", "名称": "李四", "班级": "二班", "考试": {}},
+        ])
+
+
+class BrokenPipeline:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        raise redis.ConnectionError('Connection refused')
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(snapshot_cache, 'load_teacher_snapshot', database.load)
+    monkeypatch.setattr(snapshot_cache, 'SNAPSHOT_CACHE_ENABLED', True)
+    return database
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def make_worker(server):
+    """一个 worker 进程中的缓存实例（多个实例共用同一个 Redis）"""
+    cache = SnapshotCache()
+    cache.versions._client = fakeredis.FakeRedis(server=server)
+    return cache
+
+
+def math_score(snapshot):
+    return snapshot.exams_of(f"{TEACHER}@1")["期中"]["数学"][0]
+
+
+def test_snapshot_stored_as_json_and_shared_between_workers(db, server):
+    worker_a, worker_b = make_worker(server), make_worker(server)
+    snapshot = worker_a.get(None, TEACHER)
+    assert db.loads == 1
+
+    client = fakeredis.FakeRedis(server=server)
+    [key] = client.keys(f"{snapshot_cache.SNAPSHOT_PREFIX}*")
+    payload = json.loads(client.get(key))
+    assert payload['teacher'] == TEACHER
+    assert payload['students'] == snapshot.students
+
+    loaded = worker_b.get(None, TEACHER)
+    assert db.loads == 1 and worker_b.redis_hits == 1
+    assert loaded.classes == ["一班", "二班"]
+    assert loaded.exam_scores("期中") == snapshot.exam_scores("期中")
+    assert loaded.subject_scores("语文") == snapshot.subject_scores("语文")
+
+
+def test_pickled_payload_is_not_loaded(db, server):
+    class Payload:
+        def __reduce__(self):
+            return (pytest.fail, ('pickle 数据被执行',))
+
+    worker = make_worker(server)
+    version = worker.versions.version(worker.versions._client, TEACHER)
+    worker.versions._client.set(f"{snapshot_cache.SNAPSHOT_PREFIX}{TEACHER}:{version}", pickle.dumps(Payload()))
+    assert math_score(worker.get(None, TEACHER)) == 80
+    assert worker.misses == 1
+
+
+def test_bump_makes_every_worker_reload(db, server):
+    writer, reader = make_worker(server), make_worker(server)
+    assert math_score(reader.get(None, TEACHER)) == 80
+    db.score = 95
+    writer.bump(TEACHER, ["期中"])
+    assert math_score(reader.get(None, TEACHER)) == 95
+
+
+def test_failed_bump_is_retried_before_cache_is_used(db, server, monkeypatch):
+    writer, reader = make_worker(server), make_worker(server)
+    assert math_score(reader.get(None, TEACHER)) == 80
+    exam_version = reader.exam_version(TEACHER, "期中")
+
+    db.score = 95
+    monkeypatch.setattr(writer.versions._client, 'pipeline', lambda *args, **kwargs: BrokenPipeline())
+    assert writer.bump(TEACHER, ["期中"]) is None
+    assert writer.stats()['pending_bumps'] == 1
+    # 补上之前写操作所在的 worker 不使用缓存
+    assert math_score(writer.get(None, TEACHER)) == 95
+    assert writer.bypassed == 1
+
+    monkeypatch.undo()
+    monkeypatch.setattr(snapshot_cache, 'load_teacher_snapshot', db.load)
+    monkeypatch.setattr(snapshot_cache, 'SNAPSHOT_CACHE_ENABLED', True)
+    writer.versions._down_until = 0
+    assert math_score(writer.get(None, TEACHER)) == 95
+    assert writer.stats()['pending_bumps'] == 0
+    # 其他 worker 读到新版本号，本地和 Redis 中的旧快照都不再使用
+    assert math_score(reader.get(None, TEACHER)) == 95
+    assert reader.exam_version(TEACHER, "期中") != exam_version
+
+
+def test_bump_during_retry_window_is_not_skipped(db, server):
+    writer, reader = make_worker(server), make_worker(server)
+    reader.get(None, TEACHER)
+    writer.versions.mark_down(redis.ConnectionError('timeout'))
+    assert writer.versions._down_until > time.time() + 10
+
+    db.score = 60
+    writer.bump(TEACHER, None)
+    assert writer.stats()['pending_bumps'] == 1
+    # 有待补的 bump 时重试等待期缩短为 PENDING_RETRY_INTERVAL
+    assert writer.versions._down_until <= time.time() + version_counter.PENDING_RETRY_INTERVAL
+    writer.versions._down_until = 0
+    writer.exam_version(TEACHER, "期中")
+    assert writer.stats()['pending_bumps'] == 0
+    assert math_score(reader.get(None, TEACHER)) == 60
+
+
+def test_pending_bump_flushed_by_background_thread(db, server, monkeypatch):
+    monkeypatch.setattr(version_counter, 'PENDING_RETRY_INTERVAL', 0.05)
+    writer, reader = make_worker(server), make_worker(server)
+    reader.get(None, TEACHER)
+    writer.versions.mark_down(redis.ConnectionError('timeout'))
+    db.score = 70
+    writer.bump(TEACHER, ["期中"])
+
+    deadline = time.time() + 2
+    while writer.stats()['pending_bumps'] and time.time() < deadline:
+        time.sleep(0.02)
+    assert writer.stats()['pending_bumps'] == 0
+    assert math_score(reader.get(None, TEACHER)) == 70
+
+
+def test_exam_version_read_is_one_hmget(db, server):
+    writer, reader = make_worker(server), make_worker(server)
+    writer.bump(TEACHER, ["期中"])
+    before = reader.exam_version(TEACHER, "期中")
+
+    commands = []
+    client = reader.versions._client
+    original = client.execute_command
+
+    def record(*args, **kwargs):
+        commands.append(args[0])
+        return original(*args, **kwargs)
+    client.execute_command = record
+    assert reader.exam_version(TEACHER, "期中") == before
+    assert commands == ['HMGET']
+
+    writer.bump(TEACHER, None)
+    assert reader.exam_version(TEACHER, "期中")[0] == before[0] + 1
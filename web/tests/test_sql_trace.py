@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""sql_trace.statement_shape：同一模板的语句得到相同的形状"""
+import sql_trace
+from sql_trace import statement_shape
+
+
+def test_whitespace_collapsed():
+    assert statement_shape('SELECT *\n    FROM `t`\tWHERE `a` = %s  ') == 'SELECT * FROM `t` WHERE `a` = %s'
+
+
+def test_in_lists_of_any_length_share_a_shape():
+    two = statement_shape('SELECT * FROM `t` WHERE `id` IN (%s, %s)')
+    five = statement_shape('SELECT * FROM `t` WHERE `id` IN (%s,%s, %s ,%s, %s)')
+    assert two == five == 'SELECT * FROM `t` WHERE `id` IN (%s, ...)'
+    assert statement_shape('SELECT * FROM `t` WHERE `id` IN (%s)') != two
+
+
+def test_multi_row_values_share_a_shape():
+    one = statement_shape('INSERT INTO `t` (`a`, `b`) VALUES (%s, %s)')
+    three = statement_shape('INSERT INTO `t` (`a`, `b`) VALUES (%s, %s), (%s, %s), (%s,%s)')
+    assert three == 'INSERT INTO `t` (`a`, `b`) VALUES (%s, ...), ...'
+    assert one == 'INSERT INTO `t` (`a`, `b`) VALUES (%s, ...)'
+    assert statement_shape(b'SELECT  1') == 'SELECT 1'
+
+
+def test_repeated_shapes_reported_as_n_plus_one():
+    trace = sql_trace.RequestTrace()
+    for _ in range(3):
+        trace.record('SELECT `考试` FROM `student_t1` WHERE `账号` = %s', 1.0)
+    trace.record('SELECT 1', 5.0)
+    assert trace.repeated(threshold=3) == [
+        {'sql': 'SELECT `考试` FROM `student_t1` WHERE `账号` = %s', 'count': 3, 'ms': 3.0}]
+    assert trace.slowest(1)[0]['sql'] == 'SELECT 1'
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""student_roster.allocate_student_numbers：编号连续、不重复，第一次分配时从已有的最大编号开始"""
+import student_roster
+
+
+class FakeCursor:
+    """模拟 student_sequences 表与 LAST_INSERT_ID(expr)"""
+
+    def __init__(self, db):
+        self.db = db
+        self.rowcount = 0
+        self.lastrowid = 0
+        self.result = None
+
+    def execute(self, sql, params=()):
+        if sql.lstrip().startswith('UPDATE'):
+            count, teacher = params
+            if teacher in self.db.sequences:
+                self.db.sequences[teacher] += count
+                self.rowcount = 1
+                self.lastrowid = self.db.sequences[teacher]
+            else:
+                self.rowcount = 0
+        elif sql.lstrip().startswith('SELECT'):
+            self.result = self.db.existing
+        elif sql.lstrip().startswith('INSERT IGNORE'):
+            teacher, last_no = params
+            self.db.sequences.setdefault(teacher, last_no)
+
+    def fetchone(self):
+        return self.result
+
+
+class FakeConn:
+    def __init__(self, existing=(0, 0)):
+        self.sequences = {}
+        self.existing = existing    # (学生表中最大编号, 学生数)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def test_numbers_are_consecutive_across_calls():
+    conn = FakeConn()
+    assert student_roster.allocate_student_numbers(conn, 't1', 3) == 1
+    assert student_roster.allocate_student_numbers(conn, 't1', 2) == 4
+    assert student_roster.allocate_student_numbers(conn, 't2', 1) == 1
+    assert conn.sequences == {'t1': 5, 't2': 1}
+
+
+def test_first_allocation_continues_after_existing_students():
+    # 删除过学生时最大编号大于学生数
+    assert student_roster.allocate_student_numbers(FakeConn(existing=(7, 5)), 't1', 2) == 8
+    # 旧账号编号无法解析时按学生数继续，避免与 COUNT(*) 生成的账号重复
+    assert student_roster.allocate_student_numbers(FakeConn(existing=(0, 3)), 't1', 1) == 4
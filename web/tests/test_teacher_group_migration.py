@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""分组迁移：原字段保持不变，同一考试属于多个分组时记录冲突而不是静默丢弃"""
+import json
+
+import pytest
+
+import teacher_groups
+
+
+class FakeCursor:
+    """按语句开头模拟 teachers / 分组 / 成员 / 模板 / 迁移表"""
+
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        self.db.executed.append(sql)
+        self.result = []
+        if sql.startswith('SELECT `分组`, `模板` FROM `teachers`'):
+            self.result = [self.db.teacher_row]
+        elif sql.startswith(f'SELECT 1 FROM `{teacher_groups.MIGRATION_TABLE}`'):
+            self.result = [(1,)] if params[0] in self.db.migrated else []
+        elif sql.startswith(f'INSERT IGNORE INTO `{teacher_groups.GROUP_TABLE}`'):
+            self.db.groups.setdefault(params[1], len(self.db.groups) + 1)
+        elif sql.startswith(f'INSERT IGNORE INTO `{teacher_groups.MEMBER_TABLE}`'):
+            self.db.members.setdefault(params[1], params[3])
+        elif sql.startswith(f'INSERT INTO `{teacher_groups.TEMPLATE_TABLE}`'):
+            self.db.templates[params[1]] = json.loads(params[2])
+        elif sql.startswith(f'INSERT INTO `{teacher_groups.MIGRATION_TABLE}`'):
+            self.db.migrated[params[0]] = params[1]
+        elif sql.startswith('UPDATE `teachers`'):
+            raise AssertionError('迁移不应修改 teachers 表')
+        else:
+            raise AssertionError(f'未预期的语句: {sql}')
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+
+class FakeConn:
+    def __init__(self, group_blob, template_blob=None):
+        self.teacher_row = (group_blob, template_blob)
+        self.migrated = {}
+        self.groups = {}
+        self.members = {}
+        self.templates = {}
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fresh_process(monkeypatch):
+    monkeypatch.setattr(teacher_groups, '_migrated', set())
+
+
+def test_exam_in_several_groups_reported_not_dropped(capsys):
+    conn = FakeConn(str({'期中': ['数学周测', '期中考试'], '月考': ['数学周测', '十月']}),
+                    str({'标准': {'数学': 150}}))
+    teacher_groups._migrate_teacher_blobs(conn, 't1')
+
+    # 第一个分组保留，其余成员关系记录为冲突
+    assert conn.members == {'数学周测': '期中', '期中考试': '期中', '十月': '月考'}
+    assert json.loads(conn.migrated['t1']) == [['数学周测', '月考']]
+    assert conn.templates == {'标准': {'数学': 150}}
+    assert '数学周测' in capsys.readouterr().out
+
+
+def test_migration_runs_once_per_teacher():
+    conn = FakeConn(str({'期中': ['期中考试']}))
+    teacher_groups._migrate_teacher_blobs(conn, 't1')
+    assert conn.migrated == {'t1': None}
+
+    # 其他进程：查询一次迁移表即可
+    teacher_groups._migrated.clear()
+    executed = len(conn.executed)
+    teacher_groups._migrate_teacher_blobs(conn, 't1')
+    assert len(conn.executed) == executed + 1
+
+    # 本进程：不再查询
+    teacher_groups._migrate_teacher_blobs(conn, 't1')
+    assert len(conn.executed) == executed + 1
+
+
+def test_teacher_without_legacy_data_marked_migrated():
+    conn = FakeConn(None)
+    teacher_groups._migrate_teacher_blobs(conn, 't1')
+    assert conn.migrated == {'t1': None} and not conn.groups
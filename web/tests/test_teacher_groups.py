@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""分组缓存：写操作后的失效，以及增加版本号失败时的补写"""
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+import redis
+
+import teacher_groups
+import version_counter
+from teacher_groups import TeacherGroupCache, TeacherGroups
+
+
+TEACHER = 't1'
+
+
+class BrokenPipeline:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        raise redis.ConnectionError('Connection refused')
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.groups = {'期中考试': ['期中']}
+        self.loads = 0
+
+    def load(self, conn, teacher_account):
+        self.loads += 1
+        return TeacherGroups({name: list(exams) for name, exams in self.groups.items()}, {})
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(teacher_groups, 'load_teacher_groups', database.load)
+    monkeypatch.setattr(teacher_groups, 'GROUP_CACHE_ENABLED', True)
+    return database
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def make_worker(server):
+    cache = TeacherGroupCache()
+    cache.versions._client = fakeredis.FakeRedis(server=server)
+    return cache
+
+
+def test_cached_until_invalidated(db, server):
+    writer, reader = make_worker(server), make_worker(server)
+    assert reader.get(None, TEACHER).groups == {'期中考试': ['期中']}
+    reader.get(None, TEACHER)
+    assert db.loads == 1 and reader.hits == 1
+
+    db.groups['期末考试'] = ['期末']
+    writer.invalidate(TEACHER)
+    assert '期末考试' in reader.get(None, TEACHER).groups
+
+
+def test_failed_invalidate_is_retried(db, server, monkeypatch):
+    writer, reader = make_worker(server), make_worker(server)
+    reader.get(None, TEACHER)
+
+    db.groups = {}
+    with monkeypatch.context() as patch:
+        patch.setattr(writer.versions._client, 'pipeline', lambda *args, **kwargs: BrokenPipeline())
+        writer.invalidate(TEACHER)
+        assert writer.stats()['pending'] == 1
+        # 补上之前写操作所在的 worker 不使用缓存
+        assert writer.get(None, TEACHER).groups == {}
+        assert writer.bypassed == 1
+
+    writer.versions._down_until = 0
+    assert writer.get(None, TEACHER).groups == {}
+    assert writer.stats()['pending'] == 0
+    assert reader.get(None, TEACHER).groups == {}
+
+
+def test_invalidate_during_retry_window_flushed_by_background_thread(db, server, monkeypatch):
+    monkeypatch.setattr(version_counter, 'PENDING_RETRY_INTERVAL', 0.05)
+    writer, reader = make_worker(server), make_worker(server)
+    reader.get(None, TEACHER)
+    writer.versions.mark_down(redis.ConnectionError('timeout'))
+
+    db.groups = {'新分组': []}
+    writer.invalidate(TEACHER)
+    deadline = time.time() + 2
+    while writer.stats()['pending'] and time.time() < deadline:
+        time.sleep(0.02)
+    assert writer.stats()['pending'] == 0
+    assert reader.get(None, TEACHER).groups == {'新分组': []}
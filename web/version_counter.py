@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Redis 版本号计数器 - 教师快照缓存和分组缓存共用
+
+- 每个教师在 Redis 中有一个版本号，写操作提交后 INCR，多个 gunicorn worker 共享；
+  缓存按 (教师, 版本号) 保存数据，版本号变化后其他 worker 下次读取即重新加载
+- 可选地按字段另外记录版本号（哈希 {field_prefix}{教师}，例如按考试），写操作只增加受影响字段的版本；
+  字段 '*' 是"全部字段"的版本，无法确定受影响的字段时增加它
+
+增加版本号失败（Redis 出错或处于重试等待期）时记为待补：补上之前本进程的 client() 返回 None（不使用缓存），
+后台线程每 PENDING_RETRY_INTERVAL 秒重试一次（不等待 RETRY_INTERVAL），补上后其他 worker 立即读到新版本。
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+try:
+    import redis
+    from redis_manager import redis_session_manager
+    VERSION_COUNTER_ENABLED = True
+except ImportError as e:
+    VERSION_COUNTER_ENABLED = False
+    print(f"⚠️  Redis 版本号不可用，缓存将不启用: {e}")
+
+
+ALL_FIELDS = '*'            # 字段版本哈希中"全部字段"的版本
+RETRY_INTERVAL = 30         # Redis 出错后多久再尝试（秒）
+PENDING_RETRY_INTERVAL = 1  # 有未完成的版本号增加时多久重试（秒）
+
+
+def _initial_version() -> int:
+    # 首次使用（或 Redis 数据丢失）时以毫秒时间戳为起点，避免与进程内残留的旧版本号重复
+    return int(time.time() * 1000)
+
+
+class VersionCounter:
+    """按教师保存在 Redis 中的版本号，以及失败后的补写"""
+
+    def __init__(self, name: str, version_prefix: str, field_prefix: Optional[str] = None,
+                 on_down: Optional[Callable[[], None]] = None):
+        """
+        参数:
+        name: 使用方的名称（日志中显示）
+        version_prefix: 教师版本号的键前缀
+        field_prefix: 字段版本哈希的键前缀，None 表示不按字段记录
+        on_down: Redis 出错时调用（使用方清空进程内缓存）
+        """
+        self.name = name
+        self.version_prefix = version_prefix
+        self.field_prefix = field_prefix
+        self._on_down = on_down
+        self._client = None
+        self._down_until = 0
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Optional[Set[str]]] = {}   # 增加失败的教师 -> 受影响的字段（None 表示全部）
+        self._pending_seq: Dict[str, int] = {}              # 增加失败的教师 -> 失败次数
+        self._retry_thread = None
+
+    # ------------------------------------------------------------------
+    # 连接
+    # ------------------------------------------------------------------
+    def connect(self):
+        """创建 Redis 客户端（独立的连接池，不解码，使用方可以存取 bytes），没有配置 Redis 时返回 None"""
+        if not VERSION_COUNTER_ENABLED:
+            return None
+        if self._client is None:
+            manager = redis_session_manager
+            if not manager.host:
+                return None
+            self._client = redis.Redis(
+                host=manager.host,
+                port=manager.port,
+                password=manager.password,
+                db=manager.db,
+                socket_connect_timeout=3,
+                socket_timeout=3,
+                health_check_interval=30,
+            )
+        return self._client
+
+    def client(self):
+        """获取可以使用的 Redis 客户端（有未完成的版本号增加时先补上，补不上或处于重试等待期返回 None）"""
+        if time.time() < self._down_until:
+            return None
+        client = self.connect()
+        if client is not None and self._pending and not self._flush_pending(client):
+            return None
+        return client
+
+    def mark_down(self, e):
+        """Redis 出错：等待一段时间再使用，有未完成的版本号增加时尽快重试"""
+        print(f"⚠️  {self.name}暂不可用: {e}")
+        self._down_until = time.time() + (PENDING_RETRY_INTERVAL if self._pending else RETRY_INTERVAL)
+        if self._on_down is not None:
+            self._on_down()
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    def version(self, client, teacher_account: str) -> int:
+        """读取教师的当前版本号（Redis 出错时抛出 redis.RedisError）"""
+        key = f"{self.version_prefix}{teacher_account}"
+        version = client.get(key)
+        if version is None:
+            pipe = client.pipeline(transaction=False)
+            pipe.set(key, _initial_version(), nx=True)
+            if self.field_prefix is not None:
+                pipe.hsetnx(f"{self.field_prefix}{teacher_account}", ALL_FIELDS, _initial_version())
+            pipe.get(key)
+            version = pipe.execute()[-1]
+        return int(version)
+
+    def field_version(self, teacher_account: str, field: str) -> Optional[Tuple[int, int]]:
+        """
+        读取字段的版本号，Redis 不可用时返回 None（调用方不应缓存）
+
+        返回:
+        tuple: (全部字段版本, 该字段版本)，任一部分变化都表示该字段的数据可能已变化
+        """
+        client = self.client()
+        if client is None:
+            return None
+        key = f"{self.field_prefix}{teacher_account}"
+        try:
+            # 全部字段的版本在增加版本号或首次读取教师版本号时写入，通常只需要一次 HMGET
+            all_version, version = client.hmget(key, [ALL_FIELDS, field])
+            if all_version is None:
+                client.hsetnx(key, ALL_FIELDS, _initial_version())
+                all_version, version = client.hmget(key, [ALL_FIELDS, field])
+            return int(all_version), int(version or 0)
+        except redis.RedisError as e:
+            self.mark_down(e)
+            return None
+
+    # ------------------------------------------------------------------
+    # 增加版本号
+    # ------------------------------------------------------------------
+    def _queue_bump(self, pipe, teacher_account: str, fields: Optional[Iterable[str]]):
+        pipe.incr(f"{self.version_prefix}{teacher_account}")
+        if self.field_prefix is None:
+            return
+        key = f"{self.field_prefix}{teacher_account}"
+        pipe.hsetnx(key, ALL_FIELDS, _initial_version())
+        for field in ([ALL_FIELDS] if fields is None else fields):
+            pipe.hincrby(key, field, 1)
+
+    def bump(self, teacher_account: str, fields: Optional[Iterable[str]] = None) -> Optional[int]:
+        """
+        增加教师的版本号（写操作提交之后调用），返回新版本号；失败时记为待补
+
+        参数:
+        fields: 发生变化的字段；None 表示无法确定，所有字段的版本都会变化
+        """
+        if fields is not None:
+            fields = set(fields)
+        if self.connect() is None:
+            return None     # 没有配置 Redis，读取时也不使用缓存
+        client = self.client()
+        if client is None:
+            self._add_pending(teacher_account, fields)
+            return None
+        try:
+            pipe = client.pipeline(transaction=False)
+            self._queue_bump(pipe, teacher_account, fields)
+            return pipe.execute()[0]
+        except redis.RedisError as e:
+            self._add_pending(teacher_account, fields)
+            self.mark_down(e)
+            return None
+
+    def _add_pending(self, teacher_account: str, fields: Optional[Set[str]]):
+        """记下失败的版本号增加，由后台线程每 PENDING_RETRY_INTERVAL 秒重试，直到写入 Redis"""
+        with self._lock:
+            if fields is None or self._pending.get(teacher_account, set()) is None:
+                self._pending[teacher_account] = None
+            else:
+                self._pending.setdefault(teacher_account, set()).update(fields)
+            self._pending_seq[teacher_account] = self._pending_seq.get(teacher_account, 0) + 1
+            self._down_until = min(self._down_until, time.time() + PENDING_RETRY_INTERVAL)
+            if self._retry_thread is None or not self._retry_thread.is_alive():
+                self._retry_thread = threading.Thread(target=self._retry_pending, name="version-bump-retry",
+                                                      daemon=True)
+                self._retry_thread.start()
+
+    def _retry_pending(self):
+        # 不依赖本进程是否还有请求：其他 worker 在补上之前一直读到旧版本
+        while self._pending:
+            time.sleep(PENDING_RETRY_INTERVAL)
+            self.client()
+
+    def _flush_pending(self, client) -> bool:
+        """补上之前失败的版本号增加，成功返回 True"""
+        with self._lock:
+            pending = {teacher_account: set(fields) if fields is not None else None
+                       for teacher_account, fields in self._pending.items()}
+            seq = dict(self._pending_seq)
+        try:
+            pipe = client.pipeline(transaction=False)
+            for teacher_account, fields in pending.items():
+                self._queue_bump(pipe, teacher_account, fields)
+            pipe.execute()
+        except redis.RedisError as e:
+            self.mark_down(e)
+            return False
+        with self._lock:
+            for teacher_account in pending:
+                # 补写期间同一教师又有失败的写操作时保留，下次再补
+                if self._pending_seq.get(teacher_account) == seq[teacher_account]:
+                    self._pending.pop(teacher_account, None)
+                    self._pending_seq.pop(teacher_account, None)
+        print(f"✅ {self.name}: 已补上 {len(pending)} 个教师的版本号")
+        return True
+
+    @property
+    def pending(self) -> int:
+        """待补的教师数"""
+        return len(self._pending)
@@ -1,7 +1,8 @@
 import binascii
 
 import pymysql
-from flask import Flask,redirect, url_for, session
+from flask import Flask,redirect, url_for, session, g, Response, stream_with_context
+from urllib.parse import quote
 from ALL_function import (
     connect_db,
     read_english_passage,
@@ -10,15 +11,11 @@ from ALL_function import (
     create_teacher_table,
     add_teacher,
     authenticate_teacher,
-    read_class,
-    read_teacher_group,
-    not_group_exam,
     read_student,
-    read_single_class,
     read_student_exam,
     student_class_change,
-    change_student_score,
-    update_student_score,
+    apply_score_edits,
+    MAX_SCORE_EDITS,
     read_study_resources,
     read_all_subjects,
     read_video_detail,
@@ -34,9 +31,26 @@ from ALL_function import (
     save_new_word_ids_to_vo_book,
     read_some_word_form_certain_level
 )
+from db_pool import connect as pool_connect, begin_request_scope, end_request_scope
+from sql_trace import start_sql_trace, finish_sql_trace
+from metrics import observe_request, observe_auth, metrics_response
+from session_tokens import is_session_token
+from exam_scores import create_exam_scores_table, teacher_of
+from snapshot_cache import get_teacher_snapshot
+import exam_analytics
+from exam_ranking import get_exam_ranking
+from roster_export import stream_roster_csv, stream_exam_scores_csv
+from import_jobs import import_job_manager, create_import_job, get_import_job, start_import_workers
+from session_sweeper import start_session_sweeper
+from exam_summary import create_exam_summary_tables, read_exam_list
+from exam_registry import create_exam_registry_tables, read_exam_registry, get_exam_by_id, read_exam_names
+from teacher_groups import create_teacher_group_tables, get_teacher_groups
+from student_roster import create_student_sequence_table, add_students_bulk, MAX_BULK_STUDENTS
 
 import os
+import json
 import time
+from functools import wraps
 import hashlib
 import smtplib
 import random
@@ -52,7 +66,7 @@ try:
         get_user_session,
         delete_user_session,
         force_logout_user,
-        extend_user_session
+        validate_user_identity
     )
     REDIS_ENABLED = True
     print("✅ Redis 会话管理已启用")
@@ -71,6 +85,20 @@ def is_development_mode():
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # 设置密钥用于session
 
+# 请求级数据库连接：同一请求内所有 connect_db() 共用一个连接
+@app.before_request
+def open_db_request_scope():
+    g.request_started = time.perf_counter()
+    g.db_scope = begin_request_scope()
+    # 按采样比例统计本请求的 SQL（开发模式下每个请求都统计）
+    g.sql_trace = start_sql_trace(force=is_development_mode())
+
+
+@app.teardown_request
+def close_db_request_scope(exc):
+    end_request_scope(g.pop('db_scope', None))
+
+
 # 添加CORS支持
 @app.after_request
 def after_request(response):
@@ -78,8 +106,104 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    # 本请求新建的物理连接数 / 借出的连接数
+    db_scope = g.get('db_scope')
+    if db_scope is not None:
+        response.headers['X-DB-Connections-Opened'] = str(db_scope.physical_opened)
+        response.headers['X-DB-Connections-Used'] = str(db_scope.checkouts)
+    # Server-Timing：鉴权耗时，以及查询次数、数据库耗时和疑似 N+1 的语句
+    timings = []
+    auth_ms = g.get('auth_ms')
+    if auth_ms is not None:
+        timings.append(f'auth;dur={auth_ms:.2f};desc="{g.auth_source}"')
+    sql_trace = g.pop('sql_trace', None)
+    if sql_trace is not None:
+        if sql_trace.queries:
+            timings.append(sql_trace.server_timing())
+        finish_sql_trace(sql_trace, method=request.method, path=request.path, status=response.status_code)
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(timings)
+    # Prometheus 指标：按路由模板统计（不用实际路径，避免考试编号等参数产生大量标签）
+    request_started = g.pop('request_started', None)
+    if request_started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        observe_request(request.method, route, response.status_code, time.perf_counter() - request_started)
     return response
 
+
+# ==================== 登录用户 ====================
+
+def resolve_current_user():
+    """
+    解析当前请求的登录用户（每个请求只解析一次，结果保存在 g 上）
+
+    先校验 Cookie 中的 session_id（Redis 会话或签名令牌，会话的续期策略在 validate_user_identity 中执行），
+    再回退到 Flask session。整个过程的耗时记为 Server-Timing 中的 auth 项和 Prometheus 指标。
+
+    Returns:
+        str: 用户账号，未登录返回 None；用户类型保存在 g.user_type
+    """
+    if 'user_account' in g:
+        return g.user_account
+
+    started = time.perf_counter()
+    user_account = None
+    user_type = None
+    source = 'none'
+    session_id = request.cookies.get('session_id')
+    # 签名令牌在本地校验，不需要 Redis 连接
+    if session_id and REDIS_ENABLED and (is_session_token(session_id) or redis_session_manager.is_connected()):
+        identity = validate_user_identity(session_id)
+        if identity:
+            # 用户类型来自会话数据或令牌载荷；早期创建的会话没有记录类型，按免费账户处理
+            user_account, user_type = identity[0], identity[1] or 'free'
+            source = 'token' if is_session_token(session_id) else 'redis'
+
+    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
+    if not user_account and 'user_account' in session:
+        user_account = session['user_account']
+        user_type = session.get('user_type', 'teacher')
+        source = 'flask'
+
+    g.user_account = user_account
+    g.user_type = user_type
+    g.auth_source = source
+    g.auth_ms = (time.perf_counter() - started) * 1000
+    observe_auth(source, g.auth_ms / 1000)
+    return user_account
+
+
+def require_user(kind='api'):
+    """
+    要求登录的路由装饰器，视图中通过 g.user_account 取得当前用户
+
+    Args:
+        kind: 'api' 未登录时返回 401 JSON；'page' 未登录时重定向到登录页面
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not resolve_current_user():
+                if kind == 'page':
+                    return redirect(url_for('login'))
+                return jsonify({
+                    'success': False,
+                    'message': '用户未登录'
+                }), 401
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指标（多进程模式下汇总所有 worker）"""
+    result = metrics_response()
+    if result is None:
+        return Response("prometheus_client 未安装\n", status=404, mimetype='text/plain')
+    body, content_type = result
+    return Response(body, headers={'Content-Type': content_type})
+
 # 生产环境优化配置
 if not is_development_mode():
     # 生产环境配置
@@ -425,6 +549,11 @@ def api_register():
 # 初始化数据库连接 - 仅用于首次创建表
 initial_conn = connect_db()
 create_teacher_table(initial_conn)
+create_exam_scores_table(initial_conn)
+create_exam_summary_tables(initial_conn)
+create_exam_registry_tables(initial_conn)
+create_teacher_group_tables(initial_conn)
+create_student_sequence_table(initial_conn)
 initial_conn.close()  # 关闭初始连接
 
 @app.route('/')
@@ -826,7 +955,7 @@ def api_free_login():
             session_id = None
             if REDIS_ENABLED and redis_session_manager.is_connected():
                 # 使用 Redis 创建会话
-                session_id = create_user_session(account, expires_in_hours=24)
+                session_id = create_user_session(account, expires_in_hours=24, user_type='free')
                 if session_id:
                     response_data = {
                         'success': True, 
@@ -928,7 +1057,7 @@ def api_login():
             session_id = None
             if REDIS_ENABLED and redis_session_manager.is_connected():
                 # 使用 Redis 创建会话
-                session_id = create_user_session(account, expires_in_hours=24)
+                session_id = create_user_session(account, expires_in_hours=24, user_type='teacher')
                 if session_id:
                     response_data = {
                         'success': True, 
@@ -1008,50 +1137,13 @@ def api_login():
             conn.close()  # 确保连接被关闭
 
 @app.route('/api/current_user', methods=['GET'])
+@require_user()
 def get_current_user():
     """获取当前登录用户信息 - 支持 Redis 会话"""
     print(f"DEBUG: /api/current_user 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
     
-    user_account = None
-    user_type = None
-    session_id = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-                user_type = 'free'  # Redis会话通常用于免费账户
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        user_type = session.get('user_type', 'teacher')
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}, 类型: {user_type}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-    
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
+    user_type = g.user_type
     
     print(f"DEBUG: 成功获取用户信息，用户: {user_account}, 类型: {user_type}")
     
@@ -1064,47 +1156,12 @@ def get_current_user():
     })
 
 @app.route('/api/check-user-type', methods=['GET'])
+@require_user()
 def check_user_type():
     """检查用户类型并返回相应的页面跳转信息 - 支持 Redis 会话"""
     print(f"DEBUG: /api/check-user-type 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
-    
-    user_account = None
-    session_id = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
     
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 开始检查用户类型，用户: {user_account}")
     
@@ -1131,68 +1188,34 @@ def check_user_type():
 
 
 @app.route('/api/statistics', methods=['GET'])
+@require_user()
 def get_statistics():
     """获取统计信息 - 支持 Redis 会话"""
     print(f"DEBUG: /api/statistics 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
-    
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
     
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问统计API，用户: {user_account}")
     conn = None
     try:
         conn = connect_db()
+        # 读取教师名下全部学生和考试（优先使用快照缓存）
+        snapshot = get_teacher_snapshot(conn, user_account)
         
         # 获取班级数量
-        classes = read_class(conn, user_account)
+        classes = snapshot.classes
         class_count = len(classes) if classes else 0
         
         # 获取学生数量
         student_count = 0
         if classes:
             for class_name in classes:
-                students = read_single_class(conn, user_account, class_name)
+                students = snapshot.class_students(class_name)
                 student_count += len(students) if students else 0
         
         # 获取考试数量
-        grouped_exams = read_teacher_group(conn, user_account)
-        ungrouped_exams = not_group_exam(conn, user_account)
+        grouped_exams = get_teacher_groups(conn, user_account).groups
+        ungrouped_exams = snapshot.ungrouped_exams(grouped_exams)
         exam_count = len(grouped_exams) + len(ungrouped_exams)
         
         # 计算平均及格率（模拟数据，实际应用中需要根据具体逻辑计算）
@@ -1220,48 +1243,12 @@ def get_statistics():
             conn.close()
 
 @app.route('/api/leaderboard/<leaderboard_type>')
+@require_user()
 def get_leaderboard(leaderboard_type):
     """获取排行榜数据 - 支持 Redis 会话"""
     print(f"DEBUG: /api/leaderboard/{leaderboard_type} 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
     
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问排行榜API，用户: {user_account}")
     
@@ -1286,56 +1273,22 @@ def get_leaderboard(leaderboard_type):
         }), 500
 
 @app.route('/api/class-distribution', methods=['GET'])
+@require_user()
 def get_class_distribution():
     """获取班级分布数据用于饼图 - 支持 Redis 会话"""
     print(f"DEBUG: /api/class-distribution 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
     
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问班级分布API，用户: {user_account}")
     conn = None
     try:
         conn = connect_db()
+        # 读取教师名下全部学生和考试（优先使用快照缓存）
+        snapshot = get_teacher_snapshot(conn, user_account)
         
         # 获取所有班级
-        classes = read_class(conn, user_account)
+        classes = snapshot.classes
         
         if not classes:
             return jsonify({
@@ -1351,7 +1304,7 @@ def get_class_distribution():
         studentCounts = []
         
         for class_name in classes:
-            students = read_single_class(conn, user_account, class_name)
+            students = snapshot.class_students(class_name)
             student_count = len(students) if students else 0
             classNames.append(class_name)
             studentCounts.append(student_count)
@@ -1374,56 +1327,22 @@ def get_class_distribution():
             conn.close()
 
 @app.route('/api/subject-comparison', methods=['GET'])
+@require_user()
 def get_subject_comparison():
     """获取科目对比数据用于柱状图 - 支持 Redis 会话"""
     print(f"DEBUG: /api/subject-comparison 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
-    
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
     
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问科目对比API，用户: {user_account}")
     conn = None
     try:
         conn = connect_db()
+        # 读取教师名下全部学生和考试（优先使用快照缓存）
+        snapshot = get_teacher_snapshot(conn, user_account)
         
         # 获取所有班级
-        classes = read_class(conn, user_account)
+        classes = snapshot.classes
         
         if not classes:
             return jsonify({
@@ -1440,14 +1359,14 @@ def get_subject_comparison():
         class_averages = {}  # 存储每个班级的科目平均分
         
         for class_name in classes:
-            students = read_single_class(conn, user_account, class_name)
+            students = snapshot.class_students(class_name)
             class_subject_totals = {}  # 存储每个科目的总分
             class_subject_counts = {}  # 存储每个科目的计数
             
             if students:
                 for student in students:
                     student_id = student["账号"]
-                    student_exams = read_student_exam(conn, student_id)
+                    student_exams = snapshot.exams_of(student_id)
                     
                     for exam_data in student_exams.values():
                         for subject, (score, total) in exam_data.items():
@@ -1509,56 +1428,22 @@ def get_subject_comparison():
             conn.close()
 
 @app.route('/api/classes', methods=['GET'])
+@require_user()
 def get_classes():
     """获取班级列表用于班级管理页面 - 支持 Redis 会话"""
     print(f"DEBUG: /api/classes 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
     
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问班级列表API，用户: {user_account}")
     conn = None
     try:
         conn = connect_db()
+        # 读取教师名下全部学生和考试（优先使用快照缓存）
+        snapshot = get_teacher_snapshot(conn, user_account)
         
         # 获取所有班级
-        classes = read_class(conn, user_account)
+        classes = snapshot.classes
         
         if not classes:
             return jsonify({
@@ -1570,7 +1455,7 @@ def get_classes():
         class_list = []
         
         for class_name in classes:
-            students = read_single_class(conn, user_account, class_name)
+            students = snapshot.class_students(class_name)
             student_count = len(students) if students else 0
             
             # 计算班级平均分
@@ -1580,7 +1465,7 @@ def get_classes():
             if students:
                 for student in students:
                     student_id = student["账号"]
-                    student_exams = read_student_exam(conn, student_id)
+                    student_exams = snapshot.exams_of(student_id)
                     
                     for exam_data in student_exams.values():
                         for subject, (score, total) in exam_data.items():
@@ -1594,7 +1479,7 @@ def get_classes():
             if students:
                 for student in students:
                     student_id = student["账号"]
-                    student_exams = read_student_exam(conn, student_id)
+                    student_exams = snapshot.exams_of(student_id)
                     exam_count = max(exam_count, len(student_exams))
             
             class_info = {
@@ -1621,137 +1506,29 @@ def get_classes():
             conn.close()
 
 @app.route('/api/class-detail/<class_name>', methods=['GET'])
+@require_user()
 def get_class_detail(class_name):
     """获取班级详细信息 - 支持 Redis 会话"""
     print(f"DEBUG: /api/class-detail/{class_name} 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
     
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问班级详情API，用户: {user_account}")
     conn = None
     try:
         conn = connect_db()
+        # 读取教师名下全部学生和考试（优先使用快照缓存）
+        snapshot = get_teacher_snapshot(conn, user_account)
         
-        # 获取指定班级的学生列表
-        students = read_single_class(conn, user_account, class_name)
+        # 班级统计（学生 × 考试 × 科目数组上向量化计算）
+        class_detail = exam_analytics.class_detail(snapshot, class_name)
         
-        if not students:
+        if class_detail is None:
             return jsonify({
                 'success': False,
                 'message': '班级不存在或无学生数据'
             })
         
-        # 计算班级整体信息
-        student_count = len(students)
-        total_score = 0
-        total_count = 0
-        exam_count = 0
-        passed_count = 0  # 及格人数（假设60分为及格线）
-        
-        # 存储学生详细信息
-        student_list = []
-        subject_totals = {}  # 存储各科目的总分
-        subject_counts = {}  # 存储各科目的计数
-        
-        for student in students:
-            student_id = student["账号"]
-            student_name = student["名称"]
-            student_exams = read_student_exam(conn, student_id)
-            
-            # 计算学生的平均分和考试次数
-            student_total_score = 0
-            student_score_count = 0
-            student_passed_count = 0
-            
-            for exam_data in student_exams.values():
-                for subject, (score, total) in exam_data.items():
-                    student_total_score += score
-                    student_score_count += 1
-                    total_score += score
-                    total_count += 1
-                    
-                    # 统计科目总分
-                    if subject not in subject_totals:
-                        subject_totals[subject] = 0
-                        subject_counts[subject] = 0
-                    subject_totals[subject] += score
-                    subject_counts[subject] += 1
-                    
-                    # 统计及格情况
-                    if score >= 60:
-                        student_passed_count += 1
-                        passed_count += 1
-            
-            # 存储学生信息
-            student_info = {
-                'name': student_name,
-                'account': student_id,
-                'avgScore': student_total_score / student_score_count if student_score_count > 0 else 0,
-                'examCount': len(student_exams),
-                'passedRate': (student_passed_count / student_score_count * 100) if student_score_count > 0 else 0
-            }
-            student_list.append(student_info)
-            
-            # 更新考试数量
-            exam_count = max(exam_count, len(student_exams))
-        
-        # 计算班级平均分和及格率
-        class_avg_score = total_score / total_count if total_count > 0 else 0
-        class_pass_rate = (passed_count / total_count * 100) if total_count > 0 else 0
-        
-        # 计算各科目平均分
-        subject_averages = {}
-        for subject in subject_totals:
-            subject_averages[subject] = subject_totals[subject] / subject_counts[subject]
-        
-        # 准备返回数据
-        class_detail = {
-            'className': class_name,
-            'studentCount': student_count,
-            'avgScore': round(class_avg_score, 2),
-            'passRate': round(class_pass_rate, 2),
-            'examCount': exam_count,
-            'students': student_list,
-            'subjectAverages': subject_averages
-        }
-        
         return jsonify({
             'success': True,
             'classDetail': class_detail
@@ -1767,45 +1544,12 @@ def get_class_detail(class_name):
             conn.close()
 
 @app.route('/class-detail')
+@require_user(kind='page')
 def class_detail():
     """班级详情页面 - 支持 Redis 会话"""
     print(f"DEBUG: /class-detail 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
     
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，重定向到登录页面
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，重定向到登录页面")
-        return redirect(url_for('login'))
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问 class-detail 页面，用户: {user_account}")
     return send_from_directory('static', 'OKComputer_企业化网页重设/class_detail.html')
@@ -1852,105 +1596,33 @@ def get_video_detail(video_id):
 
 
 @app.route('/student-detail')
+@require_user(kind='page')
 def student_detail():
     """学生详情页面 - 支持 Redis 会话"""
     print(f"DEBUG: /student-detail 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
     
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，重定向到登录页面
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，重定向到登录页面")
-        return redirect(url_for('login'))
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问 student-detail 页面，用户: {user_account}")
     return send_from_directory('static', 'OKComputer_企业化网页重设/student_detail.html')
 
 
 @app.route('/modify-score')
+@require_user(kind='page')
 def modify_score():
     """修改成绩页面 - 支持 Redis 会话"""
     print(f"DEBUG: /modify-score 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
     
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，重定向到登录页面
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，重定向到登录页面")
-        return redirect(url_for('login'))
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问 modify-score 页面，用户: {user_account}")
     return send_from_directory('static', 'OKComputer_企业化网页重设/modify_score.html')
 
 
 @app.route('/api/student-exam-data/<student_account>')
+@require_user()
 def get_student_exam_data(student_account):
-    """获取学生的考试数据"""
-    if 'user_account' not in session:
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
-    
-    user_account = session['user_account']
+    """获取学生的考试数据 - 支持 Redis 会话"""
     conn = None
     try:
         conn = connect_db()
@@ -1974,48 +1646,12 @@ def get_student_exam_data(student_account):
 
 
 @app.route('/api/student-detail/<student_account>', methods=['GET'])
+@require_user()
 def get_student_detail(student_account):
     """获取学生详细信息 - 支持 Redis 会话"""
     print(f"DEBUG: /api/student-detail/{student_account} 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
-    
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
     
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问学生详情API，用户: {user_account}")
     conn = None
@@ -2038,104 +1674,10 @@ def get_student_detail(student_account):
                 'message': '学生信息数据不完整'
             })
         
-        # 获取学生考试数据
-        student_exams = read_student_exam(conn, student_account)
-        
-        # 初始化各项指标
-        total_exams = len(student_exams)
-        total_score = 0
-        total_count = 0
-        highest_score = 0
-        lowest_score = float('inf')  # 初始化为无穷大
-        passed_count = 0  # 及格考试次数
-        subject_totals = {}  # 各科目总分
-        subject_counts = {}  # 各科目考试次数
-        exam_records = []  # 考试记录详情
-        exam_trend_labels = []  # 考试趋势标签
-        exam_trend_data = []  # 考试趋势数据
-        
-        # 遍历考试数据并计算各项指标
-        for exam_name, exam_data in student_exams.items():
-            # 计算本次考试总分
-            exam_total = 0
-            exam_max = 0
-            
-            for subject, (score, max_score) in exam_data.items():
-                if subject != 'total':  # 跳过total字段
-                    exam_total += score
-                    exam_max += max_score
-                    total_score += score
-                    total_count += 1
-                    
-                    # 记录最高分和最低分
-                    if score > highest_score:
-                        highest_score = score
-                    if score < lowest_score:
-                        lowest_score = score
-                    
-                    # 统计科目数据
-                    if subject not in subject_totals:
-                        subject_totals[subject] = 0
-                        subject_counts[subject] = 0
-                    subject_totals[subject] += score
-                    subject_counts[subject] += 1
-                    
-                    # 统计及格情况
-                    if score >= 60:
-                        passed_count += 1
-            
-            # 添加考试记录
-            exam_record = {
-                'examName': exam_name,
-                'date': '2024-01-01',  # 实际应用中应从数据库获取
-                'subjects': exam_data,
-                'total': [exam_total, exam_max]
-            }
-            exam_records.append(exam_record)
-            
-            # 添加考试趋势数据
-            exam_trend_labels.append(exam_name)
-            exam_trend_data.append(exam_total)
-        
-        # 处理没有考试数据的情况
-        if total_count == 0:
-            avg_score = 0
-            pass_rate = '0%'
-            lowest_score = 0  # 如果没有考试数据，最低分设为0
-        else:
-            avg_score = total_score / total_count
-            pass_rate = f"{(passed_count / total_count * 100):.1f}%"
-        
-        # 计算各科目平均分
-        subject_averages = {}
-        for subject in subject_totals:
-            subject_averages[subject] = subject_totals[subject] / subject_counts[subject]
-        
-        # 找出最强和最弱科目
-        strongest_subject = ""
-        strongest_score = 0
-        weakest_subject = ""
-        weakest_score = float('inf')
-        
-        for subject, avg in subject_averages.items():
-            if avg > strongest_score:
-                strongest_score = avg
-                strongest_subject = subject
-            if avg < weakest_score:
-                weakest_score = avg
-                weakest_subject = subject
-        
-        # 如果没有科目数据，设置默认值
-        if not subject_averages:
-            strongest_subject = "暂无数据"
-            strongest_score = 0
-            weakest_subject = "暂无数据"
-            weakest_score = 0
-        else:
-            # 如果没找到最弱科目（例如所有科目分数相同），使用任意一个科目
-            if weakest_subject == "":
-                weakest_subject = list(subject_averages.keys())[0]
-                weakest_score = subject_averages[weakest_subject]
+        # 学生成绩统计（学生 × 考试 × 科目数组上向量化计算）
+        snapshot = get_teacher_snapshot(conn, teacher_of(student_account))
+        detail = exam_analytics.student_detail(snapshot, student_account)
+        total_count = detail['totalCount']
         
         # 模拟AI分析（实际应用中应调用AI分析函数）
         ai_analysis = "该学生在较强科目表现优异，但在部分科目仍需加强练习。建议重点关注薄弱环节，制定个性化学习计划。" if total_count > 0 else "暂无考试数据，无法进行分析。"
@@ -2150,24 +1692,21 @@ def get_student_detail(student_account):
                 'name': student_info[0],
                 'account': student_account,
                 'className': student_info[1],
-                'avgScore': avg_score,
-                'examCount': total_exams,
-                'highestScore': highest_score,
-                'lowestScore': lowest_score,  # 添加最低分
-                'passRate': pass_rate,
+                'avgScore': detail['avgScore'],
+                'examCount': detail['examCount'],
+                'highestScore': detail['highestScore'],
+                'lowestScore': detail['lowestScore'],  # 添加最低分
+                'passRate': detail['passRate'],
                 'avgScoreChange': avg_score_change,
                 'passRateChange': pass_rate_change
             },
-            'examRecords': exam_records,
-            'examTrendData': {
-                'labels': exam_trend_labels,
-                'data': exam_trend_data
-            },
-            'subjectAverages': subject_averages,
-            'strongestSubject': strongest_subject,
-            'strongestScore': strongest_score,
-            'weakestSubject': weakest_subject,
-            'weakestScore': weakest_score,
+            'examRecords': detail['examRecords'],
+            'examTrendData': detail['examTrendData'],
+            'subjectAverages': detail['subjectAverages'],
+            'strongestSubject': detail['strongestSubject'],
+            'strongestScore': detail['strongestScore'],
+            'weakestSubject': detail['weakestSubject'],
+            'weakestScore': detail['weakestScore'],
             'aiAnalysis': ai_analysis
         }
         
@@ -2186,260 +1725,411 @@ def get_student_detail(student_account):
 
 
 @app.route('/dashboard')
+@require_user(kind='page')
 def dashboard():
     """仪表板页面 - 登录成功后跳转的页面"""
     print(f"DEBUG: 请求到达 /dashboard 路由")
-    print(f"DEBUG: Cookies: {request.cookies}")
-    
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
     
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，重定向到登录页面
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，重定向到登录页面")
-        return redirect(url_for('login'))
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问 dashboard，用户: {user_account}")
     # 传递用户名给前端
     return send_from_directory('static', 'OKComputer_企业化网页重设/dashboard.html')
 
 @app.route('/classes')
+@require_user(kind='page')
 def classes():
     """班级管理页面"""
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        if session_id:
-            session_data = get_user_session(session_id)
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-    
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-    
-    # 如果都没有找到有效的会话，重定向到登录页面
-    if not user_account:
-        return redirect(url_for('login'))
-        
     return send_from_directory('static', 'OKComputer_企业化网页重设/classes.html')
 
 @app.route('/exams')
+@require_user(kind='page')
 def exams():
     """考试管理页面"""
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        if session_id:
-            session_data = get_user_session(session_id)
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-    
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-    
-    # 如果都没有找到有效的会话，重定向到登录页面
-    if not user_account:
-        return redirect(url_for('login'))
-        
     return send_from_directory('static', 'OKComputer_企业化网页重设/exams.html')
 
 @app.route('/exam-detail')
+@require_user(kind='page')
 def exam_detail():
     """考试详情页面"""
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        if session_id:
-            session_data = get_user_session(session_id)
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-    
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-    
-    # 如果都没有找到有效的会话，重定向到登录页面
-    if not user_account:
-        return redirect(url_for('login'))
-        
     return send_from_directory('static', 'OKComputer_企业化网页重设/exam_detail.html')
 
 
 @app.route('/api/exam-detail/<exam_name>', methods=['GET'])
+@require_user()
 def get_exam_detail(exam_name):
     """获取考试详细信息 - 支持 Redis 会话"""
     print(f"DEBUG: /api/exam-detail/{exam_name} 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
     
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
+    user_account = g.user_account
+    
+    print(f"DEBUG: 允许访问考试详情API，用户: {user_account}")
+    conn = None
+    try:
+        conn = connect_db()
+        
+        # 读取教师名下全部学生和考试（优先使用快照缓存）
+        snapshot = get_teacher_snapshot(conn, user_account)
+        
+        # 考试统计（学生 × 考试 × 科目数组上向量化计算，学生按班级顺序排列）
+        exam_detail, all_students = exam_analytics.exam_detail(snapshot, exam_name)
+        
+        return jsonify({
+            'success': True,
+            'examDetail': exam_detail,
+            'students': all_students
+        })
+        
+    except Exception as e:
+        print(f'获取考试详情时出现错误: {str(e)}')  # 添加错误日志
+        import traceback
+        traceback.print_exc()  # 打印详细错误堆栈
+        return jsonify({
+            'success': False,
+            'message': f'获取考试详情时出现错误: {str(e)}'
+        }), 500
+    finally:
+        if conn:
+            conn.close()
+
+
+@app.route('/api/exam-ranking/<exam_name>', methods=['GET'])
+@require_user()
+def get_exam_ranking_api(exam_name):
+    """
+    考试排名与分数分布 - 支持 Redis 会话
+
+    查询参数:
+    subject: 排名字段，total（默认）或科目名
+    top: 返回前多少名（默认 10）
+    student: 查询指定学生在总分和各科目中的名次与百分位（可选）
+    buckets: 分数分布的分段数（默认 10）
+    all: 为 1 时返回全部学生在该字段的名次 {学生账号: 名次}
+    """
+    user_account = g.user_account
+    
+    subject = request.args.get('subject', 'total')
+    student_account = request.args.get('student')
+    try:
+        top_k = max(0, min(int(request.args.get('top', 10)), 1000))
+        buckets = max(1, min(int(request.args.get('buckets', 10)), 100))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'top 和 buckets 必须是整数'
+        }), 400
+    
+    conn = None
+    try:
+        conn = connect_db()
+        # 按考试缓存的排名索引，只在该考试成绩变化后重建
+        ranking = get_exam_ranking(conn, user_account, exam_name)
+        
+        if subject not in ranking.fields:
+            return jsonify({
+                'success': False,
+                'message': f'考试中没有科目: {subject}'
+            }), 404
+        
+        result = {
+            'success': True,
+            'exam': exam_name,
+            'subject': subject,
+            'participants': len(ranking.students),
+            'subjects': ranking.subjects,
+            'top': ranking.top(subject, top_k),
+            'histograms': ranking.histograms(buckets)
+        }
+        if student_account:
+            result['student'] = ranking.student_ranks(student_account)
+        if request.args.get('all') == '1':
+            result['ranks'] = ranking.all_ranks(subject)
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        print(f'获取考试排名时出现错误: {str(e)}')
+        return jsonify({
+            'success': False,
+            'message': f'获取考试排名时出现错误: {str(e)}'
+        }), 500
+    finally:
+        if conn:
+            conn.close()
+
+
+@app.route('/api/import-jobs', methods=['POST'])
+@require_user()
+def create_import_job_api():
+    """
+    上传成绩文件（CSV/Excel）并创建后台导入任务 - 支持 Redis 会话
+
+    表单字段:
+    file: 成绩文件
+    className: 班级名称
+    examName: 考试名称
+    fullScores: 满分字典的 JSON（可选，不填时科目取表头、满分 100）
+    """
+    user_account = g.user_account
+    
+    upload = request.files.get('file')
+    class_name = request.form.get('className', '').strip()
+    exam_name = request.form.get('examName', '').strip()
+    if not upload or not upload.filename or not class_name or not exam_name:
+        return jsonify({
+            'success': False,
+            'message': '请上传文件并填写班级和考试名称'
+        }), 400
+    
+    full_scores = None
+    if request.form.get('fullScores'):
+        try:
+            full_scores = json.loads(request.form['fullScores'])
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'fullScores 不是有效的 JSON'
+            }), 400
+    
+    if not import_job_manager.available():
+        return jsonify({
+            'success': False,
+            'message': '导入服务暂不可用，请稍后重试'
+        }), 503
+    
+    try:
+        job = create_import_job(user_account, class_name, exam_name, upload.filename, upload, full_scores)
+        return jsonify({
+            'success': True,
+            'jobId': job['id'],
+            'job': job
+        }), 202
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        print(f'创建导入任务时出现错误: {str(e)}')
+        return jsonify({
+            'success': False,
+            'message': f'创建导入任务时出现错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/import-jobs/<job_id>', methods=['GET'])
+@require_user()
+def get_import_job_api(job_id):
+    """查询导入任务的进度（已处理行数、错误、预计剩余时间） - 支持 Redis 会话"""
+    user_account = g.user_account
+    
+    try:
+        job = get_import_job(job_id)
+    except Exception as e:
+        print(f'查询导入任务时出现错误: {str(e)}')
+        return jsonify({
+            'success': False,
+            'message': f'查询导入任务时出现错误: {str(e)}'
+        }), 500
+    
+    # 只能查询自己创建的任务
+    if not job or job['teacher'] != user_account:
+        return jsonify({
+            'success': False,
+            'message': '导入任务不存在'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+
+def _csv_download(make_stream, filename):
+    """
+    以流式响应返回 CSV（不写临时文件）
+
+    make_stream 接收数据库连接并返回 CSV 文本生成器；先取出第一段，
+    参数或查询出错时还能返回 JSON 错误，之后的数据边查询边发送，连接在发送完后关闭。
+    """
+    conn = connect_db()
+    try:
+        chunks = make_stream(conn)
+        first = next(chunks, '')
+    except Exception:
+        conn.close()
+        raise
+
+    def generate():
+        try:
+            yield first
+            yield from chunks
+        finally:
+            conn.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={
+            'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+            'Cache-Control': 'no-cache, no-store, must-revalidate'
+        }
+    )
+
+
+@app.route('/api/students/bulk', methods=['POST'])
+@require_user()
+def add_students_bulk_api():
+    """
+    批量创建学生（一个事务，账号编号原子分配） - 支持 Redis 会话
+
+    请求 JSON:
+    students: [{"name": 姓名, "className": 班级}, ...] 或 [[姓名, 班级], ...]
+    className: 默认班级（学生没有填写班级时使用，可选）
+
+    返回创建的学生账号和初始密码，顺序与请求相同
+    """
+    user_account = g.user_account
+    
+    data = request.get_json(silent=True) or {}
+    default_class = str(data.get('className') or '').strip()
+    students = []
+    for index, item in enumerate(data.get('students') or [], start=1):
+        if isinstance(item, dict):
+            name, class_name = item.get('name'), item.get('className') or default_class
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            name, class_name = item
+        else:
+            name, class_name = None, None
+        name = str(name or '').strip()
+        class_name = str(class_name or '').strip()
+        if not name or not class_name:
+            return jsonify({
+                'success': False,
+                'message': f'第 {index} 个学生缺少姓名或班级'
+            }), 400
+        students.append((name, class_name))
+    
+    if not students:
+        return jsonify({
+            'success': False,
+            'message': '学生列表不能为空'
+        }), 400
+    if len(students) > MAX_BULK_STUDENTS:
+        return jsonify({
+            'success': False,
+            'message': f'一次最多创建 {MAX_BULK_STUDENTS} 名学生'
+        }), 400
+    
+    conn = None
+    try:
+        conn = connect_db()
+        result = add_students_bulk(conn, user_account, students)
+        if not result['success']:
+            return jsonify({
+                'success': False,
+                'message': f"批量创建学生时出现错误: {result.get('message', '')}"
+            }), 500
+        return jsonify({
+            'success': True,
+            'count': len(result['students']),
+            'students': result['students'],
+            'elapsedMs': result['elapsed_ms']
+        })
+    except Exception as e:
+        print(f'批量创建学生时出现错误: {str(e)}')
+        return jsonify({
+            'success': False,
+            'message': f'批量创建学生时出现错误: {str(e)}'
+        }), 500
+    finally:
+        if conn:
+            conn.close()
+
+
+@app.route('/api/export/class/<class_name>.csv', methods=['GET'])
+@require_user()
+def export_class_roster_csv(class_name):
+    """导出班级学生的账号和密码（CSV，流式） - 支持 Redis 会话"""
+    user_account = g.user_account
+    
+    try:
+        return _csv_download(lambda conn: stream_roster_csv(conn, user_account, class_name),
+                             f"{class_name}_账号密码.csv")
+    except Exception as e:
+        print(f'导出班级账号时出现错误: {str(e)}')
+        return jsonify({
+            'success': False,
+            'message': f'导出班级账号时出现错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/export/roster.csv', methods=['GET'])
+@require_user()
+def export_teacher_roster_csv():
+    """导出教师名下全部班级学生的账号和密码（CSV，流式） - 支持 Redis 会话"""
+    user_account = g.user_account
     
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
+    try:
+        return _csv_download(lambda conn: stream_roster_csv(conn, user_account),
+                             f"{user_account}_全部学生账号密码.csv")
+    except Exception as e:
+        print(f'导出学生账号时出现错误: {str(e)}')
+        return jsonify({
+            'success': False,
+            'message': f'导出学生账号时出现错误: {str(e)}'
+        }), 500
 
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
 
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
+@app.route('/api/export/exam/<exam_name>.csv', methods=['GET'])
+@require_user()
+def export_exam_scores_csv(exam_name):
+    """
+    导出一次考试的成绩（CSV，流式） - 支持 Redis 会话
+
+    查询参数:
+    class: 只导出指定班级（可选）
+    """
+    user_account = g.user_account
+    
+    class_name = request.args.get('class') or None
+    try:
+        return _csv_download(lambda conn: stream_exam_scores_csv(conn, user_account, exam_name, class_name),
+                             f"{exam_name}{'_' + class_name if class_name else ''}_成绩.csv")
+    except Exception as e:
+        print(f'导出考试成绩时出现错误: {str(e)}')
         return jsonify({
             'success': False,
-            'message': '用户未登录'
-        }), 401
+            'message': f'导出考试成绩时出现错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/exam-details/<int:exam_id>')
+@require_user()
+def get_exam_details(exam_id):
+    """获取考试详情 - 为兼容现有功能保留 - 支持 Redis 会话"""
+    print(f"DEBUG: /api/exam-details/{exam_id} 被调用")
+    
+    user_account = g.user_account
+    
+    print(f"DEBUG: 允许访问考试详情API (by ID)，用户: {user_account}")
     
-    print(f"DEBUG: 允许访问考试详情API，用户: {user_account}")
     conn = None
     try:
         conn = connect_db()
         
-        # 获取所有班级
-        classes = read_class(conn, user_account)
-        
-        if not classes:
+        # 从考试登记表按编号查找考试名称（只能查到自己的考试）
+        exam = get_exam_by_id(conn, user_account, exam_id)
+        if exam is None:
             return jsonify({
-                'success': True,
-                'examDetail': {
-                    'name': exam_name,
-                    'date': '2024-01-01',
-                    'participants': 0,
-                    'avgScore': 0,
-                    'subjectMaxScores': {},
-                    'allSubjects': []
-                },
-                'students': []
-            })
-        
-        # 收集参加此考试的所有学生信息
-        all_students = []
-        total_score = 0
-        score_count = 0
-        participant_count = 0
-        subject_max_scores = {}  # 存储各科目的满分
-        all_subjects = set()  # 收集所有科目名称
-        
-        for class_name in classes:
-            students = read_single_class(conn, user_account, class_name)
-            
-            if students:
-                for student in students:
-                    student_id = student["账号"]
-                    try:
-                        student_exams = read_student_exam(conn, student_id)
-                        
-                        # 检查学生是否参加了此次考试
-                        if exam_name in student_exams:
-                            exam_data = student_exams[exam_name]
-                            
-                            # 获取学生基本信息
-                            student_info = read_student(conn, student_id)
-                            student_name = student_info[0] if student_info else "未知学生"
-                            
-                            # 计算该学生的总分
-                            student_total = sum([score[0] for score in exam_data.values()])
-                            
-                            # 统计总分和科目数
-                            for subject, (score, max_score) in exam_data.items():
-                                total_score += score
-                                score_count += 1
-                                all_subjects.add(subject)
-                                
-                                # 记录各科目的满分（取最大值）
-                                if subject not in subject_max_scores or max_score > subject_max_scores[subject]:
-                                    subject_max_scores[subject] = max_score
-                            
-                            # 添加学生信息到列表
-                            student_detail = {
-                                'name': student_name,
-                                'account': student_id,
-                                'className': class_name,
-                                'scores': {subject: data[0] for subject, data in exam_data.items()},  # 只保留得分，不包含满分
-                                'totalScore': student_total
-                            }
-                            all_students.append(student_detail)
-                            participant_count += 1
-                    except Exception as e:
-                        print(f"读取学生 {student_id} 考试数据时出错: {str(e)}")
-                        continue  # 继续处理下一个学生
+                'success': False,
+                'message': '考试不存在'
+            }), 404
         
-        if score_count == 0:
-            avg_score = 0
-        else:
-            avg_score = total_score / score_count
-        
-        # 构建考试详情
-        exam_detail = {
-            'name': exam_name,
-            'date': '2024-01-01',  # 实际应用中应从数据库获取
-            'participants': participant_count,
-            'avgScore': avg_score,
-            'subjectMaxScores': subject_max_scores,
-            'allSubjects': list(all_subjects)
-        }
+        snapshot = get_teacher_snapshot(conn, user_account)
+        exam_detail, all_students = exam_analytics.exam_detail(snapshot, exam['name'])
+        exam_detail['id'] = exam['id']
+        exam_detail['createdAt'] = exam['createdAt']
         
         return jsonify({
             'success': True,
@@ -2448,9 +2138,7 @@ def get_exam_detail(exam_name):
         })
         
     except Exception as e:
-        print(f'获取考试详情时出现错误: {str(e)}')  # 添加错误日志
-        import traceback
-        traceback.print_exc()  # 打印详细错误堆栈
+        print(f'获取考试详情时出现错误: {str(e)}')
         return jsonify({
             'success': False,
             'message': f'获取考试详情时出现错误: {str(e)}'
@@ -2460,192 +2148,49 @@ def get_exam_detail(exam_name):
             conn.close()
 
 
-@app.route('/api/exam-details/<int:exam_id>')
-def get_exam_details(exam_id):
-    """获取考试详情 - 为兼容现有功能保留 - 支持 Redis 会话"""
-    print(f"DEBUG: /api/exam-details/{exam_id} 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
-    
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({'success': False, 'message': '用户未登录'}), 401
-    
-    print(f"DEBUG: 允许访问考试详情API (by ID)，用户: {user_account}")
-    
-    # 这里需要根据exam_id获取实际的考试名称
-    # 由于目前的实现中没有直接的方法从ID获取考试名称，我们需要通过其他方式实现
-    # 在实际应用中，您可能需要一个方法来根据ID获取考试名称
-    # 为了兼容性，这里返回一个通用的错误信息
-    return jsonify({
-        'success': False,
-        'message': '请使用考试名称而非ID来获取考试详情'
-    })
-
-
 @app.route('/reports')
+@require_user(kind='page')
 def reports():
     """报表统计页面"""
-    if 'user_account' not in session:
-        return redirect(url_for('login'))
     return '<h1>报表统计</h1><p>这里是报表统计页面</p><a href="/dashboard">返回仪表板</a>'
 
 # 考试管理相关API
 @app.route('/api/exams', methods=['GET'])
+@require_user()
 def get_exams():
     """获取考试列表 - 支持 Redis 会话"""
     print(f"DEBUG: /api/exams 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
-    
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
     
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问考试列表API，用户: {user_account}")
     conn = None
     try:
         conn = connect_db()
         
-        # 获取所有班级
-        classes = read_class(conn, user_account)
-        
-        if not classes:
-            return jsonify({
-                'success': True,
-                'exams': []
-            })
-        
-        # 收集所有考试数据
-        all_exams = {}
-        
-        for class_name in classes:
-            students = read_single_class(conn, user_account, class_name)
-            
-            if students:
-                for student in students:
-                    student_id = student["账号"]
-                    student_exams = read_student_exam(conn, student_id)
-                    
-                    for exam_name, exam_data in student_exams.items():
-                        if exam_name not in all_exams:
-                            # 初始化考试信息
-                            all_exams[exam_name] = {
-                                'name': exam_name,
-                                'subject': '',  # 我们可以尝试从科目名推断
-                                'className': class_name,
-                                'date': '2024-01-01',  # 默认日期，实际应用中应从数据库获取
-                                'participants': 0,
-                                'total_score': 0,
-                                'score_count': 0,
-                                'highest_score': float('-inf'),  # 最高分
-                                'lowest_score': float('inf'),      # 最低分
-                                'subjects': set()  # 记录该考试涉及的所有科目
-                            }
-                        
-                        # 更新参与者数量和分数统计
-                        all_exams[exam_name]['participants'] += 1
-                        for subject, (score, total) in exam_data.items():
-                            all_exams[exam_name]['total_score'] += score
-                            all_exams[exam_name]['score_count'] += 1
-                            all_exams[exam_name]['subjects'].add(subject)
-                            
-                            # 更新最高分和最低分
-                            if score > all_exams[exam_name]['highest_score']:
-                                all_exams[exam_name]['highest_score'] = score
-                            if score < all_exams[exam_name]['lowest_score']:
-                                all_exams[exam_name]['lowest_score'] = score
-                            
-                            # 使用第一个遇到的科目作为考试科目
-                            if not all_exams[exam_name]['subject']:
-                                all_exams[exam_name]['subject'] = subject
+        # 从考试汇总表读取（按教师一次索引查询，汇总在写成绩时增量维护）
+        exam_summaries = read_exam_list(conn, user_account)
+        # 考试编号和创建时间来自考试登记表
+        registry = read_exam_registry(conn, user_account)
         
         # 格式化考试列表
         exam_list = []
-        for exam_name, exam_data in all_exams.items():
-            avg_score = exam_data['total_score'] / exam_data['score_count'] if exam_data['score_count'] > 0 else 0
-            
-            # 如果最高分还是初始值，说明没有有效分数
-            highest_score = exam_data['highest_score'] if exam_data['highest_score'] != float('-inf') else 0
-            lowest_score = exam_data['lowest_score'] if exam_data['lowest_score'] != float('inf') else 0
-            
+        for exam_data in exam_summaries:
             # 确定考试状态 (可以根据日期或其他逻辑来判断)
             status = 'completed'  # 默认为已完成
+            registered = registry.get(exam_data['name'], {})
             
             exam_info = {
-                'id': len(exam_list) + 1,
+                'id': registered.get('id'),
                 'name': exam_data['name'],
                 'subject': exam_data['subject'],
                 'className': exam_data['className'],
-                'date': exam_data['date'],
+                'date': (registered.get('createdAt') or '2024-01-01')[:10],
                 'status': status,
                 'participants': exam_data['participants'],
-                'avgScore': round(avg_score, 1),
-                'highestScore': highest_score,
-                'lowestScore': lowest_score
+                'avgScore': exam_data['avgScore'],
+                'highestScore': exam_data['highestScore'],
+                'lowestScore': exam_data['lowestScore']
             }
             exam_list.append(exam_info)
         
@@ -2664,56 +2209,22 @@ def get_exams():
             conn.close()
 
 @app.route('/api/exam-statistics', methods=['GET'])
+@require_user()
 def get_exam_statistics():
     """获取考试统计信息 - 支持 Redis 会话"""
     print(f"DEBUG: /api/exam-statistics 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
-    
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
     
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问考试统计API，用户: {user_account}")
     conn = None
     try:
         conn = connect_db()
+        # 读取教师名下全部学生和考试（优先使用快照缓存）
+        snapshot = get_teacher_snapshot(conn, user_account)
         
         # 获取所有班级
-        classes = read_class(conn, user_account)
+        classes = snapshot.classes
         
         if not classes:
             return jsonify({
@@ -2734,13 +2245,13 @@ def get_exam_statistics():
         passed_students = 0  # 假设是基于学生平均分的及格率
         
         for class_name in classes:
-            students = read_single_class(conn, user_account, class_name)
+            students = snapshot.class_students(class_name)
             total_students += len(students) if students else 0
             
             if students:
                 for student in students:
                     student_id = student["账号"]
-                    student_exams = read_student_exam(conn, student_id)
+                    student_exams = snapshot.exams_of(student_id)
                     exam_count = max(exam_count, len(student_exams))
                     
                     # 计算学生平均分
@@ -2782,62 +2293,27 @@ def get_exam_statistics():
 
 
 @app.route('/api/exam-groups', methods=['GET'])
+@require_user()
 def get_exam_groups():
     """获取考试分组信息 - 支持 Redis 会话"""
     print(f"DEBUG: /api/exam-groups 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
-    
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
     
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
-
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问考试分组API，用户: {user_account}")
     conn = None
     try:
         conn = connect_db()
         
-        # 获取教师的分组信息
-        grouped_exams = read_teacher_group(conn, user_account)
-        ungrouped_exams = not_group_exam(conn, user_account)
+        # 分组来自按教师缓存的分组表，考试列表来自考试登记表，不读取学生表
+        teacher_groups = get_teacher_groups(conn, user_account)
+        grouped = teacher_groups.grouped_exams()
+        ungrouped_exams = [exam_name for exam_name in read_exam_names(conn, user_account) if exam_name not in grouped]
         
         # 构建分组列表，包括"未分组"选项
         groups = [{"name": "未分组", "exams": ungrouped_exams}]
         
-        for group_name, exam_list in grouped_exams.items():
+        for group_name, exam_list in teacher_groups.groups.items():
             groups.append({
                 "name": group_name,
                 "exams": exam_list
@@ -2860,15 +2336,10 @@ def get_exam_groups():
 
 
 @app.route('/api/change-student-class', methods=['POST'])
+@require_user()
 def change_student_class():
-    """更改学生班级"""
-    if 'user_account' not in session:
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
-    
-    user_account = session['user_account']
+    """更改学生班级 - 支持 Redis 会话"""
+    user_account = g.user_account
     conn = None
     try:
         conn = connect_db()
@@ -2907,19 +2378,13 @@ def change_student_class():
 
 
 @app.route('/api/update-student-score', methods=['POST'])
+@require_user()
 def update_student_score_api():
-    """更新学生成绩"""
-    if 'user_account' not in session:
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
-    
-    user_account = session['user_account']
+    """更新学生成绩（只能修改本教师名下学生已有的考试科目，与批量保存共用同一写入路径）"""
+    user_account = g.user_account
     conn = None
     try:
-        conn = connect_db()
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         student_account = data.get('student_account')
         exam_name = data.get('exam_name')
         subject = data.get('subject')
@@ -2931,20 +2396,20 @@ def update_student_score_api():
                 'message': '学生账号、考试名称、科目和分数不能为空'
             }), 400
         
-        # 读取当前学生成绩数据
-        current_score_dict = read_student_exam(conn, student_account)
-        
-        # 修改指定科目的成绩
-        updated_score_dict = change_student_score(current_score_dict, exam_name, subject, new_score)
-        
-        # 更新数据库中的成绩
-        success = update_student_score(conn, student_account, updated_score_dict)
+        # 锁住学生行后只写入修改的这一格；学生不属于当前教师时返回错误
+        conn = connect_db()
+        result = apply_score_edits(conn, user_account, [(student_account, exam_name, subject, new_score)])
         
-        if success:
+        if result['success']:
             return jsonify({
                 'success': True,
                 'message': '成绩修改成功'
             })
+        elif result['errors']:
+            return jsonify({
+                'success': False,
+                'message': f"成绩修改失败: {result['errors'][0]['message']}"
+            }), 400
         else:
             return jsonify({
                 'success': False,
@@ -2961,20 +2426,131 @@ def update_student_score_api():
             conn.close()
 
 
+@app.route('/api/scores/batch', methods=['POST'])
+@require_user()
+def save_scores_batch():
+    """
+    批量保存成绩（一个事务，每个学生读写一次） - 支持 Redis 会话
+
+    请求 JSON:
+    edits: [{"studentAccount", "examName", "subject", "score"}, ...]
+    examName: 默认考试名称（edits 中没有填写时使用，可选）
+    className: 只允许修改该班级的学生（可选）
+
+    返回修改后涉及的学生考试总分；任何一格无效时整批不保存并返回 errors
+    """
+    user_account = g.user_account
+    
+    data = request.get_json(silent=True) or {}
+    default_exam = data.get('examName') or data.get('exam_name')
+    class_name = data.get('className') or None
+    edits = []
+    for index, item in enumerate(data.get('edits') or []):
+        if not isinstance(item, dict):
+            return jsonify({
+                'success': False,
+                'message': f'第 {index + 1} 个成绩格式不正确'
+            }), 400
+        student_account = item.get('studentAccount') or item.get('student_account')
+        exam_name = item.get('examName') or item.get('exam_name') or default_exam
+        subject = item.get('subject')
+        score = item.get('score', item.get('new_score'))
+        if not student_account or not exam_name or not subject or score is None:
+            return jsonify({
+                'success': False,
+                'message': f'第 {index + 1} 个成绩缺少学生账号、考试名称、科目或分数'
+            }), 400
+        edits.append((student_account, exam_name, subject, score))
+    
+    if not edits:
+        return jsonify({
+            'success': False,
+            'message': '没有需要保存的成绩'
+        }), 400
+    if len(edits) > MAX_SCORE_EDITS:
+        return jsonify({
+            'success': False,
+            'message': f'一次最多保存 {MAX_SCORE_EDITS} 个成绩'
+        }), 400
+    
+    conn = None
+    try:
+        conn = connect_db()
+        result = apply_score_edits(conn, user_account, edits, class_name)
+        if not result['success']:
+            return jsonify({
+                'success': False,
+                'message': result.get('message', '成绩保存失败'),
+                'errors': result['errors']
+            }), 400 if result['errors'] else 500
+        return jsonify({
+            'success': True,
+            'updated': result['updated'],
+            'unchanged': result['unchanged'],
+            'students': result['students'],
+            'totals': result['totals'],
+            'elapsedMs': result['elapsed_ms']
+        })
+    except Exception as e:
+        print(f'批量保存成绩时出现错误: {str(e)}')
+        return jsonify({
+            'success': False,
+            'message': f'批量保存成绩时出现错误: {str(e)}'
+        }), 500
+    finally:
+        if conn:
+            conn.close()
+
+
 
 
 def connect_db(database='smsf'):
-    """连接到指定数据库，默认连接smsf数据库"""
-    config = MYSQL_CONFIG.copy()
-    config['database'] = database
+    """连接到指定数据库，默认连接smsf数据库（从连接池借出）"""
     try:
-        conn = pymysql.connect(**config)
+        conn = pool_connect(database, MYSQL_CONFIG)
         return conn
     except Exception as e:
         print(f"数据库连接失败: {e}")
         raise e
 
-def read_student_score(conn, student_account):
+# scores 数据库（/api/scores 使用）的成绩读写
+# 函数名与 ALL_function 中的 change_student_score / update_student_score 区分，避免与学生考试数据的写入混淆
+SCORES_DB_KEY = 'uk_account_exam_subject'
+_scores_db_ready = False
+
+
+def ensure_scores_db_schema(conn):
+    """确保 scores 表存在且有 (account, exam_name, subject) 唯一键（每个进程检查一次）"""
+    global _scores_db_ready
+    if _scores_db_ready:
+        return
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS `scores` (
+            `id`         BIGINT AUTO_INCREMENT,
+            `account`    VARCHAR(255) NOT NULL,
+            `exam_name`  VARCHAR(255) NOT NULL,
+            `subject`    VARCHAR(255) NOT NULL,
+            `score`      VARCHAR(64),
+            PRIMARY KEY (`id`),
+            UNIQUE KEY `{SCORES_DB_KEY}` (`account`, `exam_name`, `subject`)
+        )
+    ''')
+    cursor.execute('SHOW INDEX FROM `scores` WHERE `Key_name` = %s', (SCORES_DB_KEY,))
+    if not cursor.fetchall():
+        try:
+            cursor.execute(f'''
+                ALTER TABLE `scores` ADD UNIQUE KEY `{SCORES_DB_KEY}` (`account`, `exam_name`, `subject`)
+            ''')
+            print("✅ scores 表已添加 (account, exam_name, subject) 唯一键")
+        except Exception as e:
+            print(f"❌ scores 表添加唯一键失败（可能存在重复的成绩行，请先清理）: {e}")
+            raise
+    conn.commit()
+    _scores_db_ready = True
+
+
+def read_scores_db(conn, student_account):
     """读取指定学生的成绩"""
     try:
         cursor = conn.cursor()
@@ -2995,31 +2571,33 @@ def read_student_score(conn, student_account):
         print(f"读取成绩时发生错误: {e}")
         return {}
 
-def change_student_score(current_score_dict, exam_name, subject, new_score):
-    """修改指定考试和科目的成绩"""
-    if exam_name not in current_score_dict:
-        current_score_dict[exam_name] = {}
-    current_score_dict[exam_name][subject] = new_score
-    return current_score_dict
 
-def update_student_score(conn, student_account, updated_score_dict):
-    """更新数据库中的成绩"""
+def upsert_scores_db(conn, student_account, cells):
+    """
+    写入学生的若干个成绩格（只写修改的格，一次 executemany）
+
+    参数:
+    cells: [(考试名称, 科目, 分数), ...]
+
+    返回:
+    bool: 写入是否成功
+    """
     try:
+        ensure_scores_db_schema(conn)
         cursor = conn.cursor()
-        cursor.execute('''
-            DELETE FROM `scores`
-            WHERE `account` = %s
-        ''', (student_account,))
-        for exam_name, subjects in updated_score_dict.items():
-            for subject, score in subjects.items():
-                cursor.execute('''
-                    INSERT INTO `scores` (`account`, `exam_name`, `subject`, `score`)
-                    VALUES (%s, %s, %s, %s)
-                ''', (student_account, exam_name, subject, score))
+        cursor.executemany('''
+            INSERT INTO `scores` (`account`, `exam_name`, `subject`, `score`)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE `score` = VALUES(`score`)
+        ''', [(student_account, exam_name, subject, score) for exam_name, subject, score in cells])
         conn.commit()
         return True
     except Exception as e:
         print(f"更新成绩时发生错误: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
         return False
 
 # 使用 ALL_function.py 中定义的 read_study_resources 和 read_all_subjects 函数
@@ -3057,7 +2635,7 @@ def get_scores():
         conn = connect_db('scores')
         
         # 读取成绩
-        score_dict = read_student_score(conn, student_account)
+        score_dict = read_scores_db(conn, student_account)
         
         return jsonify({
             'success': True,
@@ -3076,24 +2654,31 @@ def get_scores():
 
 @app.route('/api/scores', methods=['POST'])
 def update_scores():
-    """更新成绩数据"""
+    """
+    更新成绩数据
+
+    表单字段 exam_name / subject / score 修改一个成绩；
+    也可以提交 JSON {"scores": [{"exam_name", "subject", "score"}, ...]} 一次修改多个成绩
+    """
     student_account = request.args.get('account')
-    exam_name = request.form.get('exam_name')
-    subject = request.form.get('subject')
-    new_score = request.form.get('score')
+    data = request.get_json(silent=True) if request.is_json else None
+    if data and isinstance(data.get('scores'), list):
+        cells = [(item.get('exam_name'), item.get('subject'), item.get('score'))
+                 for item in data['scores'] if isinstance(item, dict)]
+    else:
+        cells = [(request.form.get('exam_name'), request.form.get('subject'), request.form.get('score'))]
+    if not student_account or not cells or any(not exam_name or not subject for exam_name, subject, _ in cells):
+        return jsonify({
+            'success': False,
+            'message': '学生账号、考试名称和科目不能为空'
+        }), 400
     conn = None
     try:
         # 连接到scores数据库
         conn = connect_db('scores')
         
-        # 读取当前成绩
-        current_score_dict = read_student_score(conn, student_account)
-        
-        # 修改指定考试和科目的成绩
-        updated_score_dict = change_student_score(current_score_dict, exam_name, subject, new_score)
-        
-        # 更新数据库
-        result = update_student_score(conn, student_account, updated_score_dict)
+        # 按 (account, exam_name, subject) 唯一键只写入修改的成绩格
+        result = upsert_scores_db(conn, student_account, cells)
         
         if result:
             return jsonify({
@@ -3167,48 +2752,12 @@ def get_study_resources():
             conn.close()
 
 @app.route('/api/student-info', methods=['GET'])
+@require_user()
 def get_student_info():
     """获取学生信息 - 从free_account表中读取"""
     print(f"DEBUG: /api/student-info 被调用")
-    print(f"DEBUG: 请求 Headers: {dict(request.headers)}")
-    print(f"DEBUG: 请求 Cookies: {request.cookies}")
-    
-    # 检查用户是否已登录（支持 Redis 和 Flask session）
-    user_account = None
-    
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        print(f"DEBUG: 从 Cookie 获取 session_id: {session_id}")
-        if session_id:
-            session_data = get_user_session(session_id)
-            print(f"DEBUG: Redis 会话数据: {session_data}")
-            if session_data:
-                user_account = session_data['user_account']
-                # 延长会话有效期
-                extend_user_session(session_id, 24)
-                print(f"DEBUG: Redis 验证通过，用户: {user_account}")
-            else:
-                print(f"DEBUG: Redis 会话不存在或已过期")
-        else:
-            print(f"DEBUG: 未找到 session_id Cookie")
-    else:
-        print(f"DEBUG: Redis 不可用或未启用")
-
-    # 如果 Redis 不可用或没有找到会话，则检查 Flask session
-    if not user_account and 'user_account' in session:
-        user_account = session['user_account']
-        print(f"DEBUG: 使用 Flask session，用户: {user_account}")
-    else:
-        print(f"DEBUG: Flask session 中未找到 user_account")
     
-    # 如果都没有找到有效的会话，返回未授权
-    if not user_account:
-        print(f"DEBUG: 未找到有效会话，返回 401")
-        return jsonify({
-            'success': False,
-            'message': '用户未登录'
-        }), 401
+    user_account = g.user_account
     
     print(f"DEBUG: 允许访问学生信息API，用户: {user_account}")
     conn = None
@@ -4010,19 +3559,7 @@ def search_vocabulary():
 
 def get_current_user_account():
     """获取当前登录用户的账户名"""
-    # 首先检查 Redis 会话
-    if REDIS_ENABLED and redis_session_manager.is_connected():
-        session_id = request.cookies.get('session_id')
-        if session_id:
-            session_data = get_user_session(session_id)
-            if session_data:
-                return session_data['user_account']
-    
-    # 检查 Flask session
-    if 'user_account' in session:
-        return session['user_account']
-    
-    return None
+    return resolve_current_user()
 
 @app.route('/api/english-passage/<int:passage_id>/paragraph-translation', methods=['POST'])
 def get_paragraph_translation(passage_id):
@@ -4106,11 +3643,8 @@ def get_versions():
     conn = None
     try:
         # 尝试连接到version_base数据库
-        version_db_config = MYSQL_CONFIG.copy()
-        version_db_config['database'] = 'version_base'
-        
         try:
-            conn = pymysql.connect(**version_db_config)
+            conn = pool_connect('version_base', MYSQL_CONFIG)
             cursor = conn.cursor()
             
             # 查询vers表中的版本信息（适应实际表结构）
@@ -4177,12 +3711,9 @@ def download_file(version_id):
         print(f"开始处理版本 {version_id} 的下载请求")
 
         # 连接到version_base数据库获取文件路径
-        version_db_config = MYSQL_CONFIG.copy()
-        version_db_config['database'] = 'version_base'
-
         try:
             print("尝试连接数据库...")
-            conn = pymysql.connect(**version_db_config)
+            conn = pool_connect('version_base', MYSQL_CONFIG)
             cursor = conn.cursor()
 
             cursor.execute('''
@@ -4517,6 +4048,11 @@ if __name__ == '__main__':
                 else:
                     print(f"复制HTML文件时出错: {e}")
         
+        # 调试模式下由重新加载器启动的子进程运行后台导入线程和会话清理线程
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_import_workers()
+            start_session_sweeper()
+        
         print("服务器启动中...")
         print("访问 http://localhost:5000 开始使用系统")
         app.run(debug=True, host='0.0.0.0', port=5000)